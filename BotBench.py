@@ -0,0 +1,311 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+''' Benchmark the bot's hot paths against synthetic corpora, entirely offline.
+
+   For each corpus size we generate that many .lyric files (and a history file
+   where about 'fill' of the songs are still cooling down) in a scratch
+   directory, then time:
+   - compiling the lyric index
+   - TmBot.GetLyric() and TrimTweetToFit()
+   - loading the history with JsonSettings, and writing it (full & journaled)
+   - TmBot.Log()
+   - a complete cron-style run (TmBot() + Run()) against a stub Twython that
+     hands back a page of mentions and accepts every update & favorite.
+
+   We also time running tmbotg.py as a new process when its tick snapshot
+   says there's nothing to do (see botTick.py), which is what nearly every
+   cron run looks like, and compare that to botTick.kIdleTickTargetMs.
+
+   Everything is seeded, so the same arguments generate the same corpus. The
+   results are written as json (with the git commit they came from) so runs
+   from different commits can be compared.
+
+      python BotBench.py [--sizes 100,1000,10000,100000] [--repeat N]
+         [--fill 0.5] [--seed N] [--out bench.json] [--workDir DIR]
+         [--idleRuns N]
+'''
+
+from datetime import date
+from datetime import datetime
+from time import time
+
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from apiClient import RateLimitedClient
+from jsonSettings import JsonSettings as Settings
+from lyricIndex import ParseFilename
+
+import botTick
+import cooldown
+import lyricIndex
+import tmbotg
+
+kSizes = (100, 1000, 10000, 100000)
+kWords = ("love", "truth", "particle", "man", "istanbul", "birdhouse", "ana",
+   "dead", "letter", "number", "moon", "museum", "kiss", "sapphire", "bullet",
+   "whistling", "dog", "road", "another", "first", "kid", "gene", "wicked",
+   "little", "doll", "snail", "shell", "ant", "yes", "why", "does", "the",
+   "sun", "shine", "hot", "cha", "triangle", "nightgown", "robot", "parade")
+kAlbumsPerCorpus = 20
+kMentions = 20
+
+
+def RandomLine(rng):
+   return " ".join(rng.choice(kWords) for i in range(rng.randint(1, 12)))
+
+
+def GenerateCorpus(corpusDir, numFiles, rng):
+   ''' write numFiles lyric files named the way GetLyrics.py names them. '''
+   os.makedirs(corpusDir)
+   for i in range(numFiles):
+      album = "Album-{0}".format(i % kAlbumsPerCorpus)
+      title = "Track-{0}".format(i)
+      stanzas = []
+      for s in range(rng.randint(2, 8)):
+         stanzas.append("\n".join(RandomLine(rng) for j in range(rng.randint(1, 8))))
+      with open(os.path.join(corpusDir, "{0}_{1}.lyric".format(album, title)), "wt") as f:
+         f.write("\n\n".join(stanzas))
+
+
+def GenerateHistory(historyPath, corpusDir, fill, minimumDaySpacing, rng):
+   ''' mark about 'fill' of the songs as used recently enough that they're still
+      cooling down, and most of the rest as used a while ago.
+   '''
+   today = date.today().toordinal()
+   history = {}
+   for fName in os.listdir(corpusDir):
+      key = cooldown.HistoryKey(*ParseFilename(fName))
+      if rng.random() < fill:
+         history[key] = today - rng.randint(0, minimumDaySpacing)
+      elif rng.random() < 0.8:
+         history[key] = today - rng.randint(minimumDaySpacing + 1, 10 * minimumDaySpacing)
+   with open(historyPath, "wt") as f:
+      json.dump(history, f)
+
+
+class StubTwython(object):
+   ''' just enough of the Twython interface for a cron run of the bot. '''
+   def __init__(self, rng):
+      self.mentions = []
+      for i in range(kMentions, 0, -1):
+         text = "@tmbotg " + RandomLine(rng)
+         if 0 == i % 4:
+            text += "?"
+         self.mentions.append({"id_str": str(1000 + i), "text": text,
+            "user": {"screen_name": "fan{0}".format(i)}})
+      self.updates = 0
+      self.favorites = 0
+
+   def get_mentions_timeline(self, count, since_id=None, max_id=None):
+      page = [m for m in self.mentions
+         if (since_id is None or int(m["id_str"]) > int(since_id)) and
+            (max_id is None or int(m["id_str"]) <= int(max_id))]
+      return page[:count]
+
+   def update_status(self, **kwargs):
+      self.updates += 1
+      return {}
+
+   def create_favorite(self, **kwargs):
+      self.favorites += 1
+      return {}
+
+   def get_lastfunction_header(self, header):
+      return None
+
+
+def MakeBot(botDir, stub):
+   bot = tmbotg.TmBot({"debug": False, "force": True, "stream": False,
+      "daemon": False, "replay": None, "botPath": botDir})
+   bot.api = RateLimitedClient(lambda: stub, bot.settings, stats=bot.stats)
+   return bot
+
+
+def Time(func, repeat):
+   ''' call func() 'repeat' times & return the mean ms per call. '''
+   start = time()
+   for i in range(repeat):
+      func()
+   return (time() - start) * 1000.0 / repeat
+
+
+def BenchSize(workDir, numFiles, repeat, fill, rng):
+   botDir = os.path.join(workDir, str(numFiles))
+   corpusDir = os.path.join(botDir, "corpus")
+   GenerateCorpus(corpusDir, numFiles, rng)
+   config = dict(tmbotg.kDefaultConfigDict)
+   config.update({"lyricFilePath": "corpus/*.lyric", "logFilePath": "bench-%Y-%m.txt"})
+   with open(os.path.join(botDir, "tmbotg.json"), "wt") as f:
+      json.dump(config, f)
+   historyPath = os.path.join(botDir, "tmbotg_history.json")
+   GenerateHistory(historyPath, corpusDir, fill, config["minimumDaySpacing"], rng)
+
+   results = {}
+   indexPath = os.path.join(botDir, "lyrics.idx")
+   start = time()
+   lyricIndex.CompileCorpus(os.path.join(corpusDir, "*.lyric"), indexPath)
+   results["CompileCorpus"] = (time() - start) * 1000.0
+
+   stub = StubTwython(rng)
+   bot = MakeBot(botDir, stub)
+   index = bot.GetIndex()
+   eligible = bot.EligibleCount()[0]
+   results["eligible"] = eligible
+
+   # every successful GetLyric() uses up a song, so don't ask for more than we have.
+   lyricCalls = max(1, min(repeat, eligible))
+   results["GetLyric"] = Time(lambda: bot.GetLyric(rng.choice([40, 80, 120, 210])),
+      lyricCalls)
+
+   stanzas = [index.Lines(rng.randrange(index.numStanzas)) for i in range(repeat)]
+   results["TrimTweetToFit"] = Time(
+      lambda: tmbotg.TrimTweetToFit(rng.choice(stanzas), rng.choice([40, 80, 120, 210])),
+      repeat)
+
+   results["Log"] = Time(lambda: bot.Log("Bench", ["Album", "Track", "1", "2"]), repeat)
+   start = time()
+   bot.eventLog.Flush()
+   results["LogFlush"] = (time() - start) * 1000.0
+
+   results["JsonSettings load"] = Time(lambda: Settings(historyPath, journal=True),
+      max(1, repeat // 10))
+   history = Settings(historyPath, journal=True)
+   results["JsonSettings WriteFile"] = Time(history.WriteFile, max(1, repeat // 10))
+
+   def WriteOne():
+      history[cooldown.HistoryKey(*index.Track(rng.randrange(index.numTracks)))] = \
+         date.today().toordinal()
+      history.Write()
+   results["JsonSettings Write (journal)"] = Time(WriteOne, repeat)
+   history.Compact()
+
+   def CronRun():
+      runBot = MakeBot(botDir, stub)
+      runBot.settings.lastMentionId = None
+      runBot.Run()
+   results["Run"] = Time(CronRun, max(1, repeat // 10))
+   results["updatesSent"] = stub.updates
+   results["favoritesSent"] = stub.favorites
+   return results
+
+
+def BenchIdleTick(workDir, runs):
+   ''' return the median ms for tmbotg.py to start up, find that it has
+      nothing to do, and exit.
+   '''
+   botDir = os.path.join(workDir, "idle")
+   os.makedirs(botDir)
+   config = dict(tmbotg.kDefaultConfigDict)
+   # if the run isn't idle after all, don't let it reach the real Twitter.
+   config["apiUrl"] = "http://127.0.0.1:9/"
+   with open(os.path.join(botDir, "tmbotg.json"), "wt") as f:
+      json.dump(config, f)
+   now = int(time())
+   botTick.WriteTick(os.path.join(botDir, botTick.kTickFile), {
+      "lastUpdate": now, "tweetProbability": 0, "minimumSpacing": 3600,
+      "maximumSpacing": 4 * 3600, "nextMentionPoll": now + 3600,
+      "eventQueuePath": os.path.join(botDir, "events.db"), "eventQueueEmpty": True,
+      "eventQueueChanged": 0, "outboxPending": False, "deferredCalls": False})
+   # make sure the snapshot is newer than the settings.
+   os.utime(os.path.join(botDir, "tmbotg.json"), (now - 10, now - 10))
+
+   # the bot finds its files next to tmbotg.py, and a cron run has no arguments.
+   script = os.path.join(botDir, "tmbotg.py")
+   os.symlink(os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmbotg.py"),
+      script)
+   times = []
+   for i in range(runs):
+      start = time()
+      subprocess.check_call([sys.executable, script])
+      times.append((time() - start) * 1000.0)
+   if os.path.exists(os.path.join(botDir, "tmbotg_history.json")):
+      print "WARNING: the idle tick ran the whole bot."
+   return sorted(times)[len(times) // 2]
+
+
+def GitCommit():
+   try:
+      return subprocess.check_output(["git", "rev-parse", "HEAD"],
+         cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+   except (OSError, subprocess.CalledProcessError):
+      return None
+
+
+def Bench(sizes, repeat, fill, seed, workDir=None, idleRuns=20):
+   rng = random.Random(seed)
+   # the bot itself uses the module-level random functions.
+   random.seed(seed)
+   ownDir = workDir is None
+   if ownDir:
+      workDir = tempfile.mkdtemp(prefix="botbench")
+   report = {"commit": GitCommit(), "date": str(datetime.now()),
+      "python": platform.python_version(), "platform": platform.platform(),
+      "repeat": repeat, "fill": fill, "seed": seed, "sizes": {}}
+   try:
+      if idleRuns:
+         report["idleTickMs"] = BenchIdleTick(workDir, idleRuns)
+         report["idleTickTargetMs"] = botTick.kIdleTickTargetMs
+         print "idle tick: {0:.1f} ms (target {1} ms)".format(report["idleTickMs"],
+            botTick.kIdleTickTargetMs)
+      for numFiles in sizes:
+         results = BenchSize(workDir, numFiles, repeat, fill, rng)
+         report["sizes"][str(numFiles)] = results
+         print "{0} files:".format(numFiles)
+         for name in sorted(results):
+            print "   {0:<30} {1:>12.3f}".format(name, results[name])
+   finally:
+      if ownDir:
+         shutil.rmtree(workDir)
+   return report
+
+
+if __name__ == "__main__":
+   import argparse
+   parser = argparse.ArgumentParser()
+   parser.add_argument("--sizes", default=",".join(str(s) for s in kSizes),
+      help="comma-separated list of corpus sizes (number of lyric files)")
+   parser.add_argument("--repeat", type=int, default=200,
+      help="number of calls to time for each operation")
+   parser.add_argument("--fill", type=float, default=0.5,
+      help="fraction of songs in the history that are still cooling down")
+   parser.add_argument("--seed", type=int, default=1,
+      help="random seed used to generate the corpus")
+   parser.add_argument("--out", default="bench.json",
+      help="file to write the json results to")
+   parser.add_argument("--idleRuns", type=int, default=20,
+      help="number of idle cron runs to time (0 to skip)")
+   parser.add_argument("--workDir", default=None,
+      help="directory to generate the corpora in (default: a temp dir that's removed afterwards)")
+   args = parser.parse_args()
+
+   report = Bench([int(s) for s in args.sizes.split(",")], args.repeat, args.fill,
+      args.seed, args.workDir, args.idleRuns)
+   with open(args.out, "wt") as f:
+      json.dump(report, f, indent=2, sort_keys=True)
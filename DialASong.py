@@ -27,11 +27,20 @@
    Because I'll be using this by hand as the songs are released, I'm not expending
    much effort with try/except blocks, etc. If I mistype something at the command line,
    I'll figure things out then
+
+   The track is added to the same crawl frontier that GetLyrics.py uses, so if
+   fetching it fails it's retried like any other page (and if a GetLyrics.py
+   crawl was interrupted, the rest of that crawl is finished too.)
 '''
 
+from os.path import join
 import sys
 import urllib
-from GetLyrics import ProcessTrack
+
+from crawlFrontier import Frontier
+from GetLyrics import Crawl
+from GetLyrics import kFrontierFile
+from GetLyrics import kOutputDir
 
 kAlbum = "Dial a Song"
 kUrlTemplate = "http://tmbw.net/wiki/Lyrics:{0}"
@@ -45,4 +54,9 @@ def Scrub(s):
 if __name__ == "__main__":
    title = sys.argv[1]
    url = kUrlTemplate.format(title)
-   ProcessTrack(kAlbum, title, url)
+   frontier = Frontier(join(kOutputDir, kFrontierFile))
+   frontier.Add(url, "track", kAlbum, title, again=True)
+   try:
+      Crawl(frontier)
+   finally:
+      frontier.Close()
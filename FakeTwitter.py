@@ -0,0 +1,594 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+''' A local stand-in for the parts of the Twitter API that the bot uses, and a
+   load test that runs the bot against it.
+
+   The server answers:
+   - GET  /1.1/statuses/mentions_timeline.json (count, since_id & max_id)
+   - POST /1.1/statuses/update.json
+   - POST /1.1/favorites/create.json
+   - GET  /1.1/user.json -- the user stream. Each quote event is written as a
+     line of json as soon as it's added, with a keep-alive newline every
+     kKeepAlive seconds when there's nothing to send.
+   - GET  /stats -- json counts of everything the server has seen.
+
+   Every REST request can be slowed down (--latency seconds, give or take
+   half), fail with a 503 (--errorRate of them), and be limited to --rateLimit
+   calls per endpoint every --window seconds, after which we answer 429 until
+   the window resets, just like Twitter does. Posting the same status twice or
+   favoriting the same tweet twice fails the way it does on Twitter, too.
+
+   To try a bot against it by hand, start the server with some mentions &
+   quote events and add these to the bot's tmbotg.json:
+
+      "apiUrl": "http://127.0.0.1:8088/%s",
+      "streamUrl": "http://127.0.0.1:8088/1.1/user.json"
+
+      python FakeTwitter.py [--port 8088] [--mentions N] [--questions 0.25]
+         [--quotes N] [--latency S] [--errorRate F] [--rateLimit N] [--window S]
+
+   With --load, we instead generate a corpus and a bot in a scratch directory
+   (as BotBench.py does), stream the quote events to a BotStreamer connected to
+   the fake user stream, and then do cron runs of the bot until there's nothing
+   left for it to do, reporting how long each run took and how many mentions it
+   got through -- and how many mentions were never seen at all. While the bot
+   is rate limited, we wait for the limit to reset between runs, so with a
+   small --window the test also shows how the bot catches up afterwards.
+
+   Use --perRun to have that many more mentions arrive before each run.
+
+      python FakeTwitter.py --load [--corpus 1000] [--mentions 5000]
+         [--perRun N] [--quotes 1000] [--runs 20] [--out load.json]
+         [--workDir DIR] ...
+'''
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+from datetime import datetime
+from time import sleep
+from time import time
+from urlparse import parse_qs
+from urlparse import urlparse
+
+import json
+import os
+import Queue
+import random
+import shutil
+import socket
+import tempfile
+import threading
+
+from BotBench import GenerateCorpus
+from BotBench import GitCommit
+from BotBench import RandomLine
+
+import botTick
+import tmbotg
+
+kPort = 8088
+kScreenName = "tmbotg"
+
+# Twitter only lets us page back through this many of our mentions, and
+# returns at most kMaxCount tweets at a time.
+kMaxTimeline = 800
+kMaxCount = 200
+
+# seconds between keep-alive newlines on the user stream.
+kKeepAlive = 1.0
+
+# how long (seconds) the load test waits for the streamer to handle every
+# quote event.
+kStreamTimeout = 60
+
+kFirstId = 700000000000000000
+
+kRoutes = {
+   ("GET", "/1.1/statuses/mentions_timeline.json"): "Mentions",
+   ("POST", "/1.1/statuses/update.json"): "Update",
+   ("POST", "/1.1/favorites/create.json"): "Favorite",
+   ("GET", "/1.1/user.json"): "Stream",
+   ("GET", "/stats"): "Stats",
+}
+
+
+class FakeError(Exception):
+   ''' an error response: the HTTP status, Twitter's error code & message. '''
+   def __init__(self, status, code, msg):
+      self.status = status
+      self.code = code
+      self.msg = msg
+
+   def __str__(self):
+      return self.msg
+
+
+class FakeTwitter(object):
+   '''
+      Everything the fake server knows: the mentions & quote events waiting for
+      the bot, what the bot has posted & favorited, how badly to behave, and
+      counts of every request.
+   '''
+   def __init__(self, latency=0, errorRate=0, rateLimit=None, window=15*60,
+      seed=None):
+      self.latency = latency
+      self.errorRate = errorRate
+      self.rateLimit = rateLimit
+      self.window = window
+      self.lock = threading.Lock()
+      self.rng = random.Random(seed)
+      self.lastId = kFirstId
+      # oldest first.
+      self.mentions = []
+      self.quotes = Queue.Queue()
+      self.statuses = set()
+      self.favorites = set()
+      # endpoint -> (calls, reset)
+      self.limits = {}
+      self.counts = {}
+      self.stopping = False
+
+   def NewId(self):
+      ''' (call with the lock held) tweet ids only ever go up. '''
+      self.lastId += self.rng.randint(1, 1000)
+      return str(self.lastId)
+
+   def Count(self, name, amount=1):
+      with self.lock:
+         self.counts[name] = self.counts.get(name, 0) + amount
+
+   def Stats(self, params=None):
+      with self.lock:
+         stats = dict(self.counts)
+         stats["mentionsWaiting"] = len(self.mentions)
+         stats["quotesWaiting"] = self.quotes.qsize()
+      return stats
+
+   def AddMentions(self, numMentions, questions=0.25):
+      ''' add numMentions new mentions of us, about 'questions' of which are
+         questions.
+      '''
+      with self.lock:
+         for i in range(numMentions):
+            text = u"@{0} {1}".format(kScreenName, RandomLine(self.rng))
+            if self.rng.random() < questions:
+               text += u"?"
+            self.mentions.append({"id_str": self.NewId(), "text": text,
+               "user": {"screen_name": "fan{0}".format(self.rng.randrange(100000))}})
+         self.counts["mentionsAdded"] = self.counts.get("mentionsAdded", 0) + numMentions
+
+   def AddQuotes(self, numQuotes):
+      ''' add numQuotes quote tweet events to be sent down the user stream. '''
+      with self.lock:
+         events = []
+         for i in range(numQuotes):
+            who = "fan{0}".format(self.rng.randrange(100000))
+            events.append({"event": "quoted_tweet", "source": {"screen_name": who},
+               "target_object": {"id_str": self.NewId(),
+                  "text": RandomLine(self.rng), "user": {"screen_name": who}}})
+      for event in events:
+         self.quotes.put(event)
+
+   def Delay(self):
+      if self.latency:
+         with self.lock:
+            delay = self.latency * (0.5 + self.rng.random())
+         sleep(delay)
+
+   def InjectError(self):
+      if not self.errorRate:
+         return False
+      with self.lock:
+         return self.rng.random() < self.errorRate
+
+   def Limit(self, endpoint):
+      ''' count a call to endpoint against its rate limit. Returns (allowed,
+         the x-rate-limit-* headers to send back.)
+      '''
+      if not self.rateLimit:
+         return (True, {})
+      now = time()
+      with self.lock:
+         calls, reset = self.limits.get(endpoint, (0, now + self.window))
+         if now >= reset:
+            calls, reset = 0, now + self.window
+         calls += 1
+         self.limits[endpoint] = (calls, reset)
+      headers = {"x-rate-limit-limit": str(self.rateLimit),
+         "x-rate-limit-remaining": str(max(0, self.rateLimit - calls)),
+         "x-rate-limit-reset": str(int(reset))}
+      return (calls <= self.rateLimit, headers)
+
+   def Mentions(self, params):
+      ''' the mentions newer than since_id & no newer than max_id, newest first. '''
+      count = min(int(params.get("count", 20)), kMaxCount)
+      sinceId = int(params.get("since_id", 0))
+      maxId = int(params["max_id"]) if "max_id" in params else None
+      with self.lock:
+         timeline = self.mentions[-kMaxTimeline:]
+      page = []
+      for mention in reversed(timeline):
+         tweetId = int(mention["id_str"])
+         if maxId is not None and tweetId > maxId:
+            continue
+         if tweetId <= sinceId or len(page) >= count:
+            break
+         page.append(mention)
+      self.Count("mentionsSent", len(page))
+      return page
+
+   def Update(self, params):
+      status = params.get("status", "")
+      with self.lock:
+         if status in self.statuses:
+            raise FakeError(403, 187, "Status is a duplicate.")
+         self.statuses.add(status)
+         tweetId = self.NewId()
+      if params.get("in_reply_to_status_id"):
+         self.Count("replies")
+      return {"id_str": tweetId, "text": status.decode("utf-8"),
+         "in_reply_to_status_id_str": params.get("in_reply_to_status_id")}
+
+   def Favorite(self, params):
+      tweetId = params.get("id")
+      with self.lock:
+         if tweetId in self.favorites:
+            raise FakeError(403, 139, "You have already favorited this status.")
+         self.favorites.add(tweetId)
+      return {"id_str": tweetId, "favorited": True}
+
+
+class Handler(BaseHTTPRequestHandler):
+   def log_message(self, format, *args):
+      if self.server.verbose:
+         BaseHTTPRequestHandler.log_message(self, format, *args)
+
+   # a client that hangs up on us (e.g. a streamer disconnecting) isn't an error.
+   def handle(self):
+      try:
+         BaseHTTPRequestHandler.handle(self)
+      except socket.error:
+         pass
+
+   def finish(self):
+      try:
+         BaseHTTPRequestHandler.finish(self)
+      except socket.error:
+         pass
+
+   def do_GET(self):
+      self.Handle("GET")
+
+   def do_POST(self):
+      self.Handle("POST")
+
+   def Reply(self, status, body, headers=None):
+      data = json.dumps(body)
+      self.send_response(status)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Content-Length", str(len(data)))
+      for name, value in (headers or {}).items():
+         self.send_header(name, value)
+      self.end_headers()
+      self.wfile.write(data)
+
+   def Error(self, e, headers=None):
+      self.Reply(e.status, {"errors": [{"code": e.code, "message": e.msg}]}, headers)
+
+   def Handle(self, method):
+      fake = self.server.fake
+      url = urlparse(self.path)
+      params = parse_qs(url.query)
+      if "POST" == method:
+         length = int(self.headers.getheader("Content-Length") or 0)
+         params.update(parse_qs(self.rfile.read(length)))
+      params = dict((name, values[0]) for name, values in params.items())
+
+      route = kRoutes.get((method, url.path))
+      if route is None:
+         fake.Count("notFound")
+         return self.Error(FakeError(404, 34, "Sorry, that page does not exist."))
+      if "Stream" == route:
+         return self.Stream()
+      if "Stats" == route:
+         return self.Reply(200, fake.Stats())
+
+      fake.Count(route)
+      fake.Delay()
+      if fake.InjectError():
+         fake.Count("errors")
+         return self.Error(FakeError(503, 130, "Over capacity"))
+      allowed, headers = fake.Limit(route)
+      if not allowed:
+         fake.Count("rateLimited")
+         return self.Error(FakeError(429, 88, "Rate limit exceeded"), headers)
+      try:
+         body = getattr(fake, route)(params)
+      except FakeError as e:
+         fake.Count("refused")
+         return self.Error(e, headers)
+      self.Reply(200, body, headers)
+
+   def Stream(self):
+      ''' send quote events down the user stream until the client hangs up or
+         the server is stopped.
+      '''
+      fake = self.server.fake
+      fake.Count("streamConnections")
+      self.send_response(200)
+      self.send_header("Content-Type", "application/json")
+      self.end_headers()
+      try:
+         while not fake.stopping:
+            try:
+               event = fake.quotes.get(timeout=kKeepAlive)
+            except Queue.Empty:
+               self.wfile.write("\r\n")
+            else:
+               self.wfile.write(json.dumps(event) + "\r\n")
+               fake.Count("streamEvents")
+            self.wfile.flush()
+      except socket.error:
+         self.close_connection = 1
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+   daemon_threads = True
+
+   def __init__(self, fake, port=kPort, verbose=False):
+      '''
+         fake: the FakeTwitter to serve.
+         port: port to listen on (on localhost); 0 picks a free one.
+      '''
+      HTTPServer.__init__(self, ("127.0.0.1", port), Handler)
+      self.fake = fake
+      self.verbose = verbose
+      self.thread = None
+
+   def Url(self):
+      return "http://127.0.0.1:{0}".format(self.server_address[1])
+
+   def Start(self):
+      ''' serve requests on a background thread. '''
+      self.thread = threading.Thread(target=self.serve_forever)
+      self.thread.daemon = True
+      self.thread.start()
+
+   def Stop(self):
+      self.fake.stopping = True
+      self.shutdown()
+      self.server_close()
+
+
+def MakeBotDir(botDir, server, corpusSize, rng):
+   ''' set up a bot in botDir with a generated corpus, talking to server. '''
+   GenerateCorpus(os.path.join(botDir, "corpus"), corpusSize, rng)
+   config = dict(tmbotg.kDefaultConfigDict)
+   config.update({"lyricFilePath": "corpus/*.lyric", "logFilePath": "load-%Y-%m.txt",
+      "apiUrl": server.Url() + "/%s", "streamUrl": server.Url() + "/1.1/user.json"})
+   with open(os.path.join(botDir, "tmbotg.json"), "wt") as f:
+      json.dump(config, f)
+   with open(os.path.join(botDir, "tmbotg_history.json"), "wt") as f:
+      json.dump({}, f)
+   # build the lyric & search indexes now so the first run isn't slower
+   # than the rest.
+   bot = MakeBot(botDir)
+   bot.GetIndex()
+   bot.GetSearch()
+   bot.settings.Write()
+
+
+def MakeBot(botDir, stream=False):
+   return tmbotg.TmBot({"debug": False, "force": False, "stream": stream,
+      "daemon": False, "replay": None, "botPath": botDir})
+
+
+def StreamQuotes(botDir, numQuotes):
+   ''' connect a BotStreamer to the fake user stream and time how long it takes
+      to get numQuotes quote events into the event queue.
+   '''
+   bot = MakeBot(botDir, stream=True)
+   streamer = bot.twitter
+   start = time()
+   t = threading.Thread(target=streamer.User)
+   t.daemon = True
+   t.start()
+   while streamer.handled + streamer.dropped < numQuotes:
+      if time() - start > kStreamTimeout or not t.is_alive():
+         print "WARNING: gave up waiting for the streamer."
+         break
+      sleep(0.01)
+   elapsed = time() - start
+   streamer.disconnect()
+   t.join()
+   streamer.Stop()
+   bot.settings.Write()
+   stats = streamer.Stats()
+   return {"seconds": elapsed, "events": stats["handled"], "dropped": stats["dropped"],
+      "eventsPerSecond": stats["handled"] / elapsed if elapsed else 0.0}
+
+
+def CronRun(botDir, fake):
+   ''' one cron-style run of the bot. Returns what it did, and how long it took. '''
+   before = fake.Stats()
+   start = time()
+   bot = MakeBot(botDir)
+   # every run of the load test checks for mentions.
+   bot.settings.lastMentionPoll = 0
+   bot.Run()
+   elapsed = time() - start
+   after = fake.Stats()
+   counters = bot.stats.AsDict()["counters"]
+   run = {"seconds": elapsed, "mentions": counters.get("mentions", 0),
+      "quotes": counters.get("quotes", 0)}
+   for name in ("Mentions", "Update", "Favorite", "replies", "errors",
+      "rateLimited", "refused"):
+      run[name] = after.get(name, 0) - before.get(name, 0)
+   run["mentionsPerSecond"] = run["mentions"] / elapsed if elapsed else 0.0
+   run["idle"] = IsIdle(botDir)
+   run["nextReset"] = NextReset(bot.settings.rateLimits)
+   return run
+
+
+def IsIdle(botDir):
+   ''' does the tick snapshot from the last run say that nothing's left
+      waiting (unsent tweets, API calls put off until later, queued events)?
+   '''
+   tick = botTick.ReadTick(os.path.join(botDir, botTick.kTickFile))
+   if tick is None:
+      return False
+   return not (tick["outboxPending"] or tick["deferredCalls"] or
+      not tick["eventQueueEmpty"])
+
+
+def NextReset(rateLimits):
+   ''' the earliest x-rate-limit-reset time of the endpoints that the bot has
+      run out of calls for (from its 'rateLimits' setting), or None.
+   '''
+   resets = [reset for remaining, reset in (rateLimits or {}).values()
+      if remaining is not None and remaining <= 0]
+   return min(resets) if resets else None
+
+
+def LoadTest(fake, corpusSize, numMentions, questions, numQuotes, maxRuns,
+   seed, workDir=None, perRun=0):
+   '''
+      numMentions: mentions waiting before the first run.
+      perRun: new mentions that arrive before each run.
+      maxRuns: the most cron runs to do. Without perRun, we stop as soon as a
+         run finds nothing to do and leaves nothing waiting. Between runs, we
+         sleep until the earliest rate limit reset that the bot is waiting on.
+   '''
+   rng = random.Random(seed)
+   # the bot itself uses the module-level random functions.
+   random.seed(seed)
+   ownDir = workDir is None
+   if ownDir:
+      workDir = tempfile.mkdtemp(prefix="faketwitter")
+   server = FakeServer(fake, 0)
+   server.Start()
+   report = {"commit": GitCommit(), "date": str(datetime.now()), "seed": seed,
+      "corpus": corpusSize, "mentions": numMentions, "questions": questions,
+      "perRun": perRun, "quotes": numQuotes, "latency": fake.latency, "errorRate": fake.errorRate,
+      "rateLimit": fake.rateLimit, "runs": []}
+   try:
+      botDir = os.path.join(workDir, "bot")
+      MakeBotDir(botDir, server, corpusSize, rng)
+
+      fake.AddQuotes(numQuotes)
+      report["stream"] = StreamQuotes(botDir, numQuotes)
+      print "stream: {events} events in {seconds:.2f} s ({eventsPerSecond:.0f}/s), " \
+         "{dropped} dropped".format(**report["stream"])
+
+      fake.AddMentions(numMentions, questions)
+      for i in range(maxRuns):
+         if perRun:
+            fake.AddMentions(perRun, questions)
+         run = CronRun(botDir, fake)
+         report["runs"].append(run)
+         print "run {0}: {seconds:.2f} s, {mentions} mentions ({mentionsPerSecond:.0f}/s), " \
+            "{quotes} quotes, {replies} replies, {Favorite} favorites, " \
+            "{errors} errors, {rateLimited} rate limited".format(i + 1, **run)
+         busy = run["mentions"] or run["quotes"] or run["Update"] or run["Favorite"]
+         if not perRun and run["idle"] and not busy:
+            break
+         if run["nextReset"] is not None and i + 1 < maxRuns:
+            # (the reset header is in whole seconds, so allow one more.)
+            wait = run["nextReset"] + 1 - time()
+            if wait > 0:
+               print "waiting {0:.0f} s for the rate limit to reset.".format(wait)
+               sleep(wait)
+   finally:
+      server.Stop()
+      if ownDir:
+         shutil.rmtree(workDir)
+
+   handled = sum(run["mentions"] for run in report["runs"])
+   added = fake.Stats().get("mentionsAdded", 0)
+   report["mentionsHandled"] = handled
+   report["mentionsMissed"] = added - handled
+   report["mostMentionsInARun"] = max([run["mentions"] for run in report["runs"]] or [0])
+   report["server"] = fake.Stats()
+   print "{0} of {1} mentions handled (at most {2} in one run), {3} never seen.".format(
+      handled, added, report["mostMentionsInARun"], report["mentionsMissed"])
+   return report
+
+
+if __name__ == "__main__":
+   import argparse
+   parser = argparse.ArgumentParser()
+   parser.add_argument("--port", type=int, default=kPort,
+      help="port to serve on (ignored with --load, which picks a free one)")
+   parser.add_argument("--mentions", type=int, default=None,
+      help="number of mentions to generate (default 0, or 5000 with --load)")
+   parser.add_argument("--questions", type=float, default=0.25,
+      help="fraction of the mentions that are questions")
+   parser.add_argument("--quotes", type=int, default=None,
+      help="number of quote events to send down the user stream (default 0, "
+         "or 1000 with --load)")
+   parser.add_argument("--latency", type=float, default=0,
+      help="average seconds to wait before answering each request")
+   parser.add_argument("--errorRate", type=float, default=0,
+      help="fraction of requests that fail with a 503")
+   parser.add_argument("--rateLimit", type=int, default=None,
+      help="calls allowed to each endpoint per window")
+   parser.add_argument("--window", type=int, default=15*60,
+      help="length (seconds) of a rate limit window")
+   parser.add_argument("--seed", type=int, default=1,
+      help="random seed")
+   parser.add_argument("--verbose", action="store_true",
+      help="log every request")
+   parser.add_argument("--load", action="store_true",
+      help="run the bot against the server & report how it did")
+   parser.add_argument("--corpus", type=int, default=1000,
+      help="(--load) number of lyric files to generate")
+   parser.add_argument("--perRun", type=int, default=0,
+      help="(--load) new mentions that arrive before each run")
+   parser.add_argument("--runs", type=int, default=20,
+      help="(--load) most cron runs to do")
+   parser.add_argument("--out", default=None,
+      help="(--load) file to write the json results to")
+   parser.add_argument("--workDir", default=None,
+      help="(--load) directory to generate the bot in (default: a temp dir that's removed afterwards)")
+   args = parser.parse_args()
+
+   fake = FakeTwitter(args.latency, args.errorRate, args.rateLimit, args.window,
+      args.seed)
+   if args.load:
+      report = LoadTest(fake, args.corpus,
+         5000 if args.mentions is None else args.mentions, args.questions,
+         1000 if args.quotes is None else args.quotes, args.runs, args.seed, args.workDir, args.perRun)
+      if args.out:
+         with open(args.out, "wt") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+   else:
+      fake.AddMentions(args.mentions or 0, args.questions)
+      fake.AddQuotes(args.quotes or 0)
+      server = FakeServer(fake, args.port, args.verbose)
+      print "Serving on {0} (Ctrl-C to stop)".format(server.Url())
+      try:
+         server.serve_forever()
+      except KeyboardInterrupt:
+         pass
+      print json.dumps(fake.Stats(), indent=2, sort_keys=True)
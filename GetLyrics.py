@@ -21,15 +21,83 @@
 # THE SOFTWARE.
 
 from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
+from random import random
+from time import sleep
+from time import time
 from urlparse import urljoin
+from urlparse import urlparse
 from urllib import unquote
+from os.path import exists
 from os.path import join
+import hashlib
+import os
 import requests
+import threading
+
+from crawlFrontier import Frontier
+from jsonSettings import JsonSettings as Settings
+from jsonSettings import SettingsFileError
+from workPool import WorkPool
 
 kBaseUrl = "http://tmbw.net"
 
 kOutputDir = "data"
 
+# how many times we'll try to fetch a page before giving up on it, and how
+# long (in seconds) to wait before the first retry. Each retry after that
+# waits twice as long as the one before (plus a little random jitter.)
+kRetries = 4
+kBackoff = 1.0
+
+# HTTP status codes that are worth trying again.
+kRetryStatus = (429, 500, 502, 503, 504)
+
+# where we remember what each page looked like the last time we fetched it.
+kPageCacheFile = "pageCache.json"
+
+# where we keep the list of pages that the current crawl still has to process.
+kFrontierFile = "crawlFrontier.db"
+
+# where every crawl starts.
+kDiscographies = ("wiki/Discography/Studio_Albums",
+   "wiki/Discography/John_Linnell", "wiki/Discography/John_Flansburgh")
+
+# after the crawl, how many more times we go back for the pages that failed.
+kRetryPasses = 1
+
+# lxml is a lot faster than the parser that comes with Python, but it's
+# optional.
+try:
+   import lxml
+   kParser = "lxml"
+except ImportError:
+   kParser = "html.parser"
+
+# Each kind of page only has one part that we care about. We tell BeautifulSoup
+# to only build the tree for that part (the strainer), and then pull it out of
+# the (much smaller) tree that we get back (the finder).
+kPageParts = {
+   "discography": (SoupStrainer(id="discog"),
+      lambda soup: soup.find(id="discog")),
+   "album": (SoupStrainer(attrs={"class": "ebena"}),
+      lambda soup: soup.find_all(attrs={"class": "ebena"})),
+   "track": (SoupStrainer(attrs={"class": "lyrics-table"}),
+      lambda soup: soup.find(attrs={"class": "lyrics-table"})),
+}
+
+# if set, every page that we fetch is also saved in a subdirectory (named for
+# the kind of page) of this directory, e.g. for use with ParseBench.py
+kSaveDir = None
+
+
+class PageFormatError(Exception):
+   def __init__(self, msg):
+      self.msg = msg
+
+   def __str__(self):
+      return self.msg
+
 
 def Log(s):
    print s
@@ -48,23 +116,206 @@ def MakeFilename(album, track):
    ''' given an album/filename combo, return a filename that combines them'''
    return Scrub("{0}_{1}.lyric".format(album, track))
 
-def GetSoup(urlFragment):
+class Fetcher(object):
+   '''
+      All of our page requests go through a single requests.Session so that
+      we re-use connections instead of opening a new one for every page. We
+      also limit how many requests can be in flight to any one host at the
+      same time, so running lots of crawl threads doesn't hammer the wiki.
+   '''
+   def __init__(self, perHost=4):
+      self.perHost = perHost
+      self.session = requests.Session()
+      adapter = requests.adapters.HTTPAdapter(pool_maxsize=perHost)
+      self.session.mount("http://", adapter)
+      self.session.mount("https://", adapter)
+      self.lock = threading.Lock()
+      self.hosts = {}
+      self.pages = 0
+      self.start = time()
+
+   def HostLimit(self, url):
+      host = urlparse(url).netloc
+      with self.lock:
+         if host not in self.hosts:
+            self.hosts[host] = threading.BoundedSemaphore(self.perHost)
+         return self.hosts[host]
+
+   def Get(self, url, headers=None):
+      ''' fetch the page at url, retrying with exponential backoff when the
+         connection fails or the server says that it's busy.
+      '''
+      for attempt in range(kRetries):
+         if attempt:
+            sleep(kBackoff * (2 ** (attempt - 1)) * (1 + random()))
+         try:
+            with self.HostLimit(url):
+               response = self.session.get(url, headers=headers)
+         except requests.exceptions.RequestException as e:
+            if attempt + 1 == kRetries:
+               raise
+            Log("  retrying {0} ({1})".format(url, str(e)))
+            continue
+         if response.status_code in kRetryStatus and attempt + 1 < kRetries:
+            Log("  retrying {0} (HTTP {1})".format(url, response.status_code))
+            continue
+         response.raise_for_status()
+         with self.lock:
+            self.pages += 1
+         return response
+
+   def PagesPerSecond(self):
+      elapsed = time() - self.start
+      if elapsed <= 0:
+         return 0.0
+      return self.pages / elapsed
+
+
+class PageCache(object):
+   '''
+      Remembers the ETag/Last-Modified headers and a hash of the contents of
+      every page that we've processed, so a refresh run can make conditional
+      requests and skip parsing (and re-writing) anything that hasn't changed.
+
+      A page's new validators are only kept once we've finished processing
+      the page (see Commit()), so a page that fails part way through gets
+      fetched again next time. A page whose contents haven't changed needs no
+      processing, so its new validators are kept right away.
+   '''
+   def __init__(self, path, force=False):
+      '''
+         path: json file to keep the cache in.
+         force: if True, treat every page as changed (but still update the cache.)
+      '''
+      try:
+         self.pages = Settings(path, {})
+      except SettingsFileError:
+         # first run -- JsonSettings just created an empty file for us.
+         self.pages = Settings(path)
+      self.force = force
+      self.pending = {}
+      self.lock = threading.Lock()
+
+   def Headers(self, url):
+      ''' return the headers that turn a request for url into a conditional one. '''
+      headers = {}
+      entry = self.pages[url]
+      if entry and not self.force:
+         if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+         if entry.get("lastModified"):
+            headers["If-Modified-Since"] = entry["lastModified"]
+      return headers
+
+   def IsUnchanged(self, url, response):
+      if 304 == response.status_code:
+         return not self.force
+      entry = {
+         "etag": response.headers.get("ETag"),
+         "lastModified": response.headers.get("Last-Modified"),
+         "hash": hashlib.sha1(response.content).hexdigest()
+      }
+      old = self.pages[url]
+      # not every server sends validators, so also check the contents.
+      unchanged = bool(old) and old.get("hash") == entry["hash"] and not self.force
+      with self.lock:
+         if unchanged:
+            # we've already processed this content, so there's nothing left to
+            # finish before keeping its new validators.
+            self.pages[url] = entry
+         else:
+            self.pending[url] = entry
+      return unchanged
+
+   def Commit(self, url):
+      with self.lock:
+         entry = self.pending.pop(url, None)
+         if entry:
+            self.pages[url] = entry
+
+   def Write(self):
+      with self.lock:
+         self.pages.Write()
+
+
+class TrackCounter(object):
+   ''' keep count of how many tracks were new/changed/unchanged in this run. '''
+   def __init__(self):
+      self.lock = threading.Lock()
+      self.counts = {"new": 0, "changed": 0, "unchanged": 0}
+
+   def Add(self, kind):
+      with self.lock:
+         self.counts[kind] += 1
+
+   def __str__(self):
+      return "{new} new, {changed} changed, {unchanged} unchanged".format(**self.counts)
+
+
+fetcher = Fetcher()
+cache = None
+tracks = TrackCounter()
+
+
+def ParsePart(text, kind, parser=None):
+   ''' parse just the part of a page of the given kind that we care about and
+      return it. If that comes up empty (because the page has changed shape, or
+      the parser can't do partial parses) we fall back to parsing the whole
+      page with the built-in parser.
+   '''
+   strainer, finder = kPageParts[kind]
+   part = finder(BeautifulSoup(text, parser or kParser, parse_only=strainer))
+   if not part:
+      part = finder(BeautifulSoup(text, "html.parser"))
+   if part is None:
+      raise PageFormatError("can't find the {0} part of this page".format(kind))
+   return part
+
+
+def GetPart(urlFragment, kind):
    ''' - join this fragment with the base url
        - retrieve the contents at the full url
-       -  Parse with BeautifulSoup & return the resulting tree of objects.
+       - parse out & return the part of the page we need (see ParsePart())
+      If we're using a page cache and the page hasn't changed since the last
+      time we processed it, return None instead.
    '''
+   url = urljoin(kBaseUrl, urlFragment)
+   headers = cache.Headers(url) if cache else None
+   data = fetcher.Get(url, headers)
+   if cache and cache.IsUnchanged(url, data):
+      return None
+   if kSaveDir:
+      SavePage(data, kind)
+   return ParsePart(data.text, kind)
+
+
+def SavePage(response, kind):
+   saveDir = join(kSaveDir, kind)
+   if not exists(saveDir):
+      try:
+         os.makedirs(saveDir)
+      except OSError:
+         # another thread beat us to it.
+         pass
+   fileName = hashlib.sha1(response.url).hexdigest() + ".html"
+   with open(join(saveDir, fileName), "wb") as f:
+      f.write(response.content)
 
-   data = requests.get(urljoin(kBaseUrl, urlFragment))
-   soup = BeautifulSoup(data.text)
-   return soup
 
+def PageDone(urlFragment):
+   ''' we've finished with this page; remember its validators for next time. '''
+   if cache:
+      cache.Commit(urljoin(kBaseUrl, urlFragment))
 
-def ProcessDiscography(url):
-   ''' load the page at 'url' and process everything in the table of albums 
-      (with the id 'discog'), and in turn process each album.
+
+def ProcessDiscography(url, frontier):
+   ''' load the page at 'url' and add every album in the table of albums
+      (with the id 'discog') to the frontier.
    '''
-   soup = GetSoup(url)
-   table = soup.find(id="discog")
+   table = GetPart(url, "discography")
+   if table is None:
+      Log("Discography '{0}' is unchanged".format(url))
+      return
    rows = table("tr")
    # (skip the table header...)
    for row in rows[1:]:
@@ -73,10 +324,11 @@ def ProcessDiscography(url):
       name = link.text
       urlFragment = link['href']
       Log("Handling album '{0}'".format(name))
-      ProcessAlbum(name, urlFragment)
+      frontier.Add(urlFragment, "album", name)
+   PageDone(url)
 
 
-def ProcessAlbum(albumName, url):
+def ProcessAlbum(albumName, url, frontier):
    ''' look for the table on an album page that contains the track
       listing for the album. This is a little more complicated because there
       may be multiple track listings associated with a single album (alternate release versions,
@@ -85,9 +337,12 @@ def ProcessAlbum(albumName, url):
       and ignore any that end up not containing links to pages of lyrics.
 
       Hackier than I like, but we're scraping HTML and shouldn't be surprised.
+
+      Each track that we find is added to the frontier.
    '''
-   soup = GetSoup(url)
-   tables = soup.find_all(attrs={"class": "ebena"})
+   tables = GetPart(url, "album")
+   if tables is None:
+      return
 
    for table in tables:
       rows = table("tr")
@@ -98,9 +353,10 @@ def ProcessAlbum(albumName, url):
             try:
                trackName = cells[1].a.text
                lyricUrl = cells[3].a['href']
-               ProcessTrack(albumName, trackName, lyricUrl)
+               frontier.Add(lyricUrl, "track", albumName, trackName)
             except Exception, e:
                print str(e)
+   PageDone(url)
 
 
 
@@ -109,16 +365,116 @@ def ProcessTrack(albumName, trackName, url):
       url points at a lyrics page. The lyrics are inside a <div> that has the 
       class 'lyrics-table'.
    '''
-   soup = GetSoup(url)
-   lyrics = soup.find(attrs={"class": "lyrics-table"})
+   lyrics = GetPart(url, "track")
+   if lyrics is None:
+      tracks.Add("unchanged")
+      return
    stanzas = lyrics.find_all("p")
    fileName = join(kOutputDir, MakeFilename(albumName, trackName))
-   Log("  {}".format(fileName))
-   with open(fileName, "wt") as f:
-      lyric = u"\n".join([stanza.text for stanza in stanzas]).encode("UTF-8")
-      f.write(lyric)
+   lyric = u"\n".join([stanza.text for stanza in stanzas]).encode("UTF-8")
+   kind = "new"
+   if exists(fileName):
+      with open(fileName, "rt") as f:
+         kind = "unchanged" if f.read() == lyric else "changed"
+   tracks.Add(kind)
+   if kind != "unchanged":
+      Log("  {0} ({1})".format(fileName, kind))
+      # write & rename so the bot never reads a half-written file.
+      with open(fileName + ".tmp", "wt") as f:
+         f.write(lyric)
+      os.rename(fileName + ".tmp", fileName)
+   PageDone(url)
+
+
+def CrawlPage(frontier, entry):
+   ''' process one page from the frontier and record how it went. '''
+   try:
+      if "discography" == entry.kind:
+         ProcessDiscography(entry.url, frontier)
+      elif "album" == entry.kind:
+         ProcessAlbum(entry.album, entry.url, frontier)
+      else:
+         ProcessTrack(entry.album, entry.track, entry.url)
+      frontier.Done(entry)
+   except Exception as e:
+      Log("  FAILED {0} ({1})".format(entry.url, str(e)))
+      frontier.Failed(entry, str(e))
+
+
+def Crawl(frontier, pool=None):
+   ''' process pages from the frontier until there are none left. Each pass
+      handles everything that's pending when it starts (so the albums found on
+      the discography pages are the next pass, then their tracks.) Once that's
+      done, we go back for the pages that failed.
+   '''
+   for retryPass in range(kRetryPasses + 1):
+      if retryPass:
+         retries = frontier.RetryFailed()
+         if not retries:
+            break
+         Log("Retrying {0} failed pages".format(retries))
+      while True:
+         entries = frontier.Pending()
+         if not entries:
+            break
+         for entry in entries:
+            if pool:
+               pool.Submit(CrawlPage, frontier, entry)
+            else:
+               CrawlPage(frontier, entry)
+         if pool:
+            pool.Wait()
+   for url, attempts, error in frontier.Failures():
+      Log("Gave up on {0} after {1} attempts ({2})".format(url, attempts, error))
 
 if __name__ == "__main__":
-   ProcessDiscography("wiki/Discography/Studio_Albums")
-   ProcessDiscography("wiki/Discography/John_Linnell")
-   ProcessDiscography("wiki/Discography/John_Flansburgh")
+   import argparse
+   parser = argparse.ArgumentParser()
+   parser.add_argument("--workers", type=int, default=1,
+      help="number of pages to work on at the same time")
+   parser.add_argument("--perHost", type=int, default=4,
+      help="maximum number of requests in flight to any one host")
+   parser.add_argument("--baseUrl", default=kBaseUrl,
+      help="site to crawl (e.g., a local server with saved pages for testing)")
+   parser.add_argument("--full", action="store_true",
+      help="process every page, even the ones that haven't changed")
+   parser.add_argument("--parser", default=kParser,
+      help="BeautifulSoup parser to use (default '{0}')".format(kParser))
+   parser.add_argument("--savePages", default=None,
+      help="also save every page fetched into this directory")
+   parser.add_argument("--frontier", default=join(kOutputDir, kFrontierFile),
+      help="file that keeps track of the crawl, so it can be resumed")
+   parser.add_argument("--restart", action="store_true",
+      help="start a new crawl even if the last one didn't finish")
+   args = parser.parse_args()
+
+   kBaseUrl = args.baseUrl
+   kParser = args.parser
+   kSaveDir = args.savePages
+   fetcher = Fetcher(args.perHost)
+   cache = PageCache(join(kOutputDir, kPageCacheFile), args.full)
+   pool = None
+   if args.workers > 1:
+      pool = WorkPool(args.workers)
+
+   frontier = Frontier(args.frontier)
+   if args.restart or not frontier.Pending():
+      frontier.Restart()
+      for discography in kDiscographies:
+         frontier.Add(discography, "discography")
+   else:
+      Log("Resuming the last crawl")
+   try:
+      Crawl(frontier, pool)
+      if pool:
+         pool.Close()
+      Log("Fetched {0} pages ({1:.1f} pages/sec)".format(fetcher.pages,
+         fetcher.PagesPerSecond()))
+      Log("Tracks: {0}".format(tracks))
+      Log("Pages: {0}".format(", ".join("{0} {1}".format(count, state)
+         for state, count in sorted(frontier.Counts().items()))))
+   finally:
+      # if we're stopped part way through, keep what we learned about the
+      # pages that we did finish; the frontier knows where to pick up.
+      cache.Write()
+      frontier.Close()
@@ -0,0 +1,177 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+''' Generate stats from the bot's log files:
+   - tweets per day
+   - the most-used albums and tracks
+   - how often we couldn't find a lyric to tweet
+   - how many mentions & replies we handled
+
+   We read the log files a line at a time, and keep a small summary of each
+   file in a sidecar json file ('logStatsFile' in the config, default
+   'logStats.json'). Log files are only ever appended to, so on the next run
+   we only need to read the part of each file that was added since then, and
+   skip files that haven't changed at all.
+
+      python LogStats.py [--top N] [--days]
+'''
+
+from datetime import datetime
+from glob import glob
+
+import os
+import re
+
+from jsonSettings import JsonSettings as Settings
+from jsonSettings import SettingsFileError
+
+
+def LogFilePattern(pathFormat):
+   ''' turn the strftime() format we use to name log files into a glob pattern
+      that matches all of them.
+   '''
+   return re.sub(r"%.", "*", pathFormat)
+
+
+def ReadEvents(path, offset=0):
+   ''' generate a tuple (timestamp, event, [data], nextOffset) for each entry in
+      the log file at path, starting at the byte 'offset'. nextOffset is where
+      the line after this entry starts.
+   '''
+   with open(path, "rb") as f:
+      f.seek(offset)
+      for line in f:
+         if not line.endswith("\n"):
+            # the bot is in the middle of writing this one.
+            break
+         offset += len(line)
+         fields = line.rstrip("\n").split("\t")
+         try:
+            timestamp = int(fields[0])
+         except ValueError:
+            continue
+         if len(fields) >= 2:
+            yield (timestamp, fields[1], fields[2:], offset)
+
+
+def NewSummary():
+   return {"offset": 0, "mtime": 0, "events": {}, "tweetDays": {},
+      "albums": {}, "tracks": {}}
+
+
+def Increment(counts, key, amount=1):
+   counts[key] = counts.get(key, 0) + amount
+
+
+def Summarize(path, summary):
+   ''' add everything in the log file at path after summary["offset"] to the
+      summary & return it.
+   '''
+   summary["mtime"] = os.path.getmtime(path)
+   for timestamp, event, data, offset in ReadEvents(path, summary["offset"]):
+      Increment(summary["events"], event)
+      if "Tweet" == event and len(data) >= 2:
+         day = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+         Increment(summary["tweetDays"], day)
+         Increment(summary["albums"], data[0])
+         Increment(summary["tracks"], "{0}_{1}".format(data[0], data[1]))
+      summary["offset"] = offset
+   return summary
+
+
+def Merge(total, summary):
+   for key in ("events", "tweetDays", "albums", "tracks"):
+      for name, count in summary[key].iteritems():
+         Increment(total[key], name, count)
+
+
+def Top(counts, n):
+   return sorted(counts.iteritems(), key=lambda item: (-item[1], item[0]))[:n]
+
+
+def GetStats(botPath, settings):
+   ''' bring the per-file summaries up to date and return them all merged together '''
+   statsFile = settings.logStatsFile or "logStats.json"
+   statsPath = os.path.join(botPath, statsFile)
+   try:
+      sidecar = Settings(statsPath, {})
+   except SettingsFileError:
+      # first run -- JsonSettings just created an empty file for us.
+      sidecar = Settings(statsPath)
+
+   pattern = os.path.join(botPath, LogFilePattern(settings.logFilePath or "%Y-%m.txt"))
+   total = NewSummary()
+   for path in sorted(glob(pattern)):
+      summary = sidecar[path]
+      if summary is None or os.path.getsize(path) < summary["offset"]:
+         summary = NewSummary()
+      if os.path.getmtime(path) != summary["mtime"]:
+         sidecar[path] = Summarize(path, summary)
+      Merge(total, summary)
+   sidecar.Write()
+   return total
+
+
+def Report(total, top, showDays):
+   events = total["events"]
+   tweets = events.get("Tweet", 0)
+   days = total["tweetDays"]
+   print "Tweets: {0}".format(tweets)
+   if days:
+      first = datetime.strptime(min(days), "%Y-%m-%d")
+      last = datetime.strptime(max(days), "%Y-%m-%d")
+      numDays = (last - first).days + 1
+      print "Tweets per day: {0:.1f} average, {1} max over {2} days".format(
+         float(tweets) / numDays, max(days.values()), numDays)
+      if showDays:
+         for day in sorted(days):
+            print "   {0} {1}".format(day, days[day])
+
+   attempts = tweets + events.get("NoLyric", 0)
+   if attempts:
+      print "NoLyric: {0} ({1:.1%} of attempts)".format(events.get("NoLyric", 0),
+         float(events.get("NoLyric", 0)) / attempts)
+   # a mention that we replied to is logged as a Reply instead of a Mention.
+   replies = events.get("Reply", 0)
+   print "Mentions: {0}, Replies: {1}".format(events.get("Mention", 0) + replies,
+      replies)
+
+   print "\nTop albums:"
+   for name, count in Top(total["albums"], top):
+      print "   {0:5} {1}".format(count, name)
+   print "\nTop tracks:"
+   for name, count in Top(total["tracks"], top):
+      print "   {0:5} {1}".format(count, name)
+
+
+if __name__ == "__main__":
+   import argparse
+   parser = argparse.ArgumentParser()
+   parser.add_argument("--top", type=int, default=10,
+      help="number of albums/tracks to list")
+   parser.add_argument("--days", action="store_true",
+      help="list the number of tweets for each day")
+   args = parser.parse_args()
+
+   botPath = os.path.split(__file__)[0]
+   settings = Settings(os.path.join(botPath, "tmbotg.json"))
+   Report(GetStats(botPath, settings), args.top, args.days)
@@ -0,0 +1,122 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+''' Run several bots in one process.
+
+   Each bot gets its own directory holding its own tmbotg.json, history and
+   log files, exactly as if it were a separate copy of tmbotg.py being run by
+   cron, so their settings and histories never mix. What they share is
+   everything that's the same for all of them: the code is only imported
+   once, and bots whose 'lyricIndexPath' settings point at the same file share
+   a single open (mmap()ed, read-only) LyricIndex through an IndexCache.
+
+   Once a minute, a cron-style Run() of every bot is handed to a shared pool of
+   worker threads, so a bot that's waiting on the network doesn't hold up the
+   others.
+
+      python MultiBot.py <bot dir> [<bot dir> ...] [--workers N] [--once]
+         [--debug] [--force]
+'''
+
+from time import time
+
+import signal
+
+from botDaemon import OnSigTerm
+from botDaemon import stopRequested
+from lyricIndex import IndexCache
+from workPool import WorkPool
+
+import jsonSettings
+import tmbotg
+
+# seconds between runs of each bot (the same as the cron job.)
+kRunInterval = 60
+kWorkers = 4
+
+
+def RunBot(bot):
+   try:
+      bot.Run()
+   except Exception as e:
+      # one broken bot shouldn't stop the rest of them.
+      bot.Log("EXCEPTION", ["Run", str(e)])
+      bot.eventLog.Flush()
+
+
+class MultiBot(object):
+   def __init__(self, botDirs, workers=kWorkers, debug=False, force=False):
+      self.indexCache = IndexCache()
+      self.bots = []
+      for botDir in botDirs:
+         argDict = {'debug': debug, 'force': force, 'stream': False,
+            'daemon': False, 'replay': None, 'botPath': botDir}
+         try:
+            self.bots.append(tmbotg.TmBot(argDict, self.indexCache))
+         except (jsonSettings.SettingsFileError, tmbotg.LyricsFileError) as e:
+            print "{0}: {1}".format(botDir, str(e))
+      self.pool = WorkPool(workers)
+
+   def RunAll(self):
+      ''' do one cron-style run of every bot & wait for them all to finish. '''
+      for bot in self.bots:
+         self.pool.Submit(RunBot, bot)
+      self.pool.Wait()
+
+   def Run(self, once=False):
+      stopRequested.clear()
+      previous = signal.signal(signal.SIGTERM, OnSigTerm)
+      try:
+         while not stopRequested.is_set():
+            start = time()
+            self.RunAll()
+            if once:
+               break
+            # --force is for one tweet from each bot, not one every minute.
+            for bot in self.bots:
+               bot.force = False
+            stopRequested.wait(max(0, kRunInterval - (time() - start)))
+      except KeyboardInterrupt:
+         pass
+      finally:
+         signal.signal(signal.SIGTERM, previous)
+         # let any runs that are still going finish (and write their settings.)
+         self.pool.Close()
+
+
+if __name__ == "__main__":
+   import argparse
+   parser = argparse.ArgumentParser()
+   parser.add_argument("botDirs", nargs="+",
+      help="directories that each hold one bot's tmbotg.json")
+   parser.add_argument("--workers", type=int, default=kWorkers,
+      help="number of bots to run at the same time")
+   parser.add_argument("--once", action="store_true",
+      help="run each bot once and exit (e.g. from cron)")
+   parser.add_argument("--debug", action='store_true',
+      help="print to stdout instead of tweeting")
+   parser.add_argument("--force", action='store_true',
+      help="force every bot to tweet now instead of waiting for randomness "
+      "(on the first run only)")
+   args = parser.parse_args()
+
+   MultiBot(args.botDirs, args.workers, args.debug, args.force).Run(args.once)
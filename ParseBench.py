@@ -0,0 +1,123 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+''' Benchmark the different ways that GetLyrics.py can parse pages, using pages
+   that were saved by running
+      python GetLyrics.py --savePages <dir>
+
+   For each kind of page (discography, album, track) and each parser that's
+   installed, we time parsing the whole page vs. parsing just the part that we
+   need, and measure the peak memory used to do it. Memory is measured by
+   parsing in a child process and reading its max RSS, so each measurement
+   starts from the same clean slate.
+
+      python ParseBench.py <dir> [--repeat N]
+'''
+
+from glob import glob
+from os.path import join
+from time import time
+
+import os
+
+from bs4 import BeautifulSoup
+
+import GetLyrics
+
+kKinds = ("discography", "album", "track")
+kParsers = ("html.parser", "lxml", "html5lib")
+
+
+def AvailableParsers():
+   parsers = []
+   for parser in kParsers:
+      try:
+         BeautifulSoup("<p></p>", parser)
+         parsers.append(parser)
+      except Exception:
+         pass
+   return parsers
+
+
+def ParseFull(text, kind, parser):
+   strainer, finder = GetLyrics.kPageParts[kind]
+   return finder(BeautifulSoup(text, parser))
+
+
+def ParseStrained(text, kind, parser):
+   return GetLyrics.ParsePart(text, kind, parser)
+
+
+def PeakMemory(func, pages, kind, parser):
+   ''' run func over all the pages in a child process and return the peak RSS
+      of that child in KB.
+   '''
+   pid = os.fork()
+   if 0 == pid:
+      for text in pages:
+         func(text, kind, parser)
+      os._exit(0)
+   pid, status, usage = os.wait4(pid, 0)
+   return usage.ru_maxrss
+
+
+def Baseline():
+   ''' a forked child starts out with our current RSS, so measure what that is. '''
+   pid = os.fork()
+   if 0 == pid:
+      os._exit(0)
+   pid, status, usage = os.wait4(pid, 0)
+   return usage.ru_maxrss
+
+
+def Bench(pageDir, repeat):
+   print "{0:<12} {1:<12} {2:<9} {3:>6} {4:>12} {5:>12}".format("page", "parser",
+      "mode", "pages", "ms/page", "peak KB")
+   for kind in kKinds:
+      pages = []
+      for fName in sorted(glob(join(pageDir, kind, "*.html"))):
+         with open(fName, "rb") as f:
+            pages.append(f.read().decode("utf-8", "replace"))
+      if not pages:
+         continue
+      for parser in AvailableParsers():
+         for mode, func in (("full", ParseFull), ("strained", ParseStrained)):
+            start = time()
+            for i in range(repeat):
+               for text in pages:
+                  func(text, kind, parser)
+            elapsed = (time() - start) * 1000.0 / (repeat * len(pages))
+            baseline = Baseline()
+            peak = PeakMemory(func, pages, kind, parser) - baseline
+            print "{0:<12} {1:<12} {2:<9} {3:>6} {4:>12.2f} {5:>12}".format(kind,
+               parser, mode, len(pages), elapsed, peak)
+
+
+if __name__ == "__main__":
+   import argparse
+   parser = argparse.ArgumentParser()
+   parser.add_argument("pageDir",
+      help="directory of pages saved by GetLyrics.py --savePages")
+   parser.add_argument("--repeat", type=int, default=5,
+      help="number of times to parse each page when timing")
+   args = parser.parse_args()
+   Bench(args.pageDir, args.repeat)
@@ -0,0 +1,346 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+''' Simulate years of the bot's posting schedule in a few seconds, to see what
+   a choice of 'tweetProbability', 'minimumSpacing', 'maximumSpacing' and
+   'minimumDaySpacing' really does before we let cron run with it for weeks.
+
+   Every minute, a cron run of the bot decides whether to tweet with
+   botTick.ShouldTweet() (the rule that CreateUpdate() uses), and a song that's
+   been used can't be used again for cooldown.RestDays(minimumDaySpacing)
+   days. If there's no song left to use, the tweet fails with a NoLyricError
+   and the runs after it keep trying.
+
+   Instead of stepping through every minute, we hand ShouldTweet() an array of
+   every possible time since the last tweet to get the chance of trying to
+   tweet at each of them, and draw the time of the next attempt straight from
+   that. Every song that's rested long enough is as likely to be picked as any
+   other, so all we need to know about the corpus is how many songs were used
+   on each of the last RestDays() days. Each step of the simulation is then a
+   few NumPy operations over all of the Monte Carlo trials at once.
+
+   Replies to questions (--repliesPerDay of them, arriving at random) use up
+   songs too.
+
+      python ScheduleSim.py [--config tmbotg.json] [--tweetProbability P]
+         [--minimumSpacing S] [--maximumSpacing S] [--minimumDaySpacing D]
+         [--corpus N] [--repliesPerDay R] [--days 365] [--trials 1000]
+         [--seed N] [--out sim.json]
+'''
+
+from time import time
+
+import json
+
+import numpy as np
+
+from cooldown import RestDays
+
+import botTick
+import tmbotg
+
+# seconds between cron runs of the bot.
+kCronInterval = 60
+kMinutesPerDay = 24 * 60
+
+# settings that the bot fills in on its own if they're missing.
+kDefaults = dict(tmbotg.kDefaultConfigDict)
+kDefaults["maximumSpacing"] = 4 * 60 * 60
+
+# the longest gap between tweets (in days) that we keep track of exactly.
+kMaxGapDays = 7
+
+kPercentiles = (0, 5, 25, 50, 75, 95, 100)
+
+
+def AttemptCurve(tweetProbability, minimumSpacing, maximumSpacing):
+   ''' returns an array whose entry k is the chance that none of the cron runs
+      in the first k minutes after a tweet decided to tweet. The last entry is
+      0: by then it's been more than maximumSpacing seconds.
+   '''
+   ages = np.arange(1, maximumSpacing // kCronInterval + 2) * kCronInterval
+   # a run tweets regardless of the roll...
+   forced = botTick.ShouldTweet(ages, 1.0, tweetProbability, minimumSpacing,
+      maximumSpacing)
+   # ...or only if the roll comes up.
+   allowed = botTick.ShouldTweet(ages, 0.0, tweetProbability, minimumSpacing,
+      maximumSpacing)
+   chance = np.where(forced, 1.0, np.where(allowed, tweetProbability, 0.0))
+   return np.concatenate(([1.0], np.cumprod(1.0 - chance)))
+
+
+def NextAttempt(survival, age, rng):
+   ''' for trials whose runs have gone 'age' minutes since the last tweet
+      without trying to tweet, return how many minutes after the last tweet
+      the next attempt will be.
+   '''
+   last = len(survival) - 1
+   target = rng.random_sample(len(age)) * survival[np.minimum(age, last)]
+   # the first minute at which the chance of not having tried yet drops below
+   # the target.
+   attempt = np.minimum(np.searchsorted(-survival, -target, side="right"), last)
+   # once it's been more than maximumSpacing, every run tries.
+   return np.where(age >= last, age + 1, attempt)
+
+
+def UseSongs(wanted, used, resting, slot, corpusSize):
+   ''' use up to 'wanted' songs in each trial, counting them on the day in
+      'slot'. Returns how many of them there weren't songs for.
+   '''
+   got = np.minimum(wanted, corpusSize - resting)
+   rows = np.arange(len(wanted))
+   used[rows, slot] += got
+   resting += got
+   return wanted - got
+
+
+def Simulate(settings, corpusSize, days, trials, repliesPerDay=0, seed=None):
+   '''
+      settings: dict with tweetProbability, minimumSpacing, maximumSpacing and
+         minimumDaySpacing.
+      Every trial starts with a new bot (no songs used yet) that's just tweeted.
+      Returns a dict of arrays:
+      - tweets, noLyric, replies, replyNoLyric: (trials, days) counts of each
+        per day
+      - eligible: (trials, days) how many songs could be used at the start of
+        each day
+      - gaps: gaps[k] is how many times there were k minutes between tweets
+        (the last entry counts everything longer)
+   '''
+   rng = np.random.RandomState(seed)
+   survival = AttemptCurve(settings["tweetProbability"], settings["minimumSpacing"],
+      settings["maximumSpacing"])
+   forcedAge = len(survival) - 1
+   rest = RestDays(settings["minimumDaySpacing"])
+   totalMinutes = days * kMinutesPerDay
+   replyRate = repliesPerDay / float(kMinutesPerDay)
+
+   # how many songs each trial used on each of the last 'rest' days (indexed
+   # by day % rest), and how many that adds up to.
+   used = np.zeros((trials, rest), dtype=np.int64)
+   resting = np.zeros(trials, dtype=np.int64)
+   # the minute each trial has got to, that minute's day, & minutes since the
+   # last tweet.
+   now = np.zeros(trials, dtype=np.int64)
+   day = np.zeros(trials, dtype=np.int64)
+   age = np.zeros(trials, dtype=np.int64)
+
+   tweets = np.zeros((trials, days), dtype=np.int64)
+   noLyric = np.zeros((trials, days), dtype=np.int64)
+   eligible = np.zeros((trials, days), dtype=np.int64)
+   eligible[:, 0] = corpusSize
+   replies = np.zeros((trials, days), dtype=np.int64)
+   replyNoLyric = np.zeros((trials, days), dtype=np.int64)
+   gaps = np.zeros(kMaxGapDays * kMinutesPerDay + 1, dtype=np.int64)
+   rows = np.arange(trials)
+
+   def UseReplies(count):
+      failed = UseSongs(count, used, resting, day % rest, corpusSize)
+      replies[rows, day] += count - failed
+      replyNoLyric[rows, day] += failed
+
+   while True:
+      active = now < totalMinutes
+      if not active.any():
+         break
+      attempt = NextAttempt(survival, age, rng)
+      when = np.where(active, now + attempt - age, now)
+      newDay = np.minimum(when // kMinutesPerDay, days - 1)
+
+      if replyRate:
+         # the replies before midnight use songs from the day they're on...
+         end = np.minimum(when, totalMinutes)
+         midnight = np.minimum(end, (day + 1) * kMinutesPerDay)
+         UseReplies(rng.poisson(replyRate * np.maximum(midnight - now, 0)))
+
+      # start any new days, letting the songs that have rested long enough go.
+      steps = newDay - day
+      for step in range(1, steps.max() + 1):
+         moving = np.flatnonzero(steps >= step)
+         nextDay = day[moving] + step
+         slot = nextDay % rest
+         resting[moving] -= used[moving, slot]
+         used[moving, slot] = 0
+         eligible[moving, nextDay] = corpusSize - resting[moving]
+      day = newDay
+
+      if replyRate:
+         # ...and the rest from the day of the attempt.
+         UseReplies(rng.poisson(replyRate * np.maximum(end - midnight, 0)))
+
+      trying = active & (when < totalMinutes)
+      failed = UseSongs(trying.astype(np.int64), used, resting, day % rest,
+         corpusSize).astype(bool)
+      posted = trying & ~failed
+      tweets[rows, day] += posted
+      np.add.at(gaps, np.minimum(attempt[posted], len(gaps) - 1), 1)
+
+      # once we're past maximumSpacing, every run until midnight tries & fails
+      # the same way, so skip straight to the last of them.
+      stuck = failed & (attempt >= forcedAge)
+      lastRun = np.minimum((day + 1) * kMinutesPerDay, totalMinutes) - 1
+      skipped = np.where(stuck, lastRun - when, 0)
+      noLyric[rows, day] += failed + skipped
+      if replyRate:
+         # (any replies in the meantime won't find a song either.)
+         UseReplies(rng.poisson(replyRate * skipped))
+
+      age = np.where(posted, 0, np.where(active, attempt + skipped, age))
+      now = np.where(active, when + skipped, now)
+
+   return {"tweets": tweets, "noLyric": noLyric, "replies": replies,
+      "replyNoLyric": replyNoLyric, "eligible": eligible, "gaps": gaps}
+
+
+def Percentiles(values):
+   return dict((str(p), float(v)) for p, v in
+      zip(kPercentiles, np.percentile(values, kPercentiles)))
+
+
+def HistogramPercentiles(counts):
+   ''' the kPercentiles of the values in a histogram (counts[value]) '''
+   cumulative = np.cumsum(counts)
+   if not cumulative[-1]:
+      return {}
+   return dict((str(p), int(np.searchsorted(cumulative, max(1, p * cumulative[-1] / 100.0))))
+      for p in kPercentiles)
+
+
+def Summarize(results, corpusSize):
+   tweets = results["tweets"]
+   noLyric = results["noLyric"]
+   eligible = results["eligible"]
+   gaps = results["gaps"]
+   trials, days = tweets.shape
+   minutes = np.arange(len(gaps))
+   # the first day that each trial failed to tweet because it ran out of songs.
+   ranOut = (noLyric > 0).any(axis=1)
+   firstFailure = np.argmax(noLyric > 0, axis=1)[ranOut]
+   meanEligible = eligible.mean(axis=0) / float(corpusSize)
+   summary = {
+      "postsPerDay": {
+         "mean": float(tweets.mean()),
+         "std": float(tweets.std()),
+         "percentiles": Percentiles(tweets),
+         "histogram": dict((str(n), float(count) / tweets.size)
+            for n, count in enumerate(np.bincount(tweets.ravel())) if count),
+      },
+      "gapHours": {
+         "mean": float((gaps * minutes).sum()) / max(1, gaps.sum()) / 60.0,
+         "percentiles": dict((p, v / 60.0) for p, v in HistogramPercentiles(gaps).items()),
+         "longerThan{0}Days".format(kMaxGapDays): int(gaps[-1]),
+      },
+      "noLyric": {
+         "perDay": float(noLyric.mean()),
+         "daysWithAny": float((noLyric > 0).mean()),
+         "trialsWithAny": float(ranOut.mean()),
+         "firstDay": Percentiles(firstFailure) if len(firstFailure) else None,
+         "replyPerDay": float(results["replyNoLyric"].mean()),
+      },
+      "corpus": {
+         "size": corpusSize,
+         # fraction of the corpus that we could use at the start of each day,
+         # averaged over the trials.
+         "eligibleFraction": dict((str(d), float(meanEligible[d]))
+            for d in (1, 7, 30, 90, 180, 365, 730, days - 1) if d < days),
+         "leastEligibleFraction": float(eligible.min()) / corpusSize,
+         "songsUsedPerDay": float(tweets.mean() + results["replies"].mean()),
+      },
+   }
+   return summary
+
+
+def PrintSummary(summary):
+   posts = summary["postsPerDay"]
+   print "posts per day: mean {0:.2f} (std {1:.2f}), percentiles {2}".format(
+      posts["mean"], posts["std"], FormatPercentiles(posts["percentiles"]))
+   gaps = summary["gapHours"]
+   print "hours between posts: mean {0:.2f}, percentiles {1}".format(gaps["mean"],
+      FormatPercentiles(gaps["percentiles"]))
+   noLyric = summary["noLyric"]
+   print "NoLyricError: {0:.3f} per day, on {1:.1%} of days, in {2:.1%} of trials".format(
+      noLyric["perDay"], noLyric["daysWithAny"], noLyric["trialsWithAny"])
+   if noLyric["firstDay"]:
+      print "   first happened on day {0}".format(FormatPercentiles(noLyric["firstDay"]))
+   if noLyric["replyPerDay"]:
+      print "   (and {0:.3f} replies per day)".format(noLyric["replyPerDay"])
+   corpus = summary["corpus"]
+   print "corpus of {0}: {1:.1f} songs used per day; fraction eligible by day {2}".format(
+      corpus["size"], corpus["songsUsedPerDay"], ", ".join("{0}: {1:.2f}".format(d, f)
+      for d, f in sorted(corpus["eligibleFraction"].items(), key=lambda x: int(x[0]))))
+
+
+def FormatPercentiles(percentiles):
+   return " ".join("p{0}={1:g}".format(p, round(percentiles[str(p)], 2))
+      for p in kPercentiles if str(p) in percentiles)
+
+
+if __name__ == "__main__":
+   import argparse
+   parser = argparse.ArgumentParser()
+   parser.add_argument("--config", default=None,
+      help="read the spacing settings from this tmbotg.json")
+   for name in ("tweetProbability", "minimumSpacing", "maximumSpacing",
+      "minimumDaySpacing"):
+      parser.add_argument("--" + name, type=float, default=None,
+         help="(default: from --config, or {0})".format(kDefaults[name]))
+   parser.add_argument("--corpus", type=int, default=800,
+      help="number of songs")
+   parser.add_argument("--repliesPerDay", type=float, default=0,
+      help="average number of question replies per day (they use songs, too)")
+   parser.add_argument("--days", type=int, default=365,
+      help="days to simulate in each trial")
+   parser.add_argument("--trials", type=int, default=1000,
+      help="number of Monte Carlo trials")
+   parser.add_argument("--seed", type=int, default=1,
+      help="random seed")
+   parser.add_argument("--out", default=None,
+      help="file to write the json results to")
+   args = parser.parse_args()
+
+   settings = dict(kDefaults)
+   if args.config:
+      with open(args.config, "rt") as f:
+         settings.update(json.load(f))
+   for name in ("tweetProbability", "minimumSpacing", "maximumSpacing",
+      "minimumDaySpacing"):
+      if getattr(args, name) is not None:
+         settings[name] = getattr(args, name)
+   for name in ("minimumSpacing", "maximumSpacing", "minimumDaySpacing"):
+      settings[name] = int(settings[name])
+
+   start = time()
+   results = Simulate(settings, args.corpus, args.days, args.trials,
+      args.repliesPerDay, args.seed)
+   elapsed = time() - start
+   print "Simulated {0} trials of {1} days ({2:,} minutes) in {3:.1f} s.".format(
+      args.trials, args.days, args.trials * args.days * kMinutesPerDay, elapsed)
+   summary = Summarize(results, args.corpus)
+   PrintSummary(summary)
+   if args.out:
+      report = {"settings": dict((name, settings[name]) for name in
+         ("tweetProbability", "minimumSpacing", "maximumSpacing", "minimumDaySpacing")),
+         "corpus": args.corpus, "repliesPerDay": args.repliesPerDay,
+         "days": args.days, "trials": args.trials, "seed": args.seed,
+         "seconds": elapsed, "summary": summary}
+      with open(args.out, "wt") as f:
+         json.dump(report, f, indent=2, sort_keys=True)
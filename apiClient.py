@@ -0,0 +1,229 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   apiClient.py -- wrapper around the Twython calls that the bot makes, so that
+   we play nicely with the Twitter rate limits.
+
+   - Every endpoint gets a token bucket that's refilled from the
+     x-rate-limit-remaining/x-rate-limit-reset headers of its responses. If the
+     bucket is empty, we don't even try the call until the reset time.
+   - Server errors and dropped connections are retried a few times with
+     jittered exponential backoff.
+   - A call that can't be made now (empty bucket, a 429, or still failing after
+     all the retries) raises DeferredCall. Favorites are also saved in the
+     settings so that RunDeferred() can try them again on the next run instead
+     of losing them. (Status updates wait in the bot's outbox instead; see
+     outbox.py)
+
+   The buckets and deferred calls live in the settings file because the cron
+   version of the bot is a new process every minute.
+
+   Twython keeps the headers of its last response on the Twython object, and
+   favorites & status updates are sent from several threads at once, so each
+   thread makes its calls with a Twython object of its own.
+'''
+
+from random import random
+from time import sleep
+from time import time
+
+import threading
+
+from twython.exceptions import TwythonError
+from twython.exceptions import TwythonRateLimitError
+
+kRetries = 3
+kBackoff = 1.0
+
+# HTTP status codes that are worth trying again.
+kRetryStatus = (500, 502, 503, 504)
+
+# calls that we save to try again next time if we can't make them now.
+kDeferrable = ("create_favorite",)
+
+
+class DeferredCall(Exception):
+   def __init__(self, endpoint, reason):
+      self.endpoint = endpoint
+      self.reason = reason
+
+   def __str__(self):
+      return "{0} deferred: {1}".format(self.endpoint, self.reason)
+
+
+class TokenBucket(object):
+   ''' how many more calls we can make to one endpoint before 'reset' (a UNIX
+      timestamp). None for either value means that we don't know yet.
+   '''
+   def __init__(self, remaining=None, reset=None):
+      self.remaining = remaining
+      self.reset = reset
+
+   def Take(self, now):
+      ''' use up a token if we have one. Returns False if the call has to wait. '''
+      if self.reset is not None and now >= self.reset:
+         # the window has rolled over; we'll learn the new limit from the response.
+         self.remaining = None
+         self.reset = None
+      if self.remaining is None:
+         return True
+      if self.remaining <= 0:
+         return False
+      self.remaining -= 1
+      return True
+
+   def Update(self, remaining, reset):
+      ''' the responses to calls made at the same time can come back in any
+         order, so within one window we keep the lowest count we're told.
+      '''
+      if reset is not None:
+         reset = int(reset)
+      if remaining is not None:
+         remaining = int(remaining)
+         if self.remaining is not None and reset == self.reset:
+            remaining = min(remaining, self.remaining)
+         self.remaining = remaining
+      if reset is not None:
+         self.reset = reset
+
+   def Empty(self, reset):
+      self.remaining = 0
+      self.reset = int(reset) if reset else int(time()) + 15 * 60
+
+
+class RateLimitedClient(object):
+   def __init__(self, makeTwitter, settings, retries=kRetries, backoff=kBackoff,
+      stats=None):
+      '''
+         makeTwitter: returns a new Twython object to make calls with (one for
+            each thread that makes calls.)
+         settings: JsonSettings where we keep the buckets ('rateLimits') and
+            calls to try again later ('deferredCalls').
+         stats: if not None, a RunStats object to record each call in.
+      '''
+      self.makeTwitter = makeTwitter
+      self.local = threading.local()
+      self.settings = settings
+      self.stats = stats
+      self.retries = retries
+      self.backoff = backoff
+      self.lock = threading.Lock()
+      self.buckets = {}
+      for endpoint, (remaining, reset) in (settings.rateLimits or {}).items():
+         self.buckets[endpoint] = TokenBucket(remaining, reset)
+
+   def Twitter(self):
+      ''' the Twython object for the calling thread. '''
+      twitter = getattr(self.local, "twitter", None)
+      if twitter is None:
+         twitter = self.makeTwitter()
+         self.local.twitter = twitter
+      return twitter
+
+   def Bucket(self, endpoint):
+      if endpoint not in self.buckets:
+         self.buckets[endpoint] = TokenBucket()
+      return self.buckets[endpoint]
+
+   def SaveBuckets(self):
+      limits = {}
+      for endpoint, bucket in self.buckets.items():
+         if bucket.reset is not None:
+            limits[endpoint] = [bucket.remaining, bucket.reset]
+      self.settings.rateLimits = limits
+
+   def Call(self, endpoint, **kwargs):
+      ''' make the Twython call 'endpoint' with these arguments. '''
+      with self.lock:
+         allowed = self.Bucket(endpoint).Take(int(time()))
+      if not allowed:
+         self.Defer(endpoint, kwargs, "rate limit")
+      twitter = self.Twitter()
+      for attempt in range(self.retries):
+         if attempt:
+            if self.stats:
+               self.stats.Count("api_retries", endpoint=endpoint)
+            sleep(self.backoff * (2 ** (attempt - 1)) * (1 + random()))
+         start = time()
+         try:
+            result = getattr(twitter, endpoint)(**kwargs)
+         except TwythonRateLimitError as e:
+            self.Record(endpoint, start, "429")
+            with self.lock:
+               self.Bucket(endpoint).Empty(e.retry_after)
+               self.SaveBuckets()
+            self.Defer(endpoint, kwargs, "HTTP 429")
+         except TwythonError as e:
+            self.Record(endpoint, start, str(e.error_code or "none"))
+            # no error code means that we couldn't talk to the server at all.
+            if e.error_code is None or e.error_code in kRetryStatus:
+               continue
+            raise
+         self.Record(endpoint, start, "ok")
+         with self.lock:
+            self.Bucket(endpoint).Update(
+               twitter.get_lastfunction_header("x-rate-limit-remaining"),
+               twitter.get_lastfunction_header("x-rate-limit-reset"))
+            self.SaveBuckets()
+         return result
+      self.Defer(endpoint, kwargs, "still failing after {0} tries".format(self.retries))
+
+   def Record(self, endpoint, start, status):
+      if self.stats:
+         self.stats.Observe("api_call", time() - start, endpoint=endpoint)
+         self.stats.Count("api_calls", endpoint=endpoint, status=status)
+
+   def Defer(self, endpoint, kwargs, reason):
+      if self.stats:
+         self.stats.Count("api_deferred", endpoint=endpoint)
+      if endpoint in kDeferrable:
+         with self.lock:
+            self.settings.deferredCalls = (self.settings.deferredCalls or []) + \
+               [[endpoint, kwargs]]
+      raise DeferredCall(endpoint, reason)
+
+   def RunDeferred(self):
+      ''' try again to make all the calls that we couldn't make before.
+         Returns a list of (endpoint, kwargs, exception) for calls that failed
+         for good; calls that have to wait again stay deferred.
+      '''
+      with self.lock:
+         calls = self.settings.deferredCalls or []
+         if calls:
+            self.settings.deferredCalls = []
+      failures = []
+      for endpoint, kwargs in calls:
+         try:
+            self.Call(endpoint, **kwargs)
+         except DeferredCall:
+            pass
+         except TwythonError as e:
+            failures.append((endpoint, kwargs, e))
+      return failures
+
+   def update_status(self, **kwargs):
+      return self.Call("update_status", **kwargs)
+
+   def create_favorite(self, **kwargs):
+      return self.Call("create_favorite", **kwargs)
+
+   def get_mentions_timeline(self, **kwargs):
+      return self.Call("get_mentions_timeline", **kwargs)
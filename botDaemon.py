@@ -0,0 +1,125 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   botDaemon.py -- keep a single TmBot alive and run each of the things that
+   the cron version does once a minute on its own in-process timer.
+
+   The tweet decision in TmBot.CreateUpdate() is a per-tick coin flip, so as
+   long as we call it once every 60 seconds (the 'updateInterval' setting) we
+   get exactly the same distribution of posts that the cron job produced.
+'''
+
+from time import time
+
+import sched
+import signal
+import threading
+
+
+# setting name, default value in seconds
+kIntervalDefaults = {
+   "updateInterval"  : 60,
+   "mentionInterval" : 60,
+   "quoteInterval"   : 60,
+   "sendInterval"    : 60,
+   "flushInterval"   : 5 * 60,
+}
+
+
+# set once we've been asked to stop (see OnSigTerm())
+stopRequested = threading.Event()
+
+
+def OnSigTerm(signum, frame):
+   # don't interrupt whatever we're in the middle of (like posting a tweet that
+   # we haven't marked as sent yet); we stop once it's finished.
+   stopRequested.set()
+
+
+class BotDaemon(object):
+   '''
+      Runs the phases of a TmBot on repeating timers until we're told to stop.
+   '''
+   def __init__(self, bot):
+      self.bot = bot
+      self.scheduler = sched.scheduler(time, self.Wait)
+
+   def GetInterval(self, key):
+      interval = self.bot.settings[key]
+      if not interval:
+         interval = kIntervalDefaults[key]
+         self.bot.settings[key] = interval
+      return interval
+
+   def Wait(self, delay):
+      ''' the scheduler calls this between actions to wait until the next
+         one is due. If we're asked to stop, we cancel everything that's
+         still scheduled so that the scheduler's run() returns.
+      '''
+      if stopRequested.wait(delay):
+         for event in self.scheduler.queue:
+            self.scheduler.cancel(event)
+
+   def Every(self, key, priority, action, timed=True):
+      ''' call action() now, and then again every time the interval stored in
+         the setting 'key' elapses. When several actions come due at the same
+         time, they run in order of priority (lowest first.) Pass timed=False
+         for an action that records its own phase.
+      '''
+      interval = self.GetInterval(key)
+
+      def Repeat():
+         self.scheduler.enter(interval, priority, Repeat, ())
+         try:
+            if timed:
+               with self.bot.stats.Phase(action.__name__):
+                  action()
+            else:
+               action()
+         except Exception as e:
+            # one bad call to the API shouldn't take the whole bot down.
+            self.bot.Log("EXCEPTION", [action.__name__, str(e)])
+
+      self.scheduler.enter(0, priority, Repeat, ())
+
+   def Run(self):
+      bot = self.bot
+      # same order as a cron run: create, mentions, quotes, send, write.
+      self.Every("updateInterval", 1, bot.CreateUpdate)
+      self.Every("mentionInterval", 2, bot.HandleMentions)
+      self.Every("quoteInterval", 3, bot.HandleQuotes)
+      self.Every("sendInterval", 4, bot.SendTweets)
+      self.Every("flushInterval", 5, bot.Flush, timed=False)
+
+      stopRequested.clear()
+      previous = signal.signal(signal.SIGTERM, OnSigTerm)
+      try:
+         self.scheduler.run()
+      except KeyboardInterrupt:
+         pass
+      finally:
+         signal.signal(signal.SIGTERM, previous)
+         # send anything that's already been queued up before we write out the
+         # settings & history that go with it.
+         try:
+            bot.SendTweets()
+         finally:
+            bot.Flush()
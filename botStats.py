@@ -0,0 +1,161 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   botStats.py -- counters and timings for a run of the bot.
+
+   - Phase(name) times one phase of a run (CreateUpdate, HandleMentions, ...)
+   - Count(name) counts things (GetLyric retries, TooSoon rejections, ...)
+   - Observe(name, seconds) records how long something took (e.g. an API call)
+     as a count, total and maximum.
+
+   Anything can be given labels as keyword arguments, e.g.
+   Count("api_calls", endpoint="update_status").
+
+   Write() saves everything either as json or, if the path ends in '.prom', in
+   the Prometheus text format that node_exporter's textfile collector reads.
+   Either way the file is written to a temp file & renamed, so nothing that
+   reads it ever sees half a file.
+'''
+
+from contextlib import contextmanager
+from time import time
+
+import json
+import os
+import threading
+
+# prefix for the names of everything we write in Prometheus format.
+kPrefix = "tmbotg_"
+
+
+def Key(name, labels):
+   return (name, tuple(sorted(labels.items())))
+
+
+def FormatLabels(labels):
+   if not labels:
+      return ""
+   return "{" + ",".join('{0}="{1}"'.format(k, str(v).replace('"', '\\"'))
+      for k, v in labels) + "}"
+
+
+class RunStats(object):
+   def __init__(self):
+      self.lock = threading.Lock()
+      self.started = time()
+      self.phases = {}
+      self.counters = {}
+      # the names of counters that hold a value we've Set() instead of a count.
+      self.gauges = set()
+      self.timings = {}
+
+   @contextmanager
+   def Phase(self, name):
+      ''' with stats.Phase("CreateUpdate"): ... '''
+      start = time()
+      try:
+         yield
+      finally:
+         elapsed = time() - start
+         with self.lock:
+            last, total, runs = self.phases.get(name, (0, 0, 0))
+            self.phases[name] = (elapsed, total + elapsed, runs + 1)
+
+   def Count(self, name, amount=1, **labels):
+      key = Key(name, labels)
+      with self.lock:
+         self.counters[key] = self.counters.get(key, 0) + amount
+
+   def Set(self, name, value, **labels):
+      ''' for values that we read from somewhere else instead of counting. '''
+      with self.lock:
+         self.counters[Key(name, labels)] = value
+         self.gauges.add(name)
+
+   def Observe(self, name, seconds, **labels):
+      key = Key(name, labels)
+      with self.lock:
+         count, total, most = self.timings.get(key, (0, 0, 0))
+         self.timings[key] = (count + 1, total + seconds, max(most, seconds))
+
+   def AsDict(self):
+      with self.lock:
+         retval = {"started": int(self.started), "phases": {}, "counters": {},
+            "timings": {}}
+         for name, (last, total, runs) in self.phases.items():
+            retval["phases"][name] = {"seconds": last, "totalSeconds": total,
+               "runs": runs}
+         for (name, labels), value in self.counters.items():
+            retval["counters"][name + FormatLabels(labels)] = value
+         for (name, labels), (count, total, most) in self.timings.items():
+            retval["timings"][name + FormatLabels(labels)] = {"count": count,
+               "seconds": total, "maxSeconds": most}
+      return retval
+
+   def AsPrometheus(self):
+      lines = []
+      with self.lock:
+         lines.append("# TYPE {0}phase_seconds gauge".format(kPrefix))
+         for name, (last, total, runs) in sorted(self.phases.items()):
+            lines.append("{0}phase_seconds{1} {2}".format(kPrefix,
+               FormatLabels([("phase", name)]), last))
+         lines.append("# TYPE {0}phase_seconds_total counter".format(kPrefix))
+         for name, (last, total, runs) in sorted(self.phases.items()):
+            lines.append("{0}phase_seconds_total{1} {2}".format(kPrefix,
+               FormatLabels([("phase", name)]), total))
+         typed = set()
+         for (name, labels), value in sorted(self.counters.items()):
+            if name in self.gauges:
+               family, kind = name, "gauge"
+            else:
+               # counts only ever go up over the life of the process.
+               family, kind = name + "_total", "counter"
+            if family not in typed:
+               lines.append("# TYPE {0}{1} {2}".format(kPrefix, family, kind))
+               typed.add(family)
+            lines.append("{0}{1}{2} {3}".format(kPrefix, family, FormatLabels(labels),
+               value))
+         # the maximums go in their own family after the summaries.
+         for suffix in ("", "_max"):
+            typed = set()
+            for (name, labels), (count, total, most) in sorted(self.timings.items()):
+               family = "{0}{1}_seconds{2}".format(kPrefix, name, suffix)
+               if family not in typed:
+                  lines.append("# TYPE {0} {1}".format(family,
+                     "gauge" if suffix else "summary"))
+                  typed.add(family)
+               if suffix:
+                  lines.append("{0}{1} {2}".format(family, FormatLabels(labels), most))
+               else:
+                  lines.append("{0}_count{1} {2}".format(family, FormatLabels(labels), count))
+                  lines.append("{0}_sum{1} {2}".format(family, FormatLabels(labels), total))
+         lines.append("{0}last_run_timestamp_seconds {1}".format(kPrefix, int(time())))
+      return "\n".join(lines) + "\n"
+
+   def Write(self, path):
+      if path.endswith(".prom"):
+         data = self.AsPrometheus()
+      else:
+         data = json.dumps(self.AsDict(), indent=3, sort_keys=True)
+      tmpFile = path + ".tmp"
+      with open(tmpFile, "wt") as f:
+         f.write(data)
+      os.rename(tmpFile, path)
@@ -0,0 +1,194 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   botStreamer.py -- the streaming version of the bot, which listens to our
+   user stream for events (right now, just quote tweets) and passes them on to
+   the periodic bot through the EventQueue.
+
+   This is only imported when we're run with --stream, so the cron version of
+   the bot never has to load the streaming code.
+'''
+
+from time import sleep
+from time import time
+
+import json
+import Queue
+import threading
+
+from requests.exceptions import RequestException
+from twython import TwythonStreamer
+from twython.exceptions import TwythonError
+
+from eventQueue import EventQueue
+
+# how many events a worker writes to the queue at once.
+kEventBatchSize = 100
+
+# number of threads that write events to the queue, how many events can wait
+# for them before we start dropping events, how long (seconds) without even a
+# keep-alive before we decide the stream has stalled, and the range of time we
+# wait before reconnecting.
+kStreamWorkers = 2
+kMaxPendingEvents = 10000
+kStreamStallTimeout = 90
+kMinReconnectWait = 5
+kMaxReconnectWait = 320
+
+
+class BotStreamer(TwythonStreamer):
+   '''
+      Handles events streaming down from our user account. Reading the stream
+      should never wait on anything else, so on_success() just drops the events
+      we care about into a bounded in-memory queue, and a few worker threads
+      take them from there & add them (in batches) to the EventQueue that the
+      periodic bot process reads. If the in-memory queue is ever full, we drop
+      the event and count it rather than holding up the stream.
+   '''
+   # if set, connect here instead of Twitter's user stream (e.g. FakeTwitter.py)
+   userUrl = None
+
+   def Start(self, queuePath, numWorkers=kStreamWorkers, maxPending=kMaxPendingEvents):
+      ''' start the worker threads that move events into the queue at queuePath. '''
+      self.pending = Queue.Queue(maxPending)
+      # the workers all add to 'handled'.
+      self.lock = threading.Lock()
+      self.dropped = 0
+      self.handled = 0
+      self.errors = 0
+      self.workers = []
+      for i in range(numWorkers):
+         t = threading.Thread(target=self.Worker, args=(queuePath,))
+         t.daemon = True
+         t.start()
+         self.workers.append(t)
+
+   def Stop(self):
+      ''' finish writing everything that's pending, then stop the workers. '''
+      for t in self.workers:
+         self.pending.put(None)
+      for t in self.workers:
+         t.join()
+      self.workers = []
+
+   def Stats(self):
+      with self.lock:
+         handled = self.handled
+      return {"pending": self.pending.qsize(), "dropped": self.dropped,
+         "handled": handled, "errors": self.errors}
+
+   def Worker(self, queuePath):
+      # each thread needs its own connection to the database.
+      queue = EventQueue(queuePath)
+      done = False
+      while not done:
+         batch = []
+         event = self.pending.get()
+         # grab whatever else is waiting so we can write it all at once. None
+         # means that Stop() wants this thread to finish.
+         while event is not None:
+            batch.append(event)
+            if len(batch) >= kEventBatchSize:
+               break
+            try:
+               event = self.pending.get_nowait()
+            except Queue.Empty:
+               break
+         if event is None:
+            done = True
+         if batch:
+            queue.EnqueueMany(batch)
+            with self.lock:
+               self.handled += len(batch)
+      queue.Close()
+
+   def on_success(self, data):
+      # for now, all we're interested in handling are quoted tweets.
+      if 'event' in data:
+         if data['event'] == 'quoted_tweet':
+            # get the id of the tweet that quotes us:
+            tweetId = data['target_object']['id_str']
+            # hand it off to be added to the queue that the other (periodic)
+            # cron-job bot process will handle. We keep the whole event, so if
+            # we want to do more using the streaming API later, the other
+            # process has everything it needs.
+            # Example -- we may want to extend the replies to questions so that we also
+            # reply to questions in quote tweets as well.
+            try:
+               self.pending.put_nowait((data['event'], tweetId, data))
+            except Queue.Full:
+               self.dropped += 1
+
+
+   def on_error(self, status_code, data):
+      print "ERROR: {0}".format(status_code)
+      self.errors += 1
+      # Stream() will reconnect after waiting a while.
+      self.disconnect()
+
+   def on_timeout(self):
+      # we haven't even had a keep-alive in a while; the connection has stalled.
+      print "Stream stalled."
+      self.disconnect()
+
+   def User(self):
+      ''' stay connected to the user stream until we're disconnected. '''
+      if self.userUrl:
+         self._request(self.userUrl, params={})
+      else:
+         self.user()
+
+   def Stream(self):
+      ''' Stay connected to the user stream until we're interrupted. Any time
+         we're disconnected, wait and then reconnect, waiting twice as long
+         each time the connection fails (up to kMaxReconnectWait seconds.)
+      '''
+      wait = kMinReconnectWait
+      while True:
+         connected = time()
+         try:
+            self.User()
+         except (TwythonError, RequestException) as e:
+            # (a dropped connection shows up as a ConnectionError or a
+            # ChunkedEncodingError from requests, not as a TwythonError.)
+            print "ERROR: {0}".format(str(e))
+            self.errors += 1
+         except AttributeError:
+            # once on_timeout() has disconnected us, twython goes on to read
+            # the lines of a response that it never got (None).
+            if self.connected:
+               raise
+            self.errors += 1
+         if time() - connected > kMaxReconnectWait:
+            # we'd been connected for a good while, so start over with short waits.
+            wait = kMinReconnectWait
+         print "Reconnecting in {0} seconds. {1}".format(wait, self.Stats())
+         sleep(wait)
+         wait = min(wait * 2, kMaxReconnectWait)
+
+   def Replay(self, lines):
+      ''' feed a recorded stream (one json event per line) through on_success(),
+         just like the real stream would.
+      '''
+      for line in lines:
+         line = line.strip()
+         if line:
+            self.on_success(json.loads(line))
@@ -0,0 +1,129 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   botTick.py -- decide whether a cron run of the bot has anything to do
+   without loading the rest of the bot.
+
+   At the end of every run, the bot writes a small snapshot of what the next
+   run needs to know (tmbotg_tick.json): when we last tweeted & the settings
+   that decide when we tweet next, when the next mention poll is due, whether
+   the event queue was empty (and when its files last changed), and whether
+   anything is waiting in the outbox or the deferred calls.
+
+   Most runs of the bot find nothing to do, so tmbotg.py checks the snapshot
+   first and exits right away if it says we're idle -- before the network
+   libraries are imported or a Twitter client is created. If we roll the dice
+   on tweeting here, the roll is handed on to CreateUpdate() so that we never
+   roll twice in one run.
+
+   An idle run should take less than kIdleTickTargetMs from process start to
+   exit; BotBench.py measures it.
+'''
+
+from glob import glob
+from random import random
+from time import time
+
+import json
+import os
+
+kTickFile = "tmbotg_tick.json"
+
+# how long (ms) an idle cron run should take, start to finish.
+kIdleTickTargetMs = 50
+
+# cron doesn't start us at exactly the same second every minute, so a mention
+# poll that's due within this many seconds counts as due now.
+kTickSlack = 5
+
+
+def ShouldTweet(lastTweetAge, roll, tweetProbability, minimumSpacing, maximumSpacing):
+   ''' the bot's rule for whether a run tweets: always if it's been more than
+      maximumSpacing seconds since the last tweet, otherwise only if the roll
+      comes up under tweetProbability and it's been more than minimumSpacing
+      seconds. (Written with & and | so that ScheduleSim.py can hand it NumPy
+      arrays.)
+   '''
+   return (lastTweetAge > maximumSpacing) | \
+      ((roll < tweetProbability) & (lastTweetAge > minimumSpacing))
+
+
+def QueueChanged(queuePath):
+   ''' the latest modification time of the event queue's files. The streamer
+      writes to the WAL file, so that's usually the one that changes.
+   '''
+   latest = 0
+   for path in (queuePath, queuePath + "-wal"):
+      try:
+         latest = max(latest, os.path.getmtime(path))
+      except OSError:
+         pass
+   return latest
+
+
+def WriteTick(path, tick):
+   tmpFile = path + ".tmp"
+   with open(tmpFile, "wt") as f:
+      json.dump(tick, f)
+   os.rename(tmpFile, path)
+
+
+def ReadTick(path):
+   try:
+      with open(path, "rt") as f:
+         return json.load(f)
+   except (IOError, ValueError):
+      return None
+
+
+def CheckTick(botPath, settingsFile, now=None):
+   ''' returns a tuple (idle, roll). If idle is True, there's nothing for this
+      run to do. roll is the random number that we compared to the tweet
+      probability, or None if we didn't get that far.
+   '''
+   if now is None:
+      now = time()
+   tickPath = os.path.join(botPath, kTickFile)
+   tick = ReadTick(tickPath)
+   if tick is None:
+      return (False, None)
+   try:
+      if os.path.getmtime(settingsFile) > os.path.getmtime(tickPath):
+         # someone's edited the settings since the snapshot was written.
+         return (False, None)
+   except OSError:
+      return (False, None)
+
+   if tick["outboxPending"] or tick["deferredCalls"]:
+      return (False, None)
+   if now >= tick["nextMentionPoll"] - kTickSlack:
+      return (False, None)
+   if not tick["eventQueueEmpty"] or \
+      QueueChanged(tick["eventQueuePath"]) > tick["eventQueueChanged"]:
+      return (False, None)
+   if glob(os.path.join(botPath, "*.fav")):
+      return (False, None)
+
+   roll = random()
+   if ShouldTweet(now - tick["lastUpdate"], roll, tick["tweetProbability"],
+      tick["minimumSpacing"], tick["maximumSpacing"]):
+      return (False, roll)
+   return (True, roll)
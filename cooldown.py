@@ -0,0 +1,163 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   cooldown.py -- keep track of which songs we're allowed to use today.
+
+   Rather than picking a random song and then checking the history to see if
+   we've used it too recently, we keep the songs that are cooling down (a dict,
+   and a heap ordered by the day that each one becomes eligible again.) Only
+   songs in the history can be cooling down, so setting this up never has to
+   look at the rest of the corpus: the index finds each of those songs by name
+   with a binary search. Every other song is eligible, so usually a few random
+   picks find one; only when nearly everything is resting do we make a list
+   of the eligible songs to choose from.
+
+   ChooseLine() picks a single line for a reply to a question from the index's
+   table of lines sorted by length, skipping lines from songs that are
+   cooling down.
+'''
+
+from datetime import date
+from heapq import heappop
+from heapq import heappush
+from random import choice
+from random import randrange
+
+from lyricIndex import Utf8
+
+# how many random lines/songs ChooseLine() tries before giving up.
+kLineAttempts = 20
+
+# how many random songs Choose() tries before it lists the eligible ones.
+kChooseAttempts = 20
+
+
+def HistoryKey(album, title):
+   ''' the key that we use for a song in the history file. '''
+   return "{0}_{1}".format(album, title)
+
+
+def RestDays(minimumDaySpacing):
+   ''' how many days (counting the day we use it) a song can't be used again:
+      it has to have been more than minimumDaySpacing days.
+   '''
+   return minimumDaySpacing + 1
+
+
+class CooldownIndex(object):
+   def __init__(self, index, history, minimumDaySpacing, today=None):
+      '''
+         index: the LyricIndex of all the songs we know about.
+         history: settings object mapping HistoryKey() -> date ordinal last used.
+         minimumDaySpacing: number of days a song has to rest after we use it.
+
+         tooSoon counts the random lines that ChooseLine() had to pass over
+         because their song was still cooling down.
+      '''
+      if today is None:
+         today = date.today().toordinal()
+      self.index = index
+      self.minimumDaySpacing = minimumDaySpacing
+      restDays = RestDays(minimumDaySpacing)
+      # trackId -> the day that it's eligible again
+      self.cooling = {}
+      self.coolingDown = []
+      self.tooSoon = 0
+      for key, lastUsed in history.Items():
+         if not lastUsed or today - lastUsed >= restDays:
+            continue
+         parts = key.split("_")
+         if 2 != len(parts):
+            continue
+         trackId = self.TrackId(*parts)
+         if trackId is not None and trackId not in self.cooling:
+            self.cooling[trackId] = lastUsed + restDays
+            heappush(self.coolingDown, (lastUsed + restDays, trackId))
+
+   def TrackId(self, album, title):
+      return self.index.FindTrack(Utf8(album), Utf8(title))
+
+   def IsEligible(self, album, title):
+      ''' can we use this song right now? (call Release() first to be up to date) '''
+      trackId = self.TrackId(album, title)
+      return trackId is not None and trackId not in self.cooling
+
+   def Release(self, today=None):
+      ''' every song whose cooldown is over is eligible again. '''
+      if today is None:
+         today = date.today().toordinal()
+      while self.coolingDown and self.coolingDown[0][0] <= today:
+         day, trackId = heappop(self.coolingDown)
+         del self.cooling[trackId]
+
+   def Count(self, today=None):
+      ''' how many songs could we use right now? '''
+      self.Release(today)
+      return self.index.numTracks - len(self.cooling)
+
+   def Choose(self, today=None):
+      ''' return the id of a random eligible song, or None if there aren't any. '''
+      self.Release(today)
+      numTracks = self.index.numTracks
+      if len(self.cooling) >= numTracks:
+         return None
+      for i in range(kChooseAttempts):
+         trackId = randrange(numTracks)
+         if trackId not in self.cooling:
+            return trackId
+      return choice([trackId for trackId in xrange(numTracks)
+         if trackId not in self.cooling])
+
+   def MarkUsed(self, trackId, today=None):
+      ''' we just used this song, so it needs to cool down. '''
+      if today is None:
+         today = date.today().toordinal()
+      if trackId is not None and trackId not in self.cooling:
+         day = today + RestDays(self.minimumDaySpacing)
+         self.cooling[trackId] = day
+         heappush(self.coolingDown, (day, trackId))
+
+   def ChooseLine(self, maxLength, today=None, attempts=kLineAttempts):
+      ''' return the id of a random line no longer than maxLength from an
+         eligible song, or None if we can't find one.
+      '''
+      self.Release(today)
+      index = self.index
+      first, end = index.ShortLines(maxLength)
+      if first < end:
+         for i in range(attempts):
+            lineId = index.linesByLength[randrange(first, end)]
+            if index.LineTrack(lineId) not in self.cooling:
+               return lineId
+            self.tooSoon += 1
+      # almost all of the lines that fit must be in songs that are cooling
+      # down, so look through some of the eligible songs for a line instead.
+      for i in range(attempts):
+         trackId = self.Choose(today)
+         if trackId is None:
+            break
+         stanzas = index.StanzaRange(trackId)
+         lines = range(index.stanzaLine[stanzas[0]], index.stanzaLine[stanzas[1]])
+         lines = [lineId for lineId in lines
+            if 0 < index.LineLength(lineId) <= maxLength]
+         if lines:
+            return choice(lines)
+      return None
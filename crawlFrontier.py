@@ -0,0 +1,151 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   crawlFrontier.py -- every page that a GetLyrics.py crawl still has to
+   process (or has already processed), saved in a SQLite file so a crawl that's
+   stopped part way through can pick up where it left off.
+
+   Each entry is a discography, album or track page, along with the album &
+   track names that go with it. Entries start out 'pending'; once a page has
+   been processed (and any pages it links to have been Add()ed) it's 'done'.
+   A page that couldn't be processed is 'failed', with how many times we've
+   tried it and the last error. RetryFailed() gives the failed pages another
+   chance, up to kMaxAttempts tries each.
+
+   A track that's listed on more than one album is kept once per album, since
+   each album gets its own lyric file.
+'''
+
+from time import time
+
+import sqlite3
+import threading
+
+kMaxAttempts = 3
+
+kSchema = '''
+CREATE TABLE IF NOT EXISTS frontier (
+   url TEXT NOT NULL,
+   album TEXT NOT NULL DEFAULT '',
+   kind TEXT NOT NULL,
+   track TEXT NOT NULL DEFAULT '',
+   state TEXT NOT NULL DEFAULT 'pending',
+   attempts INTEGER NOT NULL DEFAULT 0,
+   added INTEGER NOT NULL,
+   lastError TEXT,
+   PRIMARY KEY (url, album)
+)
+'''
+
+
+def Unicode(s):
+   ''' album & track names are UTF-8 strs in the rest of the crawler. '''
+   if isinstance(s, str):
+      return s.decode("utf-8")
+   return s or u""
+
+
+class FrontierEntry(object):
+   def __init__(self, row):
+      self.url, album, self.kind, track, self.attempts = row
+      self.album = album.encode("utf-8")
+      self.track = track.encode("utf-8")
+
+
+class Frontier(object):
+   def __init__(self, path):
+      # the crawl's worker threads all share this connection, and we don't
+      # want their transactions to interleave.
+      self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+      self.db.execute("PRAGMA journal_mode=WAL")
+      self.db.execute(kSchema)
+      self.db.commit()
+      self.lock = threading.Lock()
+
+   def Close(self):
+      self.db.close()
+
+   def Add(self, url, kind, album=None, track=None, again=False):
+      ''' add a page to be processed. A page that's already in the frontier (in
+         any state) isn't added again, unless 'again' is True, in which case it
+         goes back to being pending. Returns True if the page is now pending
+         because of this call.
+      '''
+      with self.lock, self.db:
+         cursor = self.db.execute("INSERT OR IGNORE INTO frontier (url, album, "
+            "kind, track, added) VALUES (?, ?, ?, ?, ?)",
+            (url, Unicode(album), kind, Unicode(track), int(time())))
+         if not cursor.rowcount and again:
+            cursor = self.db.execute("UPDATE frontier SET state = 'pending', "
+               "attempts = 0 WHERE url = ? AND album = ? AND state != 'pending'",
+               (url, Unicode(album)))
+      return 1 == cursor.rowcount
+
+   def Pending(self):
+      ''' return a list of FrontierEntry for every page still waiting to be
+         processed, in the order they were added.
+      '''
+      with self.lock:
+         rows = self.db.execute("SELECT url, album, kind, track, attempts "
+            "FROM frontier WHERE state = 'pending' ORDER BY rowid").fetchall()
+      return [FrontierEntry(row) for row in rows]
+
+   def Done(self, entry):
+      self.SetState(entry, "done", None)
+
+   def Failed(self, entry, error):
+      self.SetState(entry, "failed", error)
+
+   def SetState(self, entry, state, error):
+      with self.lock, self.db:
+         self.db.execute("UPDATE frontier SET state = ?, attempts = attempts + 1, "
+            "lastError = ? WHERE url = ? AND album = ?",
+            (state, error, entry.url, Unicode(entry.album)))
+
+   def RetryFailed(self):
+      ''' put every failed page that we haven't given up on back in the
+         pending state. Returns how many there were.
+      '''
+      with self.lock, self.db:
+         cursor = self.db.execute("UPDATE frontier SET state = 'pending' "
+            "WHERE state = 'failed' AND attempts < ?", (kMaxAttempts,))
+      return cursor.rowcount
+
+   def Restart(self):
+      ''' get ready for a new crawl: forget the pages that were finished last
+         time, and give the ones that failed a fresh set of attempts.
+      '''
+      with self.lock, self.db:
+         self.db.execute("DELETE FROM frontier WHERE state = 'done'")
+         self.db.execute("UPDATE frontier SET state = 'pending', attempts = 0")
+
+   def Counts(self):
+      ''' return a dict {state: number of pages}. '''
+      with self.lock:
+         rows = self.db.execute(
+            "SELECT state, COUNT(*) FROM frontier GROUP BY state").fetchall()
+      return dict(rows)
+
+   def Failures(self):
+      ''' return a list of (url, attempts, lastError) for the pages that failed. '''
+      with self.lock:
+         return self.db.execute("SELECT url, attempts, lastError FROM frontier "
+            "WHERE state = 'failed' ORDER BY rowid").fetchall()
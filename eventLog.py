@@ -0,0 +1,136 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   eventLog.py -- buffered writer for the bot's event log.
+
+   Each entry looks like:
+   timestamp\tevent\tdata1\tdata2 <etc>\n
+   and, if a json path is given, the same entry is also written as a line of
+   json ({"time": ..., "event": ..., "data": [...]}) to a second file.
+
+   Entries are kept in memory until Flush() is called (at the end of a run),
+   or until enough of them pile up or the oldest one has waited long enough.
+   The log file stays open between flushes. Its name is passed through
+   strftime() so we can write e.g. a file per month; we only re-expand the
+   name when the minute changes, and switch files when the expansion does.
+'''
+
+from datetime import datetime
+from time import time
+
+import json
+import threading
+
+# flush once we're holding this many entries...
+kMaxBufferedEntries = 100
+# ...or the oldest entry has been waiting this many seconds.
+kMaxBufferAge = 60
+
+
+class LogFile(object):
+   ''' one strftime()-named file that we append lines to. '''
+   def __init__(self, pathFormat):
+      self.pathFormat = pathFormat
+      self.path = None
+      self.minute = None
+      self.file = None
+      self.lines = []
+      self.bytesWritten = 0
+
+   def Add(self, now, line):
+      minute = now // 60
+      if minute != self.minute:
+         self.minute = minute
+         path = datetime.fromtimestamp(now).strftime(self.pathFormat)
+         if path != self.path:
+            # everything already buffered belongs in the old file.
+            self.Flush()
+            self.Close()
+            self.path = path
+      self.lines.append(line)
+
+   def Flush(self):
+      if self.lines:
+         if self.file is None:
+            self.file = open(self.path, "a+t")
+         data = "".join(self.lines)
+         self.file.write(data)
+         self.file.flush()
+         self.bytesWritten += len(data)
+         self.lines = []
+
+   def Close(self):
+      if self.file is not None:
+         self.file.close()
+         self.file = None
+
+
+class EventLog(object):
+   def __init__(self, pathFormat, jsonPathFormat=None,
+      maxEntries=kMaxBufferedEntries, maxAge=kMaxBufferAge):
+      '''
+         pathFormat: strftime() format for the path of the tab-separated log.
+         jsonPathFormat: if not None, strftime() format for the path of a
+            newline-delimited json copy of the log.
+      '''
+      self.files = [LogFile(pathFormat)]
+      self.jsonFile = None
+      if jsonPathFormat:
+         self.jsonFile = LogFile(jsonPathFormat)
+         self.files.append(self.jsonFile)
+      self.maxEntries = maxEntries
+      self.maxAge = maxAge
+      self.count = 0
+      self.oldest = None
+      self.lock = threading.Lock()
+
+   def Log(self, eventType, dataList):
+      now = int(time())
+      line = "{0}\t{1}\t{2}\n".format(now, eventType, "\t".join(dataList))
+      with self.lock:
+         self.files[0].Add(now, line)
+         if self.jsonFile:
+            entry = {"time": now, "event": eventType, "data": list(dataList)}
+            self.jsonFile.Add(now, json.dumps(entry) + "\n")
+         self.count += 1
+         if self.oldest is None:
+            self.oldest = now
+         if self.count >= self.maxEntries or now - self.oldest >= self.maxAge:
+            self._Flush()
+
+   def _Flush(self):
+      for f in self.files:
+         f.Flush()
+      self.count = 0
+      self.oldest = None
+
+   def Flush(self):
+      with self.lock:
+         self._Flush()
+
+   def BytesWritten(self):
+      return sum(f.bytesWritten for f in self.files)
+
+   def Close(self):
+      with self.lock:
+         self._Flush()
+         for f in self.files:
+            f.Close()
@@ -0,0 +1,90 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   eventQueue.py -- a queue of events in a single SQLite file, used to pass
+   events from the streaming bot process to the periodic one.
+
+   The streamer Enqueue()s each event that it wants handled, along with the
+   whole event that came down the stream. The periodic process Dequeue()s a
+   batch, handles it, and only then Ack()s it, which is what removes it from
+   the queue. If we crash part way through a batch, that batch is handled
+   again next time.
+'''
+
+import json
+import sqlite3
+
+kSchema = '''
+CREATE TABLE IF NOT EXISTS events (
+   id INTEGER PRIMARY KEY AUTOINCREMENT,
+   kind TEXT NOT NULL,
+   tweetId TEXT NOT NULL,
+   payload TEXT,
+   UNIQUE (kind, tweetId)
+)
+'''
+
+
+class EventQueue(object):
+   def __init__(self, path):
+      # WAL mode lets the streamer keep adding events while the other process
+      # is reading them.
+      # (check_same_thread=False because MultiBot may run a bot on a different
+      # worker thread each time.)
+      self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+      self.db.execute("PRAGMA journal_mode=WAL")
+      self.db.execute(kSchema)
+      self.db.commit()
+
+   def Close(self):
+      self.db.close()
+
+   def Enqueue(self, kind, tweetId, payload=None):
+      self.EnqueueMany([(kind, tweetId, payload)])
+
+   def EnqueueMany(self, events):
+      ''' add a list of (kind, tweetId, payload) events in a single transaction.
+         An event that's already waiting in the queue isn't added twice.
+      '''
+      with self.db:
+         self.db.executemany(
+            "INSERT OR IGNORE INTO events (kind, tweetId, payload) VALUES (?, ?, ?)",
+            [(kind, tweetId, json.dumps(payload)) for kind, tweetId, payload in events])
+
+   def Dequeue(self, limit=100):
+      ''' return a list of up to 'limit' of the oldest events, each a tuple
+         (eventId, kind, tweetId, payload). They stay in the queue until they're
+         Ack()ed.
+      '''
+      rows = self.db.execute(
+         "SELECT id, kind, tweetId, payload FROM events ORDER BY id LIMIT ?",
+         (limit,)).fetchall()
+      return [(eventId, kind, tweetId, json.loads(payload))
+         for eventId, kind, tweetId, payload in rows]
+
+   def Ack(self, eventIds):
+      ''' we're done with these events; remove them from the queue. '''
+      with self.db:
+         self.db.executemany("DELETE FROM events WHERE id = ?",
+            [(eventId,) for eventId in eventIds])
+
+   def IsEmpty(self):
+      return self.db.execute("SELECT 1 FROM events LIMIT 1").fetchone() is None
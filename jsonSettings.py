@@ -26,10 +26,27 @@
    or an object
    settings.key
 
-
+   Files that grow a key at a time (like the bot's history) can be opened in
+   journal mode. Instead of rewriting the whole file, Write() then appends just
+   the keys that changed to a '<file>.journal' file, one json record per line.
+   Loading reads the file and then replays the journal on top of it, and once
+   the journal gets long enough we fold it back into the main file (compaction).
+
+   The main file is always replaced by writing a temp file and renaming it, so a
+   crash part way through a write can't leave us with a truncated settings file.
 '''
 
 import json
+import os
+
+kSettingsFileErrorMsg = '''\
+There was no settings file found at {0}, so I just created an empty/default
+file for you. Please edit it, adding the correct/desired values for each
+setting as is appropriate.
+'''
+
+# compact the journal once it holds this many records.
+kCompactThreshold = 500
 
 class SettingsFileError(Exception):
    def __init__(self, msg):
@@ -49,9 +66,16 @@ class JsonSettings(object):
 
       We separate
    '''
-   def __init__(self, settingsFile, defaultDict=None):
+   def __init__(self, settingsFile, defaultDict=None, journal=False,
+      compactThreshold=kCompactThreshold):
       if defaultDict is None:
          defaultDict = {"newFile": "PLEASE EDIT THIS FILE"}
+      self._journal = journal
+      self._journalFile = settingsFile + ".journal"
+      self._journalCount = 0
+      self._compactThreshold = compactThreshold
+      self._changed = set()
+      self._bytesWritten = 0
       try:
          self._settingsFile = settingsFile
          with open(settingsFile, "rt") as f:
@@ -64,17 +88,89 @@ class JsonSettings(object):
          self._isDirty = True
          self.Write()
          raise SettingsFileError(kSettingsFileErrorMsg.format(settingsFile))
+      if journal:
+         self.Replay()
+
+   def Replay(self):
+      ''' apply any changes in the journal to the settings we just loaded. '''
+      torn = False
+      try:
+         with open(self._journalFile, "rt") as f:
+            for line in f:
+               try:
+                  if not line.endswith("\n"):
+                     raise ValueError("incomplete record")
+                  record = json.loads(line)
+               except ValueError:
+                  # a write that was interrupted part way through. Nothing
+                  # after it can have been written completely either.
+                  torn = True
+                  break
+               self._settings[record["key"]] = record["value"]
+               self._journalCount += 1
+      except IOError:
+         # no journal, nothing to replay.
+         pass
+      if torn:
+         # don't append anything after the broken record, or we'd never be
+         # able to read it back.
+         self.Compact()
 
    def Write(self):
       try:
          if self._isDirty: 
-            with open(self._settingsFile, "wt") as f:
-               f.write(json.dumps(self._settings, indent=3, 
-                  separators=(',', ': ') ))
+            if self._journal and os.path.exists(self._settingsFile):
+               self.WriteJournal()
+               if self._journalCount >= self._compactThreshold:
+                  self.Compact()
+            else:
+               self.WriteFile()
             self._isDirty = False
+            self._changed = set()
       except IOError, e:
          print "Error writing settings file: {0}".format(str(e))
-         raise SettingsFileError()
+         raise SettingsFileError(str(e))
+
+   def WriteFile(self):
+      ''' replace the whole settings file by writing a new one & renaming it. '''
+      tmpFile = self._settingsFile + ".tmp"
+      data = json.dumps(self._settings, indent=3, separators=(',', ': '))
+      with open(tmpFile, "wt") as f:
+         f.write(data)
+         f.flush()
+         os.fsync(f.fileno())
+      os.rename(tmpFile, self._settingsFile)
+      self._bytesWritten += len(data)
+
+   def WriteJournal(self):
+      ''' append a record to the journal for each key that's changed. '''
+      with open(self._journalFile, "at") as f:
+         for key in self._changed:
+            record = {"key": key, "value": self._settings.get(key, None)}
+            line = json.dumps(record, separators=(',', ':')) + "\n"
+            f.write(line)
+            self._bytesWritten += len(line)
+         f.flush()
+         os.fsync(f.fileno())
+      self._journalCount += len(self._changed)
+
+   def Compact(self):
+      ''' fold the journal into the main file. If we crash after writing the
+         file but before removing the journal, replaying the journal again
+         on the next load is harmless.
+      '''
+      self.WriteFile()
+      if os.path.exists(self._journalFile):
+         os.remove(self._journalFile)
+      self._journalCount = 0
+
+   def Items(self):
+      ''' a list of (key, value) pairs for every setting. '''
+      return self._settings.items()
+
+   def BytesWritten(self):
+      ''' total bytes written to the settings file & journal by this object. '''
+      return self._bytesWritten
 
    def __getitem__(self, key):
       ''' get an item from settings as if this were a dict. 
@@ -93,6 +189,7 @@ class JsonSettings(object):
    def __setattr__(self, key, val):
       if not key.startswith('_'):
          self._settings[key] = val
+         self._changed.add(key)
          self._isDirty = True
       else:
          # we need to prevent recursion!
@@ -100,4 +197,5 @@ class JsonSettings(object):
 
    def __setitem__(self, key, val):
       self._settings[key] = val
-      self._isDirty = True
\ No newline at end of file
+      self._changed.add(key)
+      self._isDirty = True
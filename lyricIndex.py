@@ -0,0 +1,542 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   lyricIndex.py -- compile all of the *.lyric files written by GetLyrics.py
+   into a single packed index file that the bot can mmap() and pull stanzas
+   out of without opening/decoding every lyric file on each run.
+
+   File layout (all integers are little-endian unsigned 32 bit):
+
+   header   : magic, version, numAlbums, numTracks, numStanzas, numLines,
+              numFiles, newestFile  (the lyric files that the index was built
+                                     from; newestFile is a double -- see
+                                     CorpusSignature())
+   names    : nameOffsets[numAlbums + numTracks + 1] (albums first, then tracks)
+   tracks   : trackAlbum[numTracks]
+              trackStanza[numTracks + 1]    (first stanza of each track)
+              trackHash[numTracks]          (NameHash() of every track, sorted)
+              hashTrack[numTracks]          (the track id for each trackHash)
+   stanzas  : stanzaTrack[numStanzas]
+              stanzaLine[numStanzas + 1]    (first line of each stanza)
+   lines    : lineOffset[numLines + 1]      (byte offset into the text blob)
+              lineCum[numLines + 1]         (running total of line length + 1)
+              shortestLine[numLines]        (shortest line so far in the stanza)
+              lineStanza[numLines]          (stanza that each line is in)
+   replies  : linesByLength[numLines]       (line ids, shortest first)
+              lengthStart[kMaxLineLength + 3] (lengthStart[n] = number of lines
+                                             shorter than n characters)
+   name blob: UTF-8 album & track names
+   text blob: UTF-8 lyric text, every line followed by a single newline.
+
+   Because every line is followed by exactly one newline, the text of lines
+   a..b (inclusive) is just text[lineOffset[a]:lineOffset[b+1]-1], already
+   joined the same way that we'd join them for a tweet. In the same way, the
+   length in characters of that run of lines is lineCum[b+1] - lineCum[a] - 1,
+   which lets FitRun() find a run of lines that fits in a tweet with a binary
+   search instead of trimming lines off one at a time.
+
+   The replies section is for replies to questions, which are a single line.
+   All of the lines that are at most n characters long are
+   linesByLength[lengthStart[1]:lengthStart[n + 1]] (skipping the empty ones),
+   so picking a random line that fits is a single step. Lines longer than
+   kMaxLineLength are all counted as kMaxLineLength + 1 characters long.
+
+   Run from the command line to (re)build an index by hand:
+      python lyricIndex.py "data/*.lyric" data/lyrics.idx
+'''
+
+from array import array
+from bisect import bisect_left
+from glob import glob
+from math import log
+from random import random
+from zlib import crc32
+
+import mmap
+import os
+import struct
+import sys
+import threading
+
+kMagic = "TMBI"
+kVersion = 6
+
+# the longest line that we'd ever be able to use on its own.
+kMaxLineLength = 280
+
+# how often FitRun() trims a line from the front of a stanza instead of the back.
+kFrontTrim = 0.2
+
+kHeaderFormat = "<4sIIIIIId"
+kHeaderSize = struct.calcsize(kHeaderFormat)
+kIntSize = 4
+
+
+class LyricIndexError(Exception):
+   def __init__(self, msg):
+      self.msg = msg
+
+   def __str__(self):
+      return self.msg
+
+
+def Utf8(s):
+   ''' album & track names are UTF-8 strs everywhere in the bot, but a file
+      pattern that came out of the (json) config file is unicode, and so are
+      the names that glob() returns for it.
+   '''
+   if isinstance(s, unicode):
+      return s.encode("utf-8")
+   return s
+
+
+def ParseFilename(filePath):
+   ''' we name files like "Album-Title_Track-Title.lyric". This function breaks
+      a string in that format apart and returns a tuple ("Album-Title", "Track-Title")
+      of UTF-8 strs.
+   '''
+   filePath = Utf8(filePath)
+   path, fileName = os.path.split(filePath)
+   base, ext = os.path.splitext(fileName)
+   return tuple(base.split("_"))
+
+
+def NameHash(album, track):
+   ''' a hash of a track's (UTF-8) album & track names that stays the same
+      from one run to the next.
+   '''
+   return crc32(album + "\0" + track) & 0xffffffff
+
+
+def PackInts(values):
+   return struct.pack("<{0}I".format(len(values)), *values)
+
+
+def FindFirst(lo, hi, test):
+   ''' binary search for the first index in lo..hi-1 where test(index) is true,
+      assuming that once test() starts returning True it keeps doing so. Returns
+      hi if there's no such index.
+   '''
+   while lo < hi:
+      mid = (lo + hi) // 2
+      if test(mid):
+         hi = mid
+      else:
+         lo = mid + 1
+   return lo
+
+
+def FitRun(lineCum, shortestLine, first, end, maxLength):
+   '''
+      Find a run of consecutive lines from first..end-1 that's no longer than
+      maxLength when joined with newlines. 'lineCum' holds the running total of
+      (line length + 1) for each line, and 'shortestLine' the length of the
+      shortest line seen so far in the stanza (see the layout notes above).
+
+      This picks the same runs, with the same odds, as the old code that
+      trimmed one line at a time (from the front kFrontTrim of the time, from
+      the back otherwise) until what was left fit. Instead of popping lines one
+      by one, we sample how many lines would come off the back before the next
+      one comes off the front, and binary search for where the run would fit
+      before then. If we'd be left with a single line that's too long by
+      itself, we start the run at the first line that does fit rather than
+      giving up.
+
+      Returns a tuple (firstLine, endLine), or None if no line in the range is
+      short enough to use.
+   '''
+   if lineCum[end] - lineCum[first] - 1 <= maxLength:
+      return (first, end)
+   if shortestLine[end - 1] > maxLength:
+      return None
+
+   start, stop = first, end
+   while stop - start > 1:
+      # the longest run starting at 'start' that fits, and how many lines we'd
+      # have to take off the back to get there (or to get down to one line.)
+      fitEnd = FindFirst(start + 1, stop + 1,
+         lambda i: lineCum[i] - lineCum[start] - 1 > maxLength) - 1
+      needed = stop - max(fitEnd, start + 1)
+      # the number of back trims before the next front trim is geometric.
+      backTrims = int(log(1.0 - random()) / log(1.0 - kFrontTrim))
+      if backTrims >= needed:
+         stop -= needed
+         break
+      stop -= backTrims
+      start += 1
+
+   if lineCum[stop] - lineCum[start] - 1 <= maxLength:
+      return (start, stop)
+   start = FindFirst(first, end, lambda i: shortestLine[i] <= maxLength)
+   stop = FindFirst(start + 1, end + 1,
+      lambda i: lineCum[i] - lineCum[start] - 1 > maxLength) - 1
+   return (start, stop)
+
+
+def CorpusSignature(fileNames):
+   ''' Summarize a set of lyric files as (number of files, newest modification
+      time). GetLyrics writes every new or replaced lyric file into place, so
+      it always has a newer mtime than the index that came before it, and
+      removing a file changes the count; either way the signature changes.
+   '''
+   newest = 0.0
+   count = 0
+   for fName in fileNames:
+      try:
+         newest = max(newest, os.path.getmtime(fName))
+      except OSError:
+         # deleted out from under us.
+         continue
+      count += 1
+   return (count, newest)
+
+
+def CompileCorpus(filePattern, indexPath):
+   ''' Read every lyric file matching 'filePattern' and write a packed index
+      to 'indexPath'. The index is written to a temp file and renamed into
+      place so a bot that's running at the same time never sees a partial
+      file.
+
+      Returns the number of tracks that were written into the index.
+   '''
+   albums = []
+   albumIds = {}
+   trackNames = []
+   trackAlbum = []
+   trackStanza = []
+   stanzaTrack = []
+   stanzaLine = []
+   lineOffset = []
+   lineCum = [0]
+   shortestLine = []
+   lineStanza = []
+   lineLength = []
+   text = []
+   textSize = 0
+
+   fileNames = sorted(glob(Utf8(filePattern)))
+   # take the signature before reading anything, so a file that changes while
+   # we're reading makes this index look stale rather than current.
+   numFiles, newestFile = CorpusSignature(fileNames)
+   for fName in fileNames:
+      parts = ParseFilename(fName)
+      if 2 != len(parts):
+         # not a name that we wrote, so we couldn't log/track it anyway.
+         continue
+      album, track = parts
+      with open(fName, "rt") as f:
+         data = f.read().decode("utf-8")
+      stanzas = [s.strip() for s in data.split("\n\n")]
+      stanzas = [s for s in stanzas if s]
+      if not stanzas:
+         continue
+
+      if album not in albumIds:
+         albumIds[album] = len(albums)
+         albums.append(album)
+      trackId = len(trackNames)
+      trackNames.append(track)
+      trackAlbum.append(albumIds[album])
+      trackStanza.append(len(stanzaTrack))
+
+      for stanza in stanzas:
+         stanzaId = len(stanzaTrack)
+         stanzaTrack.append(trackId)
+         stanzaLine.append(len(lineOffset))
+         shortest = len(stanza)
+         for line in stanza.split("\n"):
+            encoded = line.encode("utf-8") + "\n"
+            lineOffset.append(textSize)
+            lineCum.append(lineCum[-1] + len(line) + 1)
+            shortest = min(shortest, len(line))
+            shortestLine.append(shortest)
+            lineStanza.append(stanzaId)
+            lineLength.append(min(len(line), kMaxLineLength + 1))
+            text.append(encoded)
+            textSize += len(encoded)
+
+   trackStanza.append(len(stanzaTrack))
+   stanzaLine.append(len(lineOffset))
+   lineOffset.append(textSize)
+
+   hashes = [NameHash(Utf8(albums[trackAlbum[t]]), Utf8(trackNames[t]))
+      for t in range(len(trackNames))]
+   hashTrack = sorted(range(len(trackNames)), key=lambda t: (hashes[t], t))
+   trackHash = [hashes[t] for t in hashTrack]
+   linesByLength = sorted(range(len(lineLength)), key=lineLength.__getitem__)
+   lengthStart = [0] * (kMaxLineLength + 3)
+   for length in lineLength:
+      lengthStart[length + 1] += 1
+   for length in range(1, len(lengthStart)):
+      lengthStart[length] += lengthStart[length - 1]
+
+   names = []
+   nameOffset = []
+   nameSize = 0
+   for name in albums + trackNames:
+      # offsets into the name blob are in bytes, not characters.
+      name = Utf8(name)
+      nameOffset.append(nameSize)
+      names.append(name)
+      nameSize += len(name)
+   nameOffset.append(nameSize)
+
+   tmpPath = indexPath + ".tmp"
+   with open(tmpPath, "wb") as f:
+      f.write(struct.pack(kHeaderFormat, kMagic, kVersion, len(albums),
+         len(trackNames), len(stanzaTrack), len(lineOffset) - 1, numFiles,
+         newestFile))
+      for section in (nameOffset, trackAlbum, trackStanza, trackHash, hashTrack,
+         stanzaTrack, stanzaLine, lineOffset, lineCum, shortestLine, lineStanza,
+         linesByLength, lengthStart):
+         f.write(PackInts(section))
+      f.write("".join(names))
+      f.write("".join(text))
+   os.rename(tmpPath, indexPath)
+   return len(trackNames)
+
+
+class IntArray(object):
+   ''' read-only, list-like view of one of the integer sections of the index '''
+   def __init__(self, buf, offset, count):
+      self._buf = buf
+      self._offset = offset
+      self._count = count
+
+   def __len__(self):
+      return self._count
+
+   def __getitem__(self, index):
+      return struct.unpack_from("<I", self._buf, self._offset + index * kIntSize)[0]
+
+   def ToArray(self):
+      ''' copy the whole section into an array('I') '''
+      values = array("I", self._buf[self._offset:self._offset + self._count * kIntSize])
+      if "big" == sys.byteorder:
+         values.byteswap()
+      return values
+
+
+class LyricIndex(object):
+   '''
+      Read-only access to a compiled lyric index. The file is mmap()ed, so
+      opening the index is cheap no matter how large the corpus is, and we
+      only ever touch the pages that hold the stanza that we pick.
+   '''
+   def __init__(self, indexPath):
+      self._path = indexPath
+      with open(indexPath, "rb") as f:
+         self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      if len(self._map) < kHeaderSize:
+         raise LyricIndexError("{0} is not a lyric index.".format(indexPath))
+      (magic, version, self.numAlbums, self.numTracks, self.numStanzas,
+         self.numLines, numFiles, newestFile) = struct.unpack_from(kHeaderFormat,
+         self._map, 0)
+      self.signature = (numFiles, newestFile)
+      if magic != kMagic or version != kVersion:
+         raise LyricIndexError("{0} is not a version {1} lyric index.".format(
+            indexPath, kVersion))
+
+      # work out where each of the sections starts.
+      offset = kHeaderSize
+      sections = (
+         ("nameOffset", self.numAlbums + self.numTracks + 1),
+         ("trackAlbum", self.numTracks),
+         ("trackStanza", self.numTracks + 1),
+         ("trackHash", self.numTracks),
+         ("hashTrack", self.numTracks),
+         ("stanzaTrack", self.numStanzas),
+         ("stanzaLine", self.numStanzas + 1),
+         ("lineOffset", self.numLines + 1),
+         ("lineCum", self.numLines + 1),
+         ("shortestLine", self.numLines),
+         ("lineStanza", self.numLines),
+         ("linesByLength", self.numLines),
+         ("lengthStart", kMaxLineLength + 3),
+         )
+      for name, count in sections:
+         setattr(self, name, IntArray(self._map, offset, count))
+         offset += count * kIntSize
+      self._names = offset
+      self._trackHash = None
+      self._text = offset + self.nameOffset[self.numAlbums + self.numTracks]
+
+   def Close(self):
+      self._map.close()
+
+   def _Name(self, nameId):
+      ''' the (UTF-8 str) album or track name stored at nameId '''
+      start = self._names + self.nameOffset[nameId]
+      end = self._names + self.nameOffset[nameId + 1]
+      return self._map[start:end]
+
+   def Track(self, trackId):
+      ''' return a tuple (album, track) for the track at 'trackId' '''
+      album = self._Name(self.trackAlbum[trackId])
+      return (album, self._Name(self.numAlbums + trackId))
+
+   def FindTrack(self, album, track):
+      ''' return the id of the track named (album, track) (UTF-8 strs), or
+         None if there's no such track in the index.
+      '''
+      if self._trackHash is None:
+         # (a single copy that bisect can search at C speed.)
+         self._trackHash = self.trackHash.ToArray()
+      nameHash = NameHash(album, track)
+      pos = bisect_left(self._trackHash, nameHash)
+      while pos < self.numTracks and self._trackHash[pos] == nameHash:
+         trackId = self.hashTrack[pos]
+         if self.Track(trackId) == (album, track):
+            return trackId
+         pos += 1
+      return None
+
+   def StanzaRange(self, trackId):
+      ''' return (first, end) stanza ids for the track -- like range(), the
+         end value is one past the last stanza in the track.
+      '''
+      return (self.trackStanza[trackId], self.trackStanza[trackId + 1])
+
+   def LineRange(self, stanzaId):
+      ''' return (first, end) line ids for the stanza. '''
+      return (self.stanzaLine[stanzaId], self.stanzaLine[stanzaId + 1])
+
+   def Text(self, firstLine, endLine):
+      ''' return the lines firstLine..endLine-1 as a single unicode string
+         with the lines separated by newlines.
+      '''
+      start = self._text + self.lineOffset[firstLine]
+      end = self._text + self.lineOffset[endLine] - 1
+      return self._map[start:end].decode("utf-8")
+
+   def Line(self, lineId):
+      return self.Text(lineId, lineId + 1)
+
+   def LineLength(self, lineId):
+      return self.lineCum[lineId + 1] - self.lineCum[lineId] - 1
+
+   def LineTrack(self, lineId):
+      return self.stanzaTrack[self.lineStanza[lineId]]
+
+   def ShortLines(self, maxLength):
+      ''' return (first, end) positions in linesByLength that hold all of the
+         (non-empty) lines that are no longer than maxLength.
+      '''
+      maxLength = max(0, min(maxLength, kMaxLineLength))
+      return (self.lengthStart[1], self.lengthStart[maxLength + 1])
+
+   def Stanza(self, stanzaId):
+      return self.Text(*self.LineRange(stanzaId))
+
+   def Lines(self, stanzaId):
+      return self.Stanza(stanzaId).split("\n")
+
+   def FitStanza(self, stanzaId, maxLength):
+      ''' return as much of the stanza as will fit into maxLength characters,
+         or an empty string if none of its lines are short enough.
+      '''
+      first, end = self.LineRange(stanzaId)
+      run = FitRun(self.lineCum, self.shortestLine, first, end, maxLength)
+      if run:
+         return self.Text(*run)
+      return u""
+
+
+def ReadSignature(indexPath):
+   ''' return the CorpusSignature() saved in the header of the index at
+      indexPath, or None if there's no (current version) index there.
+   '''
+   try:
+      with open(indexPath, "rb") as f:
+         header = f.read(kHeaderSize)
+   except IOError:
+      return None
+   if len(header) < kHeaderSize:
+      return None
+   fields = struct.unpack(kHeaderFormat, header)
+   if fields[0] != kMagic or fields[1] != kVersion:
+      return None
+   return fields[-2:]
+
+
+def IsStale(indexPath, filePattern):
+   ''' The index needs to be rebuilt if it doesn't exist or if the lyric files
+      that match filePattern aren't the ones that it was built from (which is
+      what happens when GetLyrics adds or replaces a file.) We look at the
+      files themselves and not at their directory, which the bot also writes
+      its own files into.
+   '''
+   return ReadSignature(indexPath) != CorpusSignature(glob(Utf8(filePattern)))
+
+
+def Open(indexPath, filePattern):
+   ''' Open the index at indexPath, (re)building it first if it's missing, out
+      of date, or was built by an older version of the compiler.
+   '''
+   if IsStale(indexPath, filePattern):
+      CompileCorpus(filePattern, indexPath)
+   try:
+      return LyricIndex(indexPath)
+   except LyricIndexError:
+      CompileCorpus(filePattern, indexPath)
+      return LyricIndex(indexPath)
+
+
+class IndexCache(object):
+   ''' Lets several bots in one process share a single open LyricIndex (and
+      lyricSearch.SearchIndex) for each index file instead of each of them
+      opening its own. An index that's been replaced isn't closed here; its
+      map goes away once the last bot that was using it lets go of it.
+   '''
+   def __init__(self):
+      self.lock = threading.Lock()
+      self.indexes = {}
+      self.searches = {}
+
+   def Open(self, indexPath, filePattern):
+      indexPath = os.path.abspath(indexPath)
+      with self.lock:
+         index = self.indexes.get(indexPath)
+         if index is None or IsStale(indexPath, filePattern):
+            index = Open(indexPath, filePattern)
+            self.indexes[indexPath] = index
+         return index
+
+   def OpenSearch(self, searchPath, filePattern):
+      import lyricSearch
+      searchPath = os.path.abspath(searchPath)
+      with self.lock:
+         search = self.searches.get(searchPath)
+         if search is None or lyricSearch.IsStale(searchPath, filePattern):
+            search = lyricSearch.Open(searchPath, filePattern)
+            self.searches[searchPath] = search
+         return search
+
+
+if __name__ == "__main__":
+   import sys
+   if len(sys.argv) != 3:
+      print "Usage: python lyricIndex.py <lyric file pattern> <index file>"
+      sys.exit(1)
+   count = CompileCorpus(sys.argv[1], sys.argv[2])
+   print "Wrote {0} tracks to {1}".format(count, sys.argv[2])
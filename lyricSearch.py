@@ -0,0 +1,283 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   lyricSearch.py -- find the lyric line that has the most to do with what
+   someone asked us.
+
+   Every line of every lyric file is a document. We keep an inverted index
+   (word -> the lines that use it & how many times) and score lines against
+   the words of a question with BM25, so a line that shares rarer words with
+   the question beats one that only shares common ones.
+
+   The index is saved with marshal (which loads quickly), and each word's
+   postings are kept as a packed string of (line, count) pairs that we only
+   unpack for the words that are actually in a question.
+
+   Rebuilding after GetLyrics.py adds or changes tracks only reads the lyric
+   files whose modification time changed; the words of every other file come
+   from a cache ('<index>.files') that's saved next to the index.
+
+   The index file starts with a small header (the version and the
+   lyricIndex.CorpusSignature() of the files it was built from) that's
+   marshaled separately, so IsStale() can check it without loading the rest.
+
+      python lyricSearch.py "data/*.lyric" data/lyrics.search ["a question"]
+'''
+
+from array import array
+from glob import glob
+from heapq import nlargest
+from math import log
+from random import random
+
+import marshal
+import os
+import re
+
+from lyricIndex import CorpusSignature
+from lyricIndex import ParseFilename
+from lyricIndex import Utf8
+
+kVersion = 2
+
+# BM25 parameters.
+kK1 = 1.2
+kB = 0.75
+
+# a word that's in more lines than this doesn't tell us much about what
+# someone's asking, and would take too long to score.
+kMaxPostings = 1000
+
+# how many of the best-scoring lines we look through for one that we can use
+# before sorting all of them.
+kCandidates = 50
+
+kStopWords = frozenset('''a an and are as at be but by can do does did for from
+   had has have he her him his how i if in into is it its just me my no not of
+   on or our she so than that the their them then there these they this to too
+   up us was we were what when where which who whom why will with would you
+   your'''.split())
+
+kWordPattern = re.compile(r"[a-z0-9']+")
+kMentionPattern = re.compile(r"@\w+")
+
+
+def Tokenize(text):
+   ''' return the list of (lowercased) words in text that are worth matching on. '''
+   text = kMentionPattern.sub(" ", text.lower())
+   words = [w.strip("'") for w in kWordPattern.findall(text)]
+   return [w for w in words if len(w) > 1 and w not in kStopWords]
+
+
+def ReadLines(fName):
+   with open(fName, "rt") as f:
+      data = f.read().decode("utf-8")
+   return [line.strip() for line in data.split("\n") if line.strip()]
+
+
+def BuildSearchIndex(filePattern, indexPath):
+   ''' (re)build the search index at indexPath from the lyric files matching
+      filePattern. Returns the number of lyric files that had to be read.
+   '''
+   cachePath = indexPath + ".files"
+   try:
+      with open(cachePath, "rb") as f:
+         cache = marshal.load(f)
+      if cache.get("version") != kVersion:
+         cache = None
+   except (IOError, EOFError, ValueError, TypeError):
+      cache = None
+   oldFiles = cache["files"] if cache else {}
+
+   fileNames = sorted(glob(Utf8(filePattern)))
+   signature = CorpusSignature(fileNames)
+   files = {}
+   numRead = 0
+   for fName in fileNames:
+      parts = ParseFilename(fName)
+      if 2 != len(parts):
+         continue
+      mtime = os.path.getmtime(fName)
+      key = os.path.basename(fName)
+      old = oldFiles.get(key)
+      if old and old[0] == mtime:
+         files[key] = old
+      else:
+         lines = ReadLines(fName)
+         files[key] = (mtime, parts, lines, [Tokenize(line) for line in lines])
+         numRead += 1
+
+   tracks = []
+   docText = []
+   docTrack = []
+   docLen = []
+   postings = {}
+   for key in sorted(files):
+      mtime, parts, lines, tokens = files[key]
+      trackId = len(tracks)
+      tracks.append(tuple(parts))
+      for line, words in zip(lines, tokens):
+         doc = len(docText)
+         docText.append(line)
+         docTrack.append(trackId)
+         docLen.append(len(words))
+         counts = {}
+         for word in words:
+            counts[word] = counts.get(word, 0) + 1
+         for word, count in counts.iteritems():
+            postings.setdefault(word, array("I")).extend((doc, count))
+
+   header = {"version": kVersion, "signature": signature}
+   index = {"tracks": tracks, "docText": docText,
+      "docTrack": array("I", docTrack).tostring(),
+      "docLen": array("I", docLen).tostring(),
+      "postings": dict((word, p.tostring()) for word, p in postings.iteritems())}
+   for path, items in ((indexPath, [header, index]),
+      (cachePath, [{"version": kVersion, "files": files}])):
+      tmpPath = path + ".tmp"
+      with open(tmpPath, "wb") as f:
+         for item in items:
+            marshal.dump(item, f, 2)
+      os.rename(tmpPath, path)
+   return numRead
+
+
+def ReadHeader(f):
+   ''' read the header from the start of an open index file, returning None
+      if it's not a current version search index.
+   '''
+   try:
+      header = marshal.load(f)
+   except (EOFError, ValueError, TypeError):
+      return None
+   if not isinstance(header, dict) or header.get("version") != kVersion:
+      return None
+   return header
+
+
+def IsStale(indexPath, filePattern):
+   ''' The search index needs to be rebuilt if it doesn't exist or if it
+      wasn't built from the lyric files that match filePattern right now.
+   '''
+   try:
+      with open(indexPath, "rb") as f:
+         header = ReadHeader(f)
+   except IOError:
+      return True
+   if header is None:
+      return True
+   return header["signature"] != CorpusSignature(glob(Utf8(filePattern)))
+
+
+class SearchIndexError(Exception):
+   pass
+
+
+class SearchIndex(object):
+   def __init__(self, indexPath):
+      try:
+         with open(indexPath, "rb") as f:
+            header = ReadHeader(f)
+            if header is None:
+               raise SearchIndexError("{0} is not a version {1} search index.".format(
+                  indexPath, kVersion))
+            index = marshal.load(f)
+      except (IOError, EOFError, ValueError, TypeError):
+         raise SearchIndexError("Can't read the search index {0}".format(indexPath))
+      self.signature = header["signature"]
+      self.tracks = index["tracks"]
+      self.docText = index["docText"]
+      self.docTrack = array("I")
+      self.docTrack.fromstring(index["docTrack"])
+      self.docLen = array("I")
+      self.docLen.fromstring(index["docLen"])
+      self.postings = index["postings"]
+      self.numDocs = len(self.docText)
+      self.averageLen = float(sum(self.docLen)) / max(1, self.numDocs)
+
+   def Postings(self, word):
+      p = array("I")
+      p.fromstring(self.postings.get(word, ""))
+      return p
+
+   def Score(self, text):
+      ''' return a dict {line: BM25 score} for the lines that share any words
+         with text.
+      '''
+      scores = {}
+      docLen = self.docLen
+      norm = kK1 / self.averageLen if self.averageLen else 0
+      for word in set(Tokenize(text)):
+         p = self.Postings(word)
+         docFreq = len(p) // 2
+         if not docFreq or docFreq > kMaxPostings:
+            continue
+         idf = log(1 + (self.numDocs - docFreq + 0.5) / (docFreq + 0.5))
+         for i in xrange(0, len(p), 2):
+            doc = p[i]
+            count = p[i + 1]
+            score = idf * count * (kK1 + 1) / (count + kK1 * (1 - kB) +
+               norm * kB * docLen[doc])
+            scores[doc] = scores.get(doc, 0) + score
+      return scores
+
+   def Search(self, text, maxLength, isEligible=None):
+      ''' return (album, track, line) for the best-matching line that's no
+         longer than maxLength (and for which isEligible(album, track) is True,
+         if given), or None if nothing matches. Ties are broken at random.
+      '''
+      docs = self.Score(text)
+      if not docs:
+         return None
+      key = lambda doc: (docs[doc], random())
+      candidates = nlargest(kCandidates, docs, key=key)
+      if len(candidates) < len(docs):
+         candidates += sorted(set(docs) - set(candidates), key=key, reverse=True)
+      for doc in candidates:
+         line = self.docText[doc]
+         if len(line) <= maxLength:
+            album, track = self.tracks[self.docTrack[doc]]
+            if isEligible is None or isEligible(album, track):
+               return (album, track, line)
+      return None
+
+
+def Open(indexPath, filePattern):
+   ''' Open the search index at indexPath, (re)building it first if it's
+      missing, out of date, or can't be read.
+   '''
+   if IsStale(indexPath, filePattern):
+      BuildSearchIndex(filePattern, indexPath)
+   try:
+      return SearchIndex(indexPath)
+   except SearchIndexError:
+      BuildSearchIndex(filePattern, indexPath)
+      return SearchIndex(indexPath)
+
+
+if __name__ == "__main__":
+   import sys
+   if len(sys.argv) not in (3, 4):
+      print 'Usage: python lyricSearch.py <lyric file pattern> <index file> ["question"]'
+      sys.exit(1)
+   print "Read {0} lyric files.".format(BuildSearchIndex(sys.argv[1], sys.argv[2]))
+   if 4 == len(sys.argv):
+      print SearchIndex(sys.argv[2]).Search(sys.argv[3].decode("utf-8"), 140)
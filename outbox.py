@@ -0,0 +1,130 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   outbox.py -- every status update that the bot wants to post, saved in a
+   SQLite file until Twitter has accepted it.
+
+   Each entry holds the arguments for update_status(), the song it came from,
+   and the log entry to write once it's been posted. An entry stays 'pending'
+   until it's either sent (and removed) or fails for good ('failed' -- kept
+   around so we can see what went wrong.) Pending entries that couldn't be sent
+   this time are tried again on the next run, up to kMaxAttempts times.
+'''
+
+from time import time
+
+import json
+import sqlite3
+
+kMaxAttempts = 10
+
+kSchema = '''
+CREATE TABLE IF NOT EXISTS outbox (
+   id INTEGER PRIMARY KEY AUTOINCREMENT,
+   kind TEXT NOT NULL,
+   args TEXT NOT NULL,
+   album TEXT,
+   track TEXT,
+   logEvent TEXT,
+   logData TEXT,
+   state TEXT NOT NULL DEFAULT 'pending',
+   attempts INTEGER NOT NULL DEFAULT 0,
+   created INTEGER NOT NULL,
+   lastError TEXT
+)
+'''
+
+
+class OutboxEntry(object):
+   def __init__(self, row):
+      (self.id, self.kind, args, album, track, self.logEvent, logData,
+         self.attempts) = row
+      # album & track names are UTF-8 strs everywhere else in the bot.
+      self.album = album.encode("utf-8") if album else None
+      self.track = track.encode("utf-8") if track else None
+      self.args = json.loads(args)
+      self.logData = json.loads(logData)
+
+
+class Outbox(object):
+   def __init__(self, path):
+      # a bot only uses its outbox from one thread at a time, but (in MultiBot)
+      # not always the same thread.
+      self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+      self.db.execute("PRAGMA journal_mode=WAL")
+      self.db.execute(kSchema)
+      self.db.commit()
+
+   def Close(self):
+      self.db.close()
+
+   def Add(self, kind, args, album=None, track=None, logEvent=None, logData=None):
+      '''
+         kind: 'tweet' or 'reply'
+         args: dict of arguments for update_status()
+         album, track: the song that the status came from (for the history)
+         logEvent, logData: what to Log() once it's been posted.
+      '''
+      if isinstance(album, str):
+         album = album.decode("utf-8")
+      if isinstance(track, str):
+         track = track.decode("utf-8")
+      with self.db:
+         cursor = self.db.execute("INSERT INTO outbox (kind, args, album, track, "
+            "logEvent, logData, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (kind, json.dumps(args), album, track, logEvent,
+            json.dumps(logData or []), int(time())))
+      return cursor.lastrowid
+
+   def Pending(self, kind=None):
+      ''' return a list of OutboxEntry for everything still waiting to be sent,
+         oldest first.
+      '''
+      query = ("SELECT id, kind, args, album, track, logEvent, logData, attempts "
+         "FROM outbox WHERE state = 'pending'")
+      params = ()
+      if kind:
+         query += " AND kind = ?"
+         params = (kind,)
+      rows = self.db.execute(query + " ORDER BY id", params).fetchall()
+      return [OutboxEntry(row) for row in rows]
+
+   def Sent(self, entryId):
+      with self.db:
+         self.db.execute("DELETE FROM outbox WHERE id = ?", (entryId,))
+
+   def Retry(self, entryId, error):
+      ''' couldn't send it this time. Returns False if we've now tried too many
+         times and given up on it.
+      '''
+      with self.db:
+         self.db.execute("UPDATE outbox SET attempts = attempts + 1, lastError = ?, "
+            "state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE state END "
+            "WHERE id = ?", (error, kMaxAttempts, entryId))
+         state = self.db.execute("SELECT state FROM outbox WHERE id = ?",
+            (entryId,)).fetchone()[0]
+      return 'pending' == state
+
+   def Failed(self, entryId, error):
+      ''' this one can never be sent. '''
+      with self.db:
+         self.db.execute("UPDATE outbox SET attempts = attempts + 1, lastError = ?, "
+            "state = 'failed' WHERE id = ?", (error, entryId))
@@ -0,0 +1,161 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+''' RateLimitedClient against FakeTwitter.py with its rate limits turned on. '''
+
+from time import sleep
+from time import time
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from twython import Twython
+
+from apiClient import DeferredCall
+from apiClient import RateLimitedClient
+from FakeTwitter import FakeServer
+from FakeTwitter import FakeTwitter
+from jsonSettings import JsonSettings
+from workPool import WorkPool
+
+
+class ThreadCheckingTwython(Twython):
+   ''' remembers which threads made calls with it. '''
+   def __init__(self, *args, **kwargs):
+      Twython.__init__(self, *args, **kwargs)
+      self.threads = set()
+
+   def _request(self, *args, **kwargs):
+      self.threads.add(threading.current_thread().ident)
+      return Twython._request(self, *args, **kwargs)
+
+
+def Favorite(client, tweetId):
+   client.create_favorite(id=tweetId)
+
+
+class TestRateLimits(unittest.TestCase):
+   def setUp(self):
+      self.workDir = tempfile.mkdtemp(prefix="apiclient")
+      self.servers = []
+
+   def tearDown(self):
+      for server in self.servers:
+         server.Stop()
+      shutil.rmtree(self.workDir)
+
+   def Serve(self, **kwargs):
+      fake = FakeTwitter(**kwargs)
+      server = FakeServer(fake, 0)
+      server.Start()
+      self.servers.append(server)
+      return fake, server
+
+   def Client(self, server, name="settings.json", made=None):
+      ''' a RateLimitedClient that talks to server. Every Twython object that
+         it makes is added to the list 'made'.
+      '''
+      path = os.path.join(self.workDir, name)
+      with open(path, "wt") as f:
+         f.write("{}")
+      settings = JsonSettings(path)
+
+      def MakeTwitter():
+         twitter = ThreadCheckingTwython("key", "secret", "token", "tokenSecret")
+         twitter.api_url = server.Url() + "/%s"
+         if made is not None:
+            made.append(twitter)
+         return twitter
+      return RateLimitedClient(MakeTwitter, settings, backoff=0.01)
+
+   def testBucketsFollowTheirOwnEndpoint(self):
+      fake, server = self.Serve(rateLimit=100, latency=0.02)
+      made = []
+      client = self.Client(server, made=made)
+      pool = WorkPool(8)
+      try:
+         for i in range(12):
+            pool.Submit(Favorite, client, str(i))
+            if 0 == i % 3:
+               pool.Submit(client.get_mentions_timeline)
+         pool.Wait()
+      finally:
+         pool.Close()
+      # each bucket has the count from its own endpoint's responses, even
+      # though the calls were all made at the same time.
+      self.assertEqual(100 - 12, client.Bucket("create_favorite").remaining)
+      self.assertEqual(100 - 4, client.Bucket("get_mentions_timeline").remaining)
+      self.assertEqual(int(fake.limits["Favorite"][1]),
+         client.Bucket("create_favorite").reset)
+      self.assertEqual(int(fake.limits["Mentions"][1]),
+         client.Bucket("get_mentions_timeline").reset)
+      self.assertEqual(12, len(fake.favorites))
+      # the headers that a bucket is updated from are only ever those of the
+      # calling thread's own last call.
+      self.assertTrue(len(made) > 1)
+      for twitter in made:
+         self.assertEqual(1, len(twitter.threads))
+
+   def testEmptyBucketDefers(self):
+      fake, server = self.Serve(rateLimit=3, window=2)
+      client = self.Client(server)
+      for i in range(3):
+         client.get_mentions_timeline()
+      # we know that we're out of calls, so we don't even ask.
+      self.assertRaises(DeferredCall, client.get_mentions_timeline)
+      self.assertEqual(3, fake.Stats()["Mentions"])
+      self.assertFalse(client.settings.deferredCalls)
+
+      for i in range(3):
+         client.create_favorite(id=str(i))
+      self.assertRaises(DeferredCall, client.create_favorite, id="3")
+      self.assertEqual([["create_favorite", {"id": "3"}]],
+         client.settings.deferredCalls)
+      self.assertEqual(3, fake.Stats()["Favorite"])
+
+      # once the window is over, the favorite that had to wait goes through.
+      sleep(max(0, client.Bucket("create_favorite").reset + 1 - time()))
+      self.assertEqual([], client.RunDeferred())
+      self.assertEqual([], client.settings.deferredCalls)
+      self.assertTrue("3" in fake.favorites)
+
+   def testTooManyRequests(self):
+      fake, server = self.Serve(rateLimit=2)
+      # someone else has already used up this window.
+      other = self.Client(server, "other.json")
+      for i in range(2):
+         other.get_mentions_timeline()
+      client = self.Client(server)
+      self.assertRaises(DeferredCall, client.get_mentions_timeline)
+      self.assertEqual(1, fake.Stats()["rateLimited"])
+      bucket = client.Bucket("get_mentions_timeline")
+      self.assertEqual(0, bucket.remaining)
+      self.assertEqual(int(fake.limits["Mentions"][1]), bucket.reset)
+      self.assertEqual({"get_mentions_timeline": [0, bucket.reset]},
+         client.settings.rateLimits)
+
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,89 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+''' The streaming bot replaying a recorded stream (--stream --replay FILE),
+   then the cron bot handling what it queued.
+'''
+
+import json
+import os
+import unittest
+
+from eventQueue import EventQueue
+from FakeTwitter import MakeBot
+from tests.testTmBot import BotTestCase
+
+
+def QuoteEvent(tweetId):
+   return {"event": "quoted_tweet", "source": {"screen_name": "fan"},
+      "target_object": {"id_str": tweetId, "text": "a quote",
+         "user": {"screen_name": "fan"}}}
+
+
+class TestReplay(BotTestCase):
+   def Replay(self, events):
+      ''' write events to a file, one per line, and --replay it. Returns the
+         streaming bot.
+      '''
+      path = os.path.join(self.workDir, "events.json")
+      with open(path, "wt") as f:
+         for event in events:
+            f.write(json.dumps(event) + "\n")
+         f.write("\n")
+      bot = MakeBot(self.botDir, stream=True)
+      bot.replay = path
+      bot.Run()
+      bot.settings.Write()
+      return bot
+
+   def QueuedIds(self, bot):
+      queue = EventQueue(bot.GetPath(bot.GetEventQueuePath()))
+      try:
+         return [tweetId for eventId, kind, tweetId, payload in queue.Dequeue(10000)]
+      finally:
+         queue.Close()
+
+   def testReplay(self):
+      ids = ["101", "102", "103"]
+      # only quotes are queued, and a repeated event is only queued once.
+      events = [QuoteEvent(ids[0]), {"event": "favorite"}, QuoteEvent(ids[1]),
+         QuoteEvent(ids[2]), QuoteEvent(ids[0])]
+      streamer = self.Replay(events)
+      self.assertEqual(ids, self.QueuedIds(streamer))
+      self.assertEqual(4, streamer.twitter.Stats()["handled"])
+
+      bot = MakeBot(self.botDir)
+      bot.HandleQuotes()
+      self.assertEqual(set(ids), self.fake.favorites)
+      self.assertEqual([], self.QueuedIds(bot))
+
+   def testAllHandled(self):
+      # enough events to keep every worker busy at once.
+      ids = [str(1000 + i) for i in range(2000)]
+      streamer = self.Replay([QuoteEvent(tweetId) for tweetId in ids])
+      stats = streamer.twitter.Stats()
+      self.assertEqual((2000, 0), (stats["handled"], stats["dropped"]))
+      self.assertEqual(set(ids), set(self.QueuedIds(streamer)))
+
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,227 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+''' GetLyrics.py against a local web server that serves saved copies of
+   discography, album and track pages (tests/fixtures/tmbw), so the whole
+   crawl can be checked without going near the real wiki.
+
+      python -m unittest discover -s tests -t .
+'''
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+from os.path import dirname
+from os.path import join
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from crawlFrontier import Frontier
+
+import GetLyrics
+
+kFixtureDir = join(dirname(__file__), "fixtures", "tmbw")
+
+
+def ReadFixture(path):
+   with open(join(kFixtureDir, path), "rb") as f:
+      return f.read()
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+   ''' serves the fixture pages with an ETag, and answers 304 to a request
+      whose If-None-Match still matches.
+   '''
+   def log_message(self, format, *args):
+      pass
+
+   def do_GET(self):
+      server = self.server
+      path = self.path.split("?")[0]
+      body = server.overrides.get(path)
+      if body is None:
+         try:
+            body = ReadFixture(path.lstrip("/"))
+         except IOError:
+            server.Count(path, 404)
+            self.send_error(404)
+            return
+      etag = '"{0}{1}"'.format(hashlib.sha1(body).hexdigest(), server.etagSuffix)
+      if etag == self.headers.get("If-None-Match"):
+         server.Count(path, 304)
+         self.send_response(304)
+         self.send_header("ETag", etag)
+         self.end_headers()
+         return
+      server.Count(path, 200)
+      self.send_response(200)
+      self.send_header("Content-Type", "text/html; charset=utf-8")
+      self.send_header("Content-Length", str(len(body)))
+      self.send_header("ETag", etag)
+      self.end_headers()
+      self.wfile.write(body)
+
+
+class FixtureServer(ThreadingMixIn, HTTPServer):
+   daemon_threads = True
+
+   def __init__(self):
+      HTTPServer.__init__(self, ("127.0.0.1", 0), FixtureHandler)
+      self.lock = threading.Lock()
+      # path -> page to serve instead of the fixture file
+      self.overrides = {}
+      # change this to change every ETag without changing any pages.
+      self.etagSuffix = ""
+      # (path, status) -> number of requests
+      self.requests = {}
+
+   def Count(self, path, status):
+      with self.lock:
+         self.requests[(path, status)] = self.requests.get((path, status), 0) + 1
+
+   def Statuses(self):
+      ''' number of responses of each status, e.g. {200: 8} '''
+      with self.lock:
+         counts = {}
+         for (path, status), count in self.requests.items():
+            counts[status] = counts.get(status, 0) + count
+         return counts
+
+   def Url(self):
+      return "http://127.0.0.1:{0}".format(self.server_address[1])
+
+
+class TestCrawl(unittest.TestCase):
+   def setUp(self):
+      self.server = FixtureServer()
+      self.thread = threading.Thread(target=self.server.serve_forever)
+      self.thread.daemon = True
+      self.thread.start()
+      self.workDir = tempfile.mkdtemp(prefix="getlyrics")
+      # GetLyrics keeps its configuration in module globals (set from the
+      # command line); point them at the fixture server & our scratch dir.
+      self.saved = dict((name, getattr(GetLyrics, name)) for name in
+         ("kBaseUrl", "kOutputDir", "fetcher", "cache", "tracks", "Log"))
+      GetLyrics.kBaseUrl = self.server.Url()
+      GetLyrics.kOutputDir = self.workDir
+      GetLyrics.Log = lambda s: None
+      self.cachePath = join(self.workDir, GetLyrics.kPageCacheFile)
+
+   def tearDown(self):
+      for name, value in self.saved.items():
+         setattr(GetLyrics, name, value)
+      self.server.shutdown()
+      self.server.server_close()
+      shutil.rmtree(self.workDir)
+
+   def Crawl(self):
+      ''' one complete crawl, like a run of GetLyrics.py. Returns the track counts. '''
+      GetLyrics.fetcher = GetLyrics.Fetcher()
+      GetLyrics.cache = GetLyrics.PageCache(self.cachePath)
+      GetLyrics.tracks = GetLyrics.TrackCounter()
+      frontier = Frontier(join(self.workDir, GetLyrics.kFrontierFile))
+      try:
+         frontier.Restart()
+         for discography in GetLyrics.kDiscographies:
+            frontier.Add(discography, "discography")
+         GetLyrics.Crawl(frontier)
+         self.assertEqual([], frontier.Failures())
+      finally:
+         GetLyrics.cache.Write()
+         frontier.Close()
+      return GetLyrics.tracks.counts
+
+   def ReadLyric(self, fileName):
+      with open(join(self.workDir, fileName), "rt") as f:
+         return f.read()
+
+   def LyricFiles(self):
+      return sorted(f for f in os.listdir(self.workDir) if f.endswith(".lyric"))
+
+   def testFirstCrawl(self):
+      counts = self.Crawl()
+      self.assertEqual({"new": 3, "changed": 0, "unchanged": 0}, counts)
+      self.assertEqual(["Factory-Showroom_S-E-X-X-Y.lyric",
+         "Factory-Showroom_Till-My-Head-Falls-Off.lyric",
+         "State-Songs_West-Virginia.lyric"], self.LyricFiles())
+      self.assertEqual("first stanza, first line\nfirst stanza, second line\n"
+         "second stanza", self.ReadLyric("Factory-Showroom_S-E-X-X-Y.lyric"))
+      self.assertEqual({200: 8}, self.server.Statuses())
+
+      # every page that we processed has its validators in the cache.
+      with open(self.cachePath, "rt") as f:
+         pages = json.load(f)
+      self.assertEqual(8, len(pages))
+      for url, entry in pages.items():
+         self.assertTrue(url.startswith(self.server.Url()))
+         self.assertTrue(entry["etag"])
+         self.assertTrue(entry["hash"])
+
+   def testUnchangedPagesAreNotRefetched(self):
+      self.Crawl()
+      mtimes = dict((f, os.path.getmtime(join(self.workDir, f)))
+         for f in self.LyricFiles())
+      counts = self.Crawl()
+      # the discographies are unchanged, so we never even get to the albums
+      # and tracks the second time.
+      self.assertEqual({"new": 0, "changed": 0, "unchanged": 0}, counts)
+      self.assertEqual({200: 8, 304: 3}, self.server.Statuses())
+      for f, mtime in mtimes.items():
+         self.assertEqual(mtime, os.path.getmtime(join(self.workDir, f)))
+
+   def testNewValidatorsForUnchangedPages(self):
+      self.Crawl()
+      self.server.etagSuffix = "-2"
+      self.Crawl()
+      # the discographies come back in full (their ETags don't match), but
+      # they're the same as before, so we keep their new ETags...
+      self.assertEqual({200: 11}, self.server.Statuses())
+      # ...and send those next time.
+      self.Crawl()
+      self.assertEqual({200: 11, 304: 3}, self.server.Statuses())
+
+   def testChangedTrack(self):
+      self.Crawl()
+      # the discography & album pages change (so we look at their tracks
+      # again), and so do the words of one track.
+      overrides = self.server.overrides
+      overrides["/wiki/Discography/Studio_Albums"] = ReadFixture(
+         "wiki/Discography/Studio_Albums").replace("1996", "1996 (reissue)")
+      overrides["/wiki/Factory_Showroom"] = ReadFixture(
+         "wiki/Factory_Showroom").replace("3:28", "3:29")
+      overrides["/wiki/Lyrics_Till_My_Head_Falls_Off"] = ReadFixture(
+         "wiki/Lyrics_Till_My_Head_Falls_Off").replace(
+         "I keep on going till my head falls off", "new words")
+      counts = self.Crawl()
+      self.assertEqual({"new": 0, "changed": 1, "unchanged": 1}, counts)
+      self.assertEqual("new words",
+         self.ReadLyric("Factory-Showroom_Till-My-Head-Falls-Off.lyric"))
+
+
+if __name__ == "__main__":
+   unittest.main()
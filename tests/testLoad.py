@@ -0,0 +1,56 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+''' FakeTwitter.py's load test, checking what the bot got done and not just
+   how long it took.
+'''
+
+import unittest
+
+from FakeTwitter import FakeTwitter
+from FakeTwitter import LoadTest
+
+
+class TestLoad(unittest.TestCase):
+   def testAllMentionsHandled(self):
+      # fewer than the 800 mentions that one run can read.
+      fake = FakeTwitter(seed=1)
+      report = LoadTest(fake, 50, 300, 0.25, 20, maxRuns=5, seed=1)
+      self.assertEqual(300, report["runs"][0]["mentions"])
+      self.assertEqual((300, 0), (report["mentionsHandled"], report["mentionsMissed"]))
+      self.assertEqual(20, sum(run["quotes"] for run in report["runs"]))
+      # every mention and every quote gets a favorite.
+      self.assertEqual(320, len(fake.favorites))
+      self.assertTrue(report["runs"][-1]["idle"])
+
+   def testDeferredCallsRetried(self):
+      # too few calls per window to favorite everything in the first run.
+      fake = FakeTwitter(rateLimit=10, window=1, seed=1)
+      report = LoadTest(fake, 50, 30, 0.25, 5, maxRuns=20, seed=1)
+      self.assertLess(report["runs"][0]["Favorite"], 35)
+      self.assertEqual(0, report["mentionsMissed"])
+      self.assertEqual(35, len(fake.favorites))
+      self.assertTrue(report["runs"][-1]["idle"])
+
+
+if __name__ == "__main__":
+   unittest.main()
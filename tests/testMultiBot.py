@@ -0,0 +1,74 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+''' MultiBot's loop, with the wait between runs turned off. '''
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from botDaemon import stopRequested
+from FakeTwitter import FakeServer
+from FakeTwitter import FakeTwitter
+from FakeTwitter import MakeBotDir
+
+import MultiBot
+
+
+class TestMultiBot(unittest.TestCase):
+   def setUp(self):
+      self.workDir = tempfile.mkdtemp(prefix="multibot")
+      self.fake = FakeTwitter(seed=1)
+      self.server = FakeServer(self.fake, 0)
+      self.server.Start()
+      self.botDir = os.path.join(self.workDir, "bot")
+      MakeBotDir(self.botDir, self.server, 20, random.Random(1))
+      self.runInterval = MultiBot.kRunInterval
+      MultiBot.kRunInterval = 0
+
+   def tearDown(self):
+      MultiBot.kRunInterval = self.runInterval
+      self.server.Stop()
+      shutil.rmtree(self.workDir)
+
+   def testForceOnlyOnce(self):
+      multi = MultiBot.MultiBot([self.botDir], workers=1, force=True)
+      forced = []
+      runAll = multi.RunAll
+
+      def RunAll():
+         forced.append([bot.force for bot in multi.bots])
+         runAll()
+         if len(forced) == 3:
+            stopRequested.set()
+
+      multi.RunAll = RunAll
+      multi.Run()
+      self.assertEqual([[True], [False], [False]], forced)
+      # one forced tweet; the others were up to tweetProbability & spacing.
+      self.assertEqual(1, self.fake.Stats()["Update"])
+
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,96 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+''' TmBot's sending, bookkeeping & stats against FakeTwitter.py. '''
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from cooldown import HistoryKey
+from FakeTwitter import FakeServer
+from FakeTwitter import FakeTwitter
+from FakeTwitter import MakeBot
+from FakeTwitter import MakeBotDir
+
+
+class BotTestCase(unittest.TestCase):
+   ''' a bot with a small corpus in a temporary directory, talking to FakeTwitter. '''
+   def setUp(self):
+      self.workDir = tempfile.mkdtemp(prefix="tmbot")
+      self.fake = FakeTwitter(seed=1)
+      self.server = FakeServer(self.fake, 0)
+      self.server.Start()
+      self.botDir = os.path.join(self.workDir, "bot")
+      MakeBotDir(self.botDir, self.server, 20, random.Random(1))
+
+   def tearDown(self):
+      self.server.Stop()
+      shutil.rmtree(self.workDir)
+
+
+class TestSendTweets(BotTestCase):
+   def Send(self, status):
+      ''' queue a tweet of status and send it; returns the bot. '''
+      bot = MakeBot(self.botDir)
+      bot.QueueTweet("tweet", {"status": status}, "Album", "Track", "Tweet", [status])
+      bot.SendTweets()
+      return bot
+
+   def testSent(self):
+      bot = self.Send("first")
+      self.assertEqual([], bot.GetOutbox().Pending())
+      self.assertTrue(bot.history[HistoryKey("Album", "Track")])
+      self.assertTrue(bot.settings.lastUpdate)
+      self.assertIn("first", self.fake.statuses)
+
+   def testDuplicateCountsAsSent(self):
+      # an earlier attempt got through, but we never heard back.
+      self.fake.statuses.add("again")
+      bot = self.Send("again")
+      self.assertEqual([], bot.GetOutbox().Pending())
+      self.assertTrue(bot.history[HistoryKey("Album", "Track")])
+      self.assertTrue(bot.settings.lastUpdate)
+      counters = bot.stats.AsDict()["counters"]
+      self.assertEqual(1, counters['tweets_duplicate{kind="tweet"}'])
+
+
+class TestStats(BotTestCase):
+   def testPrometheus(self):
+      self.fake.AddMentions(5, 0)
+      bot = MakeBot(self.botDir)
+      bot.settings.statsFilePath = "stats.prom"
+      bot.settings.lastMentionPoll = 0
+      bot.Run()
+      with open(os.path.join(self.botDir, "stats.prom"), "rt") as f:
+         lines = f.read().splitlines()
+      # Flush's own time is in there, even though it's what writes the file.
+      self.assertTrue([l for l in lines if l.startswith('tmbotg_phase_seconds{phase="Flush"}')])
+      self.assertIn("# TYPE tmbotg_api_calls_total counter", lines)
+      self.assertIn("# TYPE tmbotg_bytes_written gauge", lines)
+      self.assertFalse([l for l in lines if l.startswith("tmbotg_api_calls{")])
+
+
+if __name__ == "__main__":
+   unittest.main()
@@ -25,20 +25,35 @@
 from datetime import datetime
 from datetime import date
 from glob import glob
+from math import exp
 from pprint import pprint
 from random import choice
 from random import random
+from random import randrange
 from time import time
-from twython import Twython
-from twython import TwythonStreamer
-from twython.exceptions import TwythonError
 
+# NOTE: twython (and everything that imports it -- apiClient and botStreamer),
+# and the modules that only some runs need (the daemon, the search index and
+# the SQLite queues) are only imported once we know that we need them. Most
+# cron runs find that they're idle (see botTick.py) and exit before then.
 
 import os.path
+import sys
 
 from jsonSettings import JsonSettings as Settings
 import jsonSettings
 
+from lyricIndex import FitRun
+from lyricIndex import ParseFilename
+import lyricIndex
+
+from cooldown import CooldownIndex
+from cooldown import HistoryKey
+from eventLog import EventLog
+from workPool import WorkPool
+from botStats import RunStats
+import botTick
+
 
 # if we're started without a config file, we create a default/empty
 # file that the user can fill in and then restart the app.
@@ -48,12 +63,33 @@ kDefaultConfigDict = {
    "accessToken"        : "!!! your access token",
    "accessTokenSecret"  : "!!! your access token secret",
    "lyricFilePath"      : "*.lyric",
+   "lyricIndexPath"     : "lyrics.idx",
    "tweetProbability"   : 24.0 / 1440,
    "minimumSpacing"     : 60*60,
    "minimumDaySpacing"  : 30,
    "logFilePath"        : "%Y-%m.txt"
 }
 
+# how many mentions to ask for at a time, and the most pages of them we'll
+# read in one run (the API won't go back further than 800 mentions anyway.)
+kMentionPageSize = 200
+kMaxMentionPages = 5
+
+# how many queued quote events we handle at a time.
+kQuoteBatchSize = 100
+
+# the shortest & longest time (seconds) between checks for new mentions. We
+# check often while people are talking to us and back off when it's quiet (see
+# AdaptMentionPoll()), and 'minimumMentionPoll' / 'maximumMentionPoll' in the
+# config file override these.
+kMinMentionPoll = 60
+kMaxMentionPoll = 15 * 60
+
+# how long (seconds) it takes the average mention rate to mostly forget what it
+# saw, and how much longer each quiet check can make the wait before the next.
+kMentionRateWindow = 60 * 60
+kMentionPollBackoff = 2
+
 kSettingsFileErrorMsg = '''\
 There was no settings file found at {0}, so I just created an empty/default
 file for you. Please edit it, adding the correct/desired values for each
@@ -71,71 +107,58 @@ class LyricsFileError(Exception):
       return self.msg
 
 
-class BotStreamer(TwythonStreamer):
-
-   def SetOutputPath(self, path):
-      self.path = path
-
-   def on_success(self, data):
-      # for now, all we're interested in handling are quoted tweets.
-      if 'event' in data:
-         if data['event'] == 'quoted_tweet':
-            # get the id of the tweet that quotes us:
-            tweetId = data['target_object']['id_str']
-            # create a file that the other (periodic) cron-job bot process will handle.
-            # As very rudimentary IPC, we use the id of the tweet that quotes us as
-            # a filename. If we want to do more using the streaming API, we might want to write
-            # more interesting data into the file to be parsed out later.
-            # Example -- we may want to extend the replies to questions so that we also
-            # reply to questions in quote tweets as well.
-            with open(os.path.join(self.path, "{0}.fav".format(tweetId)), "wt") as f:
-               f.write("{0}".format(tweetId))
-
-
-   def on_error(self, status_code, data):
-      print "ERROR: {0}".format(status_code)
-      self.disconnect()
-
-
-
-def ParseFilename(filePath):
-   ''' we name files like "Album-Title_Track-Title.lyric". This function breaks
-      a string in that format apart and returns a tuple ("Album-Title", "Track-Title")
-   '''
-   path, fileName = os.path.split(filePath)
-   base, ext = os.path.splitext(fileName)
-   return tuple(base.split("_"))
-
-
 def TrimTweetToFit(listOfStrings, maxLength):
    '''
       Given a list of strings (one string per line), trim that list (usually from
       the back, but occasionally from the front to keep things interesting) until
-      it's less than or equal to the maxLength parameter.
+      it's less than or equal to the maxLength parameter. Returns an empty string
+      if none of the lines are short enough to use.
    '''
-   length = 0
+   lineCum = [0]
+   shortestLine = []
    for line in listOfStrings:
-      length += len(line) + 1
-   length = length - 1
+      lineCum.append(lineCum[-1] + len(line) + 1)
+      shortestLine.append(min([len(line)] + shortestLine[-1:]))
 
-   if length <= maxLength:
-      return "\n".join(listOfStrings)
-   else:
-      if 1 == len(listOfStrings):
-         # we can't trim any more because there's only one line left. Give up.
-         return ""
-      else:
-         # decoding this next line: create a list that weights the probability of
-         # whether we trim lines from the end or the front (more frequently from the end)
-         popIndex = choice([-1] * 8 + [0] * 2)
-         listOfStrings.pop(popIndex)
-         return TrimTweetToFit(listOfStrings, maxLength)
+   run = FitRun(lineCum, shortestLine, 0, len(listOfStrings), maxLength)
+   if not run:
+      return ""
+   return "\n".join(listOfStrings[run[0]:run[1]])
 
 
 class NoLyricError(Exception):
    pass
 
 
+def AdaptMentionPoll(interval, rate, numMentions, elapsed, minimum, maximum):
+   '''
+      Given the number of seconds we waited before this check for mentions
+      (interval), the average mentions per hour before it (rate), and that this
+      check found numMentions new mentions in the 'elapsed' seconds since the
+      last one, returns (seconds to wait before the next check, new rate).
+
+      The rate is a moving average that weighs each check by how much time it
+      covers. Any new mention drops us to the minimum wait, so a conversation
+      gets answered quickly. A quiet check lets the wait grow (by at most
+      kMentionPollBackoff times) toward the time we'd expect to wait for the
+      next mention at the current rate, up to the maximum.
+   '''
+   if elapsed > 0:
+      weight = 1 - exp(-float(elapsed) / kMentionRateWindow)
+      rate += weight * (numMentions * 3600.0 / elapsed - rate)
+   if numMentions:
+      interval = minimum
+   else:
+      expected = 3600.0 / rate if rate > 0 else maximum
+      interval = min(interval * kMentionPollBackoff, expected)
+   return (int(max(minimum, min(maximum, interval))), rate)
+
+
+def IsDuplicateStatus(e):
+   ''' Twitter refuses to post the same status twice (error 187). '''
+   return 403 == getattr(e, "error_code", None) and "duplicate" in str(e).lower()
+
+
 
 
 class TmBot(object):
@@ -143,9 +166,17 @@ class TmBot(object):
       The class that actually runs the bot.
    '''
 
-   def __init__(self, argDict=None):
+   def __init__(self, argDict=None, indexCache=None):
+      '''
+         argDict: the command line arguments (see the bottom of this file)
+         indexCache: if several bots are running in the same process, an
+            IndexCache that they can all get their lyric index from.
+      '''
       if not argDict:
-         argDict = { 'debug' : False, "force": False, 'stream': False, 'botPath' : "."}
+         argDict = { 'debug' : False, "force": False, 'stream': False,
+            'daemon': False, 'replay': None, 'botPath' : "."}
+      # if botTick already rolled the dice on tweeting this time, the roll.
+      self.tweetRoll = None
       # update this object's internal dict with the dict of args that was passed
       # in so we can access those values as attributes.
       self.__dict__.update(argDict)
@@ -153,16 +184,50 @@ class TmBot(object):
       # we build a list of dicts containing status (and whatever other args
       # we may need to pass to the update_status function as we exit, most
       # probably 'in_reply-to_status_id' when we're replying to someone.)
+      # In debug mode they're only printed; otherwise they go straight into
+      # the outbox (see QueueTweet())
       self.tweets = []
-
-      self.history = Settings(self.GetPath("tmbotg_history.json"))
+      self.outbox = None
+
+      # the compiled lyric index is opened the first time we need a lyric, along
+      # with the list of which of its songs are eligible to be used today.
+      self.index = None
+      self.indexCache = indexCache
+      self.cooldown = None
+      self.search = None
+      self.eventLog = None
+      self.eventQueue = None
+      # timings & counters for this run (see botStats.py)
+      self.stats = RunStats()
+
+      # the history gains a key for every song we ever post, so we only append
+      # the keys that change instead of rewriting the whole file every time.
+      self.history = Settings(self.GetPath("tmbotg_history.json"), journal=True)
       self.settings = Settings(self.GetPath("tmbotg.json"), kDefaultConfigDict)
       s = self.settings
       if self.stream:
-         self.twitter = BotStreamer(s.appKey, s.appSecret, s.accessToken, s.accessTokenSecret)
-         self.twitter.SetOutputPath(self.botPath)
+         from botStreamer import BotStreamer
+         from botStreamer import kStreamStallTimeout
+         self.twitter = BotStreamer(s.appKey, s.appSecret, s.accessToken,
+            s.accessTokenSecret, timeout=kStreamStallTimeout)
+         if s.streamUrl:
+            # e.g. a local stand-in for the user stream while testing.
+            self.twitter.userUrl = s.streamUrl
+         self.twitter.Start(self.GetPath(self.GetEventQueuePath()))
       else:
-         self.twitter = Twython(s.appKey, s.appSecret, s.accessToken, s.accessTokenSecret)
+         from apiClient import RateLimitedClient
+         # all of our REST calls go through this so we respect the rate limits.
+         self.api = RateLimitedClient(self.NewTwitter, self.settings, stats=self.stats)
+
+   def NewTwitter(self):
+      ''' a new Twython object for making REST calls with. '''
+      from twython import Twython
+      s = self.settings
+      twitter = Twython(s.appKey, s.appSecret, s.accessToken, s.accessTokenSecret)
+      if s.apiUrl:
+         # e.g. a local stand-in for the API while testing.
+         twitter.api_url = s.apiUrl
+      return twitter
 
    def GetPath(self, path):
       '''
@@ -186,62 +251,155 @@ class TmBot(object):
          that's stored in the settings file is passed through datetime.strftime()
          so we can expand any format codes found there against the current date/time
          and create e.g. a monthly log file.
+
+         Entries are buffered (see eventLog.py) and written out when we Flush().
+         If the settings contain a 'jsonLogFilePath', each entry is also written
+         as a line of json to that file.
       '''
-      now = int(time())
-      today = datetime.fromtimestamp(now)
-      fileName = self.settings.logFilePath
-      if not fileName:
-         fileName = "%Y-%m.txt"
-         self.settings.logFilePath = fileName
-      path = self.GetPath(fileName)
-      path = today.strftime(path)
-      with open(path, "a+t") as f:
-         f.write("{0}\t{1}\t".format(now, eventType))
-         f.write("\t".join(dataList))
-         f.write("\n")
+      if self.eventLog is None:
+         fileName = self.settings.logFilePath
+         if not fileName:
+            fileName = "%Y-%m.txt"
+            self.settings.logFilePath = fileName
+         jsonFileName = self.settings.jsonLogFilePath
+         if jsonFileName:
+            jsonFileName = self.GetPath(jsonFileName)
+         self.eventLog = EventLog(self.GetPath(fileName), jsonFileName)
+      self.eventLog.Log(eventType, dataList)
+
+   def GetOutbox(self):
+      if self.outbox is None:
+         outboxPath = self.settings.outboxPath
+         if not outboxPath:
+            outboxPath = "tmbotg_outbox.db"
+            self.settings.outboxPath = outboxPath
+         from outbox import Outbox
+         self.outbox = Outbox(self.GetPath(outboxPath))
+      return self.outbox
+
+   def QueueTweet(self, kind, args, album, track, logEvent, logData):
+      ''' Save a status update to be sent by SendTweets().
+         kind: 'tweet' or 'reply'
+         args: the arguments for update_status()
+         album, track: the song it's from; it only goes into the history once
+            it's actually been posted.
+         logEvent, logData: the log entry to write once it's been posted.
+      '''
+      if self.debug:
+         self.tweets.append((kind, args, album, track, logEvent, logData))
+      else:
+         self.GetOutbox().Add(kind, args, album, track, logEvent, logData)
+
+   def PostTweet(self, entry, results):
+      ''' runs on a worker thread; the outbox is only updated from the main
+         thread, once all of the sends are done.
+      '''
+      from apiClient import DeferredCall
+      from twython.exceptions import TwythonError
+      try:
+         self.api.update_status(**entry.args)
+         results.append((entry, None))
+      except (DeferredCall, TwythonError) as e:
+         results.append((entry, e))
 
    def SendTweets(self):
-      ''' send each of the status updates that are collected in self.tweets
+      ''' send everything that's waiting in the outbox (after first retrying
+         any calls that we had to put off until later.) Replies don't depend on
+         each other, so they're sent from a pool of worker threads.
+
+         Only once Twitter accepts a tweet do we count it as posted: that's when
+         we set lastUpdate, add its song to the history and log it. Anything
+         that can't be sent right now stays in the outbox for next time, except
+         for errors that will never go away. A duplicate status means an
+         earlier attempt at this entry did get through (we just never heard
+         back), so that's counted as posted too.
       '''
-      for msg in self.tweets:
-         if self.debug:
-            print msg['status'].encode("UTF-8")
+      if self.debug:
+         for kind, args, album, track, logEvent, logData in self.tweets:
+            print args['status'].encode("UTF-8")
+            self.Posted(kind, album, track, logEvent, logData)
+         # in daemon mode we're going to be called again, so don't resend these.
+         self.tweets = []
+         return
+
+      from apiClient import DeferredCall
+      for endpoint, kwargs, e in self.api.RunDeferred():
+         self.Log("EXCEPTION", [str(e), endpoint])
+      outbox = self.GetOutbox()
+      entries = outbox.Pending()
+      if not entries:
+         return
+      workers = self.settings.sendWorkers
+      if not workers:
+         workers = 4
+         self.settings.sendWorkers = workers
+      results = []
+      pool = WorkPool(min(workers, len(entries)))
+      try:
+         for entry in entries:
+            pool.Submit(self.PostTweet, entry, results)
+         pool.Wait()
+      finally:
+         pool.Close()
+
+      for entry, e in results:
+         if e is None or IsDuplicateStatus(e):
+            if e is not None:
+               self.stats.Count("tweets_duplicate", kind=entry.kind)
+               self.Log("Duplicate", [str(e), entry.args['status'].encode("UTF-8")])
+            outbox.Sent(entry.id)
+            self.stats.Count("tweets_sent", kind=entry.kind)
+            self.Posted(entry.kind, entry.album, entry.track, entry.logEvent,
+               [d.encode("utf-8") for d in entry.logData])
+         elif isinstance(e, DeferredCall):
+            self.stats.Count("tweets_deferred", kind=entry.kind)
+            if not outbox.Retry(entry.id, str(e)):
+               self.Log("SendFailed", [str(e), entry.args['status'].encode("UTF-8")])
+            else:
+               self.Log("Deferred", [str(e)])
          else:
-            try:
-               self.twitter.update_status(**msg)
-            except TwythonError, e:
-               Log("EXCEPTION", [str(e), msg['status'].encode("UTF-8")])
+            # the API said no, and asking again won't change its mind.
+            self.stats.Count("tweets_failed", kind=entry.kind)
+            outbox.Failed(entry.id, str(e))
+            self.Log("EXCEPTION", [str(e), entry.args['status'].encode("UTF-8")])
 
 
-   def CheckDaySpacing(self, album, title):
-      ''' There are a few tunes that seem to come up *way* too often. We'll maintain
-         a new history file that just tracks the last time that any given (album, track) tuple
-         is used (and maybe this should just be title?). If we're okay to use this song, return
-         true.
+   def Posted(self, kind, album, track, logEvent, logData):
+      ''' the bookkeeping for a status that's been posted (or printed, in
+         debug mode): when we last tweeted, the song's history and the log.
       '''
-      key = "{0}_{1}".format(album, title)
-      retval = True
-      lastUsed = self.history[key]
-      if lastUsed:
-         minimumSpace = self.settings.minimumDaySpacing
-         if not minimumSpace:
-            minimumSpace = 30
-            self.settings.minimumDaySpacing = minimumSpace
-         today = date.today()
-         last = date.fromordinal(lastUsed)
-         # how many days has it been since we last tweeted this album/track?
-         daysAgo = (today - last).days
-         retval =  daysAgo > minimumSpace
-         if not retval:
-            self.Log("TooSoon", [album, title, "used {0} days ago".format(daysAgo)])
-      return retval
+      if 'tweet' == kind:
+         self.settings.lastUpdate = int(time())
+      if album:
+         self.LogHistory(album, track)
+      if logEvent:
+         self.Log(logEvent, logData)
 
+   def GetMinimumDaySpacing(self):
+      minimumSpace = self.settings.minimumDaySpacing
+      if not minimumSpace:
+         minimumSpace = 30
+         self.settings.minimumDaySpacing = minimumSpace
+      return minimumSpace
 
    def LogHistory(self, album, title):
       today = date.today()
-      key = "{0}_{1}".format(album, title)
+      key = HistoryKey(album, title)
       self.history[key] = today.toordinal()
 
+   def GetCooldown(self):
+      ''' Return the index of which songs have rested long enough since we last
+         used them (minimumDaySpacing days) to be used again.
+      '''
+      if self.cooldown is None:
+         self.cooldown = CooldownIndex(self.GetIndex(), self.history,
+            self.GetMinimumDaySpacing())
+      return self.cooldown
+
+   def EligibleCount(self):
+      ''' returns a tuple (songs we could use now, total number of songs) '''
+      return (self.GetCooldown().Count(), self.GetIndex().numTracks)
+
    def CreateUpdate(self):
       '''
          Called everytime the bot is Run().
@@ -253,7 +411,6 @@ class TmBot(object):
          posting an update too frequently. Starting at an hour ()
 
       '''
-      doUpdate = False
       last = self.settings.lastUpdate or 0
       now = int(time())
       lastTweetAge = now - last
@@ -264,23 +421,23 @@ class TmBot(object):
          maxSpace = 4 * 60 * 60
          self.settings.maximumSpacing = maxSpace
 
-      if lastTweetAge > maxSpace:
-         # been too long since the last tweet. Make a new one for our fans!
-         doUpdate = True
+      # Make sure that we're not tweeting too frequently. Default is to enforce
+      # a 1-hour gap between tweets (configurable using the 'minimumSpacing' key
+      # in the config file, providing a number of seconds we must remain silent.)
+      requiredSpace = self.settings.minimumSpacing
+      if not requiredSpace:
+         # no entry in the file -- let's create one. Default = 1 hour.
+         requiredSpace = 60*60
+         self.settings.minimumSpacing = requiredSpace
 
-      elif random() < self.settings.tweetProbability:
-         # Make sure that we're not tweeting too frequently. Default is to enforce
-         # a 1-hour gap between tweets (configurable using the 'minimumSpacing' key
-         # in the config file, providing a number of minutes we must remain silent.)
-         requiredSpace = self.settings.minimumSpacing
-         if not requiredSpace:
-            # no entry in the file -- let's create one. Default = 1 hour.
-            requiredSpace = 60*60
-            self.settings.minimumSpacing = requiredSpace
+      # if it's been too long since the last tweet, make a new one for our fans!
+      # Otherwise, roll the dice (see botTick.ShouldTweet())
+      doUpdate = botTick.ShouldTweet(lastTweetAge, self.RollForTweet(),
+         self.settings.tweetProbability, requiredSpace, maxSpace)
 
-         if lastTweetAge > requiredSpace:
-            # Our last tweet was a while ago, let's make another one.
-            doUpdate = True
+      if doUpdate and not self.debug and self.GetOutbox().Pending('tweet'):
+         # the last one hasn't gone out yet; don't pile another one up behind it.
+         doUpdate = False
 
       if doUpdate or self.force:
          try:
@@ -288,75 +445,224 @@ class TmBot(object):
             # paragraph-length.. (these values arbitrarily chosen)
             maxLen = choice([210, 120, 120, 120, 120, 100, 100, 100, 80, 80, 40])
             album, track, msg = self.GetLyric(maxLen)
-            self.tweets.append({'status' : msg})
-            self.settings.lastUpdate = int(time())
-            # we'll log album name, track name, number of lines, number of characters
-            self.Log("Tweet", [album, track, str(1 + msg.count("\n")), str(len(msg))])
+            # once it's posted, we'll log album name, track name, number of
+            # lines, number of characters
+            self.QueueTweet('tweet', {'status' : msg}, album, track, "Tweet",
+               [album, track, str(1 + msg.count("\n")), str(len(msg))])
          except NoLyricError:
             self.Log("NoLyric", [])
             pass
 
+   def RollForTweet(self):
+      ''' the random number that decides whether we tweet this time (the one
+         that botTick already rolled, if it did.)
+      '''
+      roll = self.tweetRoll
+      self.tweetRoll = None
+      if roll is None:
+         roll = random()
+      return roll
+
+   def GetMentionPollBounds(self):
+      minimum = self.settings.minimumMentionPoll
+      if not minimum:
+         minimum = kMinMentionPoll
+         self.settings.minimumMentionPoll = minimum
+      maximum = self.settings.maximumMentionPoll
+      if not maximum:
+         maximum = kMaxMentionPoll
+         self.settings.maximumMentionPoll = maximum
+      return (minimum, maximum)
+
+   def GetMentionPollInterval(self):
+      ''' how long (seconds) to wait after the last check for mentions before
+         the next one. This changes with how busy we are (see UpdateMentionPoll())
+      '''
+      interval = self.settings.mentionPollInterval
+      if interval is None:
+         interval = self.GetMentionPollBounds()[0]
+         self.settings.mentionPollInterval = interval
+      return interval
+
+   def NextMentionPoll(self):
+      return (self.settings.lastMentionPoll or 0) + self.GetMentionPollInterval()
+
+   def UpdateMentionPoll(self, numMentions, lastPoll, now):
+      ''' we just found numMentions new mentions in the time since lastPoll;
+         work out how long to wait before the next check.
+      '''
+      minimum, maximum = self.GetMentionPollBounds()
+      elapsed = now - lastPoll if lastPoll else 0
+      interval, rate = AdaptMentionPoll(self.GetMentionPollInterval(),
+         self.settings.mentionRate or 0.0, numMentions, elapsed, minimum, maximum)
+      self.settings.mentionPollInterval = interval
+      self.settings.mentionRate = round(rate, 4)
+      self.stats.Set("mention_poll_seconds", interval)
+      self.stats.Set("mentions_per_hour", rate)
+
+   def GetMentions(self):
+      '''
+         Page back through all of the tweets that mention us since lastMentionId
+         (using max_id to ask for the page older than the last one we got.)
+         Returns a list of pages, newest first, with the newest tweet first in
+         each page.
+      '''
+      pages = []
+      args = {'count': kMentionPageSize}
+      if self.settings.lastMentionId:
+         args['since_id'] = self.settings.lastMentionId
+      for i in range(kMaxMentionPages):
+         page = self.api.get_mentions_timeline(**args)
+         if not page:
+            break
+         pages.append(page)
+         args['max_id'] = str(int(page[-1]['id_str']) - 1)
+      return pages
+
+   def Favorite(self, tweetId):
+      from apiClient import DeferredCall
+      from twython.exceptions import TwythonError
+      try:
+         self.api.create_favorite(id=tweetId)
+      except DeferredCall as e:
+         self.Log("Deferred", [str(e)])
+      except TwythonError as e:
+         self.Log("EXCEPTION", [str(e), tweetId])
+
    def HandleMentions(self):
       '''
          Get all the tweets that mention us since the last time we ran and process each
          one.
          Any time we're mentioned in someone's tweet, we favorite it. If they ask
          us a question, we reply to them.
-      '''
-      mentions = self.twitter.get_mentions_timeline(since_id=self.settings.lastMentionId)
-      if mentions:
-         # Remember the most recent tweet id, which will be the one at index zero.
-         self.settings.lastMentionId = mentions[0]['id_str']
-         for mention in mentions:
-            who = mention['user']['screen_name']
-            text = mention['text']
-            theId = mention['id_str']
-
-            # we favorite every mention that we see
-            if self.debug:
-               print "Faving tweet {0} by {1}:\n {2}".format(theId, who, text.encode("utf-8"))
-            else:
-               try:
-                  self.twitter.create_favorite(id=theId)
-               except TwythonError, e:
-                  Log("EXCEPTION", [str(e), msg['status'].encode("UTF-8")])
-
-
-            eventType = 'Mention'
-            # if they asked us a question, reply to them.
-            if "?" in text:
-               # create a reply to them.
-               maxReplyLen = 120 - len(who)
-               album, track, msg = self.GetLyric(maxReplyLen)
-               # get just the first line
-               msg = msg.split('\n')[0]
-               # In order to post a reply, you need to be sure to include their username
-               # in the body of the tweet.
-               replyMsg = "@{0} {1}".format(who, msg)
-               self.tweets.append({'status': replyMsg, "in_reply_to_status_id" : theId})
-               eventType = "Reply"
-
-            self.Log(eventType, [who])
 
+         We work through the pages of mentions oldest first. The favorites for a
+         page are sent from a pool of worker threads while we build the replies,
+         and we only move lastMentionId forward once a page is completely done,
+         so if something goes wrong we'll pick up from there next time.
 
+         We only check for mentions every 'mentionPollInterval' seconds, which
+         gets shorter while people are mentioning us & longer when they aren't.
+      '''
+      from apiClient import DeferredCall
+      now = int(time())
+      if now < self.NextMentionPoll() - botTick.kTickSlack:
+         return
+      lastPoll = self.settings.lastMentionPoll
+      self.settings.lastMentionPoll = now
+      # (the first time, we don't know how long the mentions we get have been
+      # piling up, so they don't count toward the rate.)
+      firstPoll = not self.settings.lastMentionId
+      try:
+         pages = self.GetMentions()
+      except DeferredCall as e:
+         # lastMentionId hasn't moved, so we'll get all of these next time.
+         self.Log("Deferred", [str(e)])
+         return
+      if not firstPoll:
+         self.UpdateMentionPoll(sum(len(page) for page in pages), lastPoll, now)
+      if not pages:
+         return
+      workers = self.settings.favoriteWorkers
+      if not workers:
+         workers = 4
+         self.settings.favoriteWorkers = workers
+      pool = None
+      if not self.debug:
+         pool = WorkPool(workers)
+      try:
+         for page in reversed(pages):
+            questions = []
+            for mention in reversed(page):
+               who = mention['user']['screen_name']
+               text = mention['text']
+               theId = mention['id_str']
+
+               self.stats.Count("mentions")
+               # we favorite every mention that we see
+               if self.debug:
+                  print "Faving tweet {0} by {1}:\n {2}".format(theId, who, text.encode("utf-8"))
+               else:
+                  pool.Submit(self.Favorite, theId)
+
+               # if they asked us a question, reply to them.
+               if "?" in text:
+                  questions.append(mention)
+               else:
+                  self.Log('Mention', [who])
+
+            self.ReplyToQuestions(questions)
+            if pool:
+               pool.Wait()
+            # Remember the most recent tweet id, which will be the one at index zero.
+            self.settings.lastMentionId = page[0]['id_str']
+      finally:
+         if pool:
+            pool.Close()
+
+   def ReplyToQuestions(self, mentions):
+      ''' create a reply to each of these mentions. '''
+      for mention in mentions:
+         who = mention['user']['screen_name']
+         maxReplyLen = 120 - len(who)
+         try:
+            album, track, msg = self.GetReplyLine(maxReplyLen, mention['text'])
+         except NoLyricError:
+            # don't let one missing reply stop us from answering everyone else.
+            self.Log("NoLyric", [who])
+            continue
+         # In order to post a reply, you need to be sure to include their username
+         # in the body of the tweet.
+         replyMsg = u"@{0} {1}".format(who, msg)
+         self.QueueTweet('reply', {'status': replyMsg,
+            "in_reply_to_status_id" : mention['id_str']}, album, track, "Reply", [who])
+
+   def GetEventQueuePath(self):
+      queuePath = self.settings.eventQueuePath
+      if not queuePath:
+         queuePath = "tmbotg_events.db"
+         self.settings.eventQueuePath = queuePath
+      return queuePath
+
+   def GetEventQueue(self):
+      ''' the queue of events that the streaming bot wants us to handle. '''
+      if self.eventQueue is None:
+         from eventQueue import EventQueue
+         self.eventQueue = EventQueue(self.GetPath(self.GetEventQueuePath()))
+      return self.eventQueue
+
+   def ImportFavFiles(self, queue):
+      ''' Older versions of the streaming bot left a <tweet id>.fav file for each
+         quoted tweet; move any of those that are still around into the queue.
+      '''
+      faves = glob(self.GetPath("*.fav"))
+      if faves:
+         events = []
+         for fileName in faves:
+            with open(fileName, "rt") as f:
+               events.append(("quoted_tweet", f.readline().strip(), None))
+         queue.EnqueueMany(events)
+         for fileName in faves:
+            os.remove(fileName)
 
    def HandleQuotes(self):
       ''' The streaming version of the bot may have detected some quoted tweets
-         that we want to respond to. Look for files with the .fav extension, and
-         if we find any, handle them.
+         that we want to respond to. Work through the queue of them a batch at a
+         time, and only remove each batch from the queue once it's been handled.
       '''
-      faves = glob(self.GetPath("*.fav"))
-      for fileName in faves:
-         with open(fileName, "rt") as f:
-            tweetId = f.readline().strip()
+      queue = self.GetEventQueue()
+      self.ImportFavFiles(queue)
+      while True:
+         events = queue.Dequeue(kQuoteBatchSize)
+         if not events:
+            break
+         for eventId, kind, tweetId, payload in events:
+            self.stats.Count("quotes")
             if self.debug:
                print "Faving quoted tweet {0}".format(tweetId)
             else:
-               try:
-                  self.twitter.create_favorite(id=tweetId)
-               except TwythonError as e:
-                  self.Log("EXCEPTION", str(e))
-         os.remove(fileName)
+               self.Favorite(tweetId)
+         queue.Ack([event[0] for event in events])
 
 
    def Run(self):
@@ -364,28 +670,172 @@ class TmBot(object):
          if self.debug:
             print "About to stream from user account."
          try:
-            # The call to user() will sit forever waiting for events on
-            # our user account to stream down. Those events will be handled
-            # for us by the BotStreamer object that we created ab
-            self.twitter.user()
+            if self.replay:
+               with open(self.replay, "rt") as f:
+                  self.twitter.Replay(f)
+            else:
+               # The call to Stream() will sit forever waiting for events on
+               # our user account to stream down. Those events will be handled
+               # for us by the BotStreamer object that we created ab
+               self.twitter.Stream()
          except KeyboardInterrupt:
             # disconnect cleanly from the server.
             self.twitter.disconnect()
+         finally:
+            self.twitter.Stop()
+            if self.debug:
+               print self.twitter.Stats()
+      elif self.daemon:
+         # stay alive, running each of the steps below on its own timer.
+         from botDaemon import BotDaemon
+         BotDaemon(self).Run()
       else:
-         self.CreateUpdate()
-         self.HandleMentions()
-         self.HandleQuotes()
-         self.SendTweets()
-
-         # if anything we dpsid changed the settings, make sure those changes get written out.
+         from twython.exceptions import TwythonError
+         try:
+            for phase in (self.CreateUpdate, self.HandleMentions, self.HandleQuotes,
+               self.SendTweets):
+               with self.stats.Phase(phase.__name__):
+                  try:
+                     phase()
+                  except TwythonError as e:
+                     # one API call that failed for good shouldn't cost us the
+                     # rest of the run.
+                     self.Log("EXCEPTION", [phase.__name__, str(e)])
+         finally:
+            # whatever happens, write out the settings and everything that
+            # we've logged so far.
+            self.Flush()
+
+   def Flush(self):
+      ''' if anything we did changed the settings, make sure those changes get written out.
+         The stats are written last, outside of the Flush phase, so that they
+         include how long the rest of this took.
+      '''
+      with self.stats.Phase("Flush"):
          self.settings.lastExecuted = str(datetime.now())
-         self.settings.Write()
-         self.history.Write()
-
+         with self.stats.Phase("Write"):
+            self.settings.Write()
+            self.history.Write()
+            if self.eventLog:
+               self.eventLog.Flush()
+         self.WriteTick()
+         # a long-running bot needs to notice when GetLyrics has fetched new lyrics.
+         if self.index is not None:
+            if lyricIndex.IsStale(self.GetPath(self.settings.lyricIndexPath),
+               self.GetPath(self.settings.lyricFilePath)):
+               if not self.indexCache:
+                  # (other bots may still be using a shared one.)
+                  self.index.Close()
+               self.index = None
+               self.cooldown = None
+               self.search = None
+      self.WriteStats()
+
+
+   def WriteTick(self):
+      ''' save what the next cron run needs to decide whether it has anything
+         to do (see botTick.py)
+      '''
+      if self.stream:
+         return
+      s = self.settings
+      queue = self.GetEventQueue()
+      queuePath = self.GetPath(self.GetEventQueuePath())
+      tick = {
+         "lastUpdate": s.lastUpdate or 0,
+         "tweetProbability": s.tweetProbability,
+         "minimumSpacing": s.minimumSpacing or 60*60,
+         "maximumSpacing": s.maximumSpacing or 4*60*60,
+         "nextMentionPoll": self.NextMentionPoll(),
+         "eventQueuePath": os.path.abspath(queuePath),
+         "eventQueueEmpty": queue.IsEmpty(),
+         "eventQueueChanged": botTick.QueueChanged(queuePath),
+         "outboxPending": bool(self.outbox and self.outbox.Pending()),
+         "deferredCalls": bool(s.deferredCalls),
+      }
+      botTick.WriteTick(self.GetPath(botTick.kTickFile), tick)
+
+   def WriteStats(self):
+      ''' if the settings contain a 'statsFilePath', write our timings and
+         counters there (as json, or for Prometheus if the name ends in '.prom')
+      '''
+      statsFile = self.settings.statsFilePath
+      if statsFile:
+         self.stats.Set("bytes_written", self.settings.BytesWritten(), file="settings")
+         self.stats.Set("bytes_written", self.history.BytesWritten(), file="history")
+         if self.eventLog:
+            self.stats.Set("bytes_written", self.eventLog.BytesWritten(), file="log")
+         self.stats.Write(self.GetPath(statsFile))
+
+   def GetSearch(self):
+      ''' Return the search index of all our lyric lines, (re)building it
+         first if it's missing or the lyric files have changed.
+      '''
+      if self.search is None:
+         import lyricSearch
+         searchPath = self.settings.lyricSearchPath
+         if not searchPath:
+            searchPath = "lyrics.search"
+            self.settings.lyricSearchPath = searchPath
+         searchPath = self.GetPath(searchPath)
+         filePattern = self.GetPath(self.settings.lyricFilePath)
+         if self.indexCache:
+            self.search = self.indexCache.OpenSearch(searchPath, filePattern)
+         else:
+            self.search = lyricSearch.Open(searchPath, filePattern)
+      return self.search
+
+   def GetReplyLine(self, maxLen, question=None):
+      ''' pick a single line (from a song that we're allowed to use today)
+         that's no longer than maxLen to reply to a question with. If we can,
+         we use the line that best matches the words in the question;
+         otherwise it's a random line. Returns a tuple (album, track, line).
+      '''
+      index = self.GetIndex()
+      cooldown = self.GetCooldown()
+      if question:
+         cooldown.Release()
+         found = self.GetSearch().Search(question, maxLen, cooldown.IsEligible)
+         if found:
+            album, track, line = found
+            self.stats.Count("reply_matches")
+            cooldown.MarkUsed(cooldown.TrackId(album, track))
+            return found
+      tooSoon = cooldown.tooSoon
+      lineId = cooldown.ChooseLine(maxLen)
+      self.stats.Count("too_soon", cooldown.tooSoon - tooSoon)
+      if lineId is None:
+         self.stats.Count("no_lyric")
+         raise NoLyricError()
+      trackId = index.LineTrack(lineId)
+      album, track = index.Track(trackId)
+      cooldown.MarkUsed(trackId)
+      return (album, track, index.Line(lineId))
+
+   def GetIndex(self):
+      ''' Return the compiled index of all our lyric files, (re)building it first
+         if it's missing or the lyric files have changed since it was built.
+      '''
+      if self.index is None:
+         indexPath = self.settings.lyricIndexPath
+         if not indexPath:
+            indexPath = "lyrics.idx"
+            self.settings.lyricIndexPath = indexPath
+         indexPath = self.GetPath(indexPath)
+         filePattern = self.GetPath(self.settings.lyricFilePath)
+         if self.indexCache:
+            self.index = self.indexCache.Open(indexPath, filePattern)
+         else:
+            self.index = lyricIndex.Open(indexPath, filePattern)
+      if 0 == self.index.numTracks:
+         # there aren't any lyrics files to use -- tell them to  GetLyrics
+         raise LyricsFileError("Please run GetLyrics.py to fetch lyric data first.")
+      return self.index
 
    def GetLyric(self, maxLen, count=10):
-      ''' open a random lyric file, then grab a random stanza of lyrics from it,
-         then (if needed) trim it down into lines <= maxLen
+      ''' pick a random eligible track from the lyric index, then grab a random stanza of lyrics from it,
+         then (if needed) trim it down into lines <= maxLen. We only come up
+         empty if none of the lines in that stanza is short enough on its own.
          returns a tuple (album, track, stanza) (we may want to log the album/tracks
             that are being used...)
 
@@ -398,33 +848,37 @@ class TmBot(object):
          try again in a bit.
       '''
       if 0 == count:
+         self.stats.Count("no_lyric")
          raise NoLyricError()
 
-      files = glob(self.GetPath(self.settings.lyricFilePath))
-      if not files:
-         # there aren't any lyrics files to use -- tell them to  GetLyrics
-         raise LyricsFileError("Please run GetLyrics.py to fetch lyric data first.")
-
-      fName = choice(files)
-      album, track = ParseFilename(fName)
-      # Check to see if it's been long enough since we tweeted from this song:
-      if not self.CheckDaySpacing(album, track):
-         return self.GetLyric(maxLen, count-1)
-      stanza = ""
-      with open(fName, "rt") as f:
-         data = f.read().decode("utf-8")
-         stanzas = data.split("\n\n")
-         stanza = choice(stanzas).strip().split('\n')
-         stanza = TrimTweetToFit(stanza, maxLen)
+      index = self.GetIndex()
+      # only pick from songs that it's been long enough since we tweeted from.
+      cooldown = self.GetCooldown()
+      trackId = cooldown.Choose()
+      if trackId is None:
+         self.stats.Count("no_lyric")
+         raise NoLyricError()
+      album, track = index.Track(trackId)
+      stanzaId = randrange(*index.StanzaRange(trackId))
+      stanza = index.FitStanza(stanzaId, maxLen)
 
       if stanza:
-         self.LogHistory(album, track)
+         # (it only goes into the history once it's been posted.)
+         cooldown.MarkUsed(trackId)
          return (album, track, stanza)
       else:
+         self.stats.Count("lyric_retries")
          return self.GetLyric(maxLen, count-1)
 
 
 if __name__ == "__main__":
+   if 1 == len(sys.argv):
+      # a plain cron run -- see if there's anything to do before loading up.
+      botPath = os.path.split(__file__)[0]
+      idle, tweetRoll = botTick.CheckTick(botPath, os.path.join(botPath, "tmbotg.json"))
+      if idle:
+         sys.exit(0)
+
    import argparse
    parser = argparse.ArgumentParser()
    parser.add_argument("--debug", action='store_true',
@@ -434,6 +888,16 @@ if __name__ == "__main__":
 
    parser.add_argument("--stream", action="store_true",
       help="run in streaming mode")
+   parser.add_argument("--replay", default=None,
+      help="in streaming mode, read events from this file (one json event per line) instead of Twitter")
+   parser.add_argument("--daemon", action="store_true",
+      help="keep running instead of being started by cron every minute")
+   parser.add_argument("--profile", default=None,
+      help="run under cProfile and save the profile to this file")
+   parser.add_argument("--eligible", action="store_true",
+      help="print how many songs are eligible to be used right now and exit")
+   parser.add_argument("--botPath", default=None,
+      help="directory holding the bot's settings & data (default: where this file is)")
    args = parser.parse_args()
    # convert the object returned from parse_args() to a plain old dict
    argDict = vars(args)
@@ -441,13 +905,28 @@ if __name__ == "__main__":
 
    # Find the path where this source file is being loaded from -- we use
    # this when resolving relative paths (e.g., to the data/ directory)
-   botPath = os.path.split(__file__)[0]
+   botPath = args.botPath or os.path.split(__file__)[0]
    argDict['botPath'] = botPath
 
+   if 1 == len(sys.argv):
+      # (we already rolled the dice on tweeting above.)
+      argDict['tweetRoll'] = tweetRoll
+
+   bot = None
    try:
       bot = TmBot(argDict)
-      bot.Run()
+      if args.eligible:
+         print "{0} of {1} songs are eligible".format(*bot.EligibleCount())
+      elif args.profile:
+         import cProfile
+         profile = cProfile.Profile()
+         profile.runcall(bot.Run)
+         profile.dump_stats(args.profile)
+      else:
+         bot.Run()
    except (jsonSettings.SettingsFileError, LyricsFileError) as e:
-      # !!! TODO: Write this into a log file (also)
-      bot.Log("ERROR", [str(e)])
+      # if we couldn't even load the settings, there's no log file to write to.
+      if bot:
+         bot.Log("ERROR", [str(e)])
+         bot.eventLog.Flush()
       print str(e)
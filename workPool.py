@@ -0,0 +1,80 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   workPool.py -- a small pool of worker threads. Work items are just a
+   callable and its arguments, and a work item is free to Submit() more work
+   to the same pool (e.g., an album page submitting each of its tracks), so
+   Wait() blocks until everything -- including work added along the way --
+   is finished.
+'''
+
+from Queue import Queue
+
+import threading
+
+
+class WorkPool(object):
+   def __init__(self, numWorkers, errorHandler=None):
+      '''
+         numWorkers: how many threads to run work items on.
+         errorHandler: called with (func, args, exception) for any work item that
+            raises. By default we just print the exception.
+      '''
+      self._queue = Queue()
+      self._errorHandler = errorHandler or self.PrintError
+      self._threads = []
+      for i in range(max(1, numWorkers)):
+         t = threading.Thread(target=self._Worker)
+         t.daemon = True
+         t.start()
+         self._threads.append(t)
+
+   def PrintError(self, func, args, e):
+      print "{0}{1}: {2}".format(func.__name__, args, str(e))
+
+   def _Worker(self):
+      while True:
+         item = self._queue.get()
+         try:
+            if item is None:
+               return
+            func, args = item
+            try:
+               func(*args)
+            except Exception as e:
+               self._errorHandler(func, args, e)
+         finally:
+            self._queue.task_done()
+
+   def Submit(self, func, *args):
+      self._queue.put((func, args))
+
+   def Wait(self):
+      ''' block until every submitted work item has finished. '''
+      self._queue.join()
+
+   def Close(self):
+      ''' finish any outstanding work, then stop all of the worker threads. '''
+      for t in self._threads:
+         self._queue.put(None)
+      for t in self._threads:
+         t.join()
+      self._threads = []